@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Measure execute() throughput from several threads over one connection.
+
+Runs short commands against the local paramiko SSH server stand-in used
+by the tests, from 1, 2, 4 and 8 threads sharing one BaseInstance and
+so one SSH connection.
+
+Usage: PYTHONPATH=. python3 benchmarks/concurrent_execute.py
+           [--commands N] [--command CMD]
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pycloudlib.instance import BaseInstance
+from pycloudlib.key import KeyPair
+from pycloudlib.tests.helpers import InstanceSubclass
+from pycloudlib.tests.sshd import SSHServer
+
+
+def rate(instance, threads, commands, command):
+    """Return commands per second run from threads threads.
+
+    Args:
+        instance: BaseInstance to run the commands on
+        threads: number of threads calling execute()
+        commands: number of commands to run
+        command: command to run
+    """
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for result in executor.map(instance.execute, [command] * commands):
+            assert result.ok, result.stderr
+    return commands / (time.monotonic() - start)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--commands', type=int, default=200,
+                        help='commands per thread count')
+    parser.add_argument('--command', default='sleep 0.01',
+                        help='command to run')
+    args = parser.parse_args()
+    # The server logs the readiness probes hanging up as errors
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        server = SSHServer(key_dir)
+        instance = InstanceSubclass(
+            key_pair=KeyPair(server.client_key_path + '.pub', name='bench')
+        )
+        instance.ip = '127.0.0.1'
+        instance.port = str(server.port)
+        try:
+            # Connect before timing
+            instance.execute('true')
+            for threads in (1, 2, 4, 8):
+                print('%d threads  %6.1f commands/s' % (
+                    threads,
+                    rate(instance, threads, args.commands, args.command)
+                ))
+            assert 1 == server.connections
+        finally:
+            instance.__del__()
+            BaseInstance.ssh_connections.clear()
+            server.close()
+
+
+if __name__ == '__main__':
+    main()
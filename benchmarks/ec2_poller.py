@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Count DescribeInstances calls waiting for many EC2 instances.
+
+Waits for --instances instances, each pending for a random 3 to 8
+polls before running, once with a boto3 instance_running waiter per
+instance as EC2Instance.wait used to, and once through one shared
+StatePoller. A boto3 EC2 client answers from a script instead of AWS.
+
+Usage: PYTHONPATH=. python3 benchmarks/ec2_poller.py [--instances N]
+"""
+
+import argparse
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import boto3
+
+from pycloudlib.ec2.poller import StatePoller
+
+
+class ScriptedEC2:
+    """Answer DescribeInstances from scripted instance states.
+
+    Every call describing an instance moves it one poll closer to
+    running.
+    """
+
+    def __init__(self, polls):
+        """Script the instances.
+
+        Args:
+            polls: dictionary of instance id to number of polls it is
+                pending for
+        """
+        self.polls = dict(polls)
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.client = boto3.Session(
+            aws_access_key_id='bench', aws_secret_access_key='bench',
+            region_name='us-east-1'
+        ).client('ec2')
+
+    def api_call(self, operation, params):
+        """Answer one API call of the client."""
+        assert operation == 'DescribeInstances', operation
+        instances = []
+        with self._lock:
+            self.calls += 1
+            for instance_id in params['InstanceIds']:
+                pending = self.polls[instance_id]
+                self.polls[instance_id] = pending - 1
+                instances.append({
+                    'InstanceId': instance_id,
+                    'State': {'Name': 'pending' if pending else 'running'},
+                })
+        return {'Reservations': [{'Instances': instances}]}
+
+    def patch(self):
+        """Return a context manager answering the client's API calls."""
+        return mock.patch.object(
+            self.client, '_make_api_call', side_effect=self.api_call
+        )
+
+
+def waiters(script):
+    """Wait for all instances with one boto3 waiter each."""
+    def wait(instance_id):
+        script.client.get_waiter('instance_running').wait(
+            InstanceIds=[instance_id],
+            WaiterConfig={'Delay': 0.01, 'MaxAttempts': 100}
+        )
+
+    with script.patch(), ThreadPoolExecutor(
+            max_workers=len(script.polls)) as executor:
+        list(executor.map(wait, list(script.polls)))
+
+
+def poller(script):
+    """Wait for all instances through one StatePoller."""
+    states = StatePoller(script.client)
+    states.min_interval = 0.01
+    states.max_interval = 0.05
+
+    with script.patch(), ThreadPoolExecutor(
+            max_workers=len(script.polls)) as executor:
+        list(executor.map(
+            lambda instance_id: states.wait(instance_id, 'running'),
+            list(script.polls)
+        ))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--instances', type=int, default=100,
+                        help='instances to wait for')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    polls = {
+        'i-%017x' % number: rng.randint(3, 8)
+        for number in range(args.instances)
+    }
+    print('%d instances pending for 3-8 polls each:' % args.instances)
+    for name, wait in (('per-instance waiters', waiters),
+                       ('StatePoller', poller)):
+        script = ScriptedEC2(polls)
+        wait(script)
+        print('  %-22s %5d DescribeInstances calls' % (name, script.calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Measure execute() latency through the exec agent and per channel.
+
+Runs short commands one after another against the local paramiko SSH
+server stand-in used by the tests, once opening a channel and shell per
+command, the default, and once through the ExecAgent helper started by
+use_agent.
+
+Usage: PYTHONPATH=. python3 benchmarks/exec_agent.py
+           [--commands N] [--command CMD]
+"""
+
+import argparse
+import logging
+import shlex
+import tempfile
+import time
+
+from pycloudlib.instance import BaseInstance
+from pycloudlib.key import KeyPair
+from pycloudlib.tests.helpers import InstanceSubclass
+from pycloudlib.tests.sshd import SSHServer
+
+
+def latency(instance, commands, command):
+    """Return milliseconds per command run one after another.
+
+    Args:
+        instance: BaseInstance to run the commands on
+        commands: number of commands to run
+        command: list of the command to run
+    """
+    # Connect, and start the agent, before timing
+    instance.execute(command)
+    start = time.monotonic()
+    for _ in range(commands):
+        result = instance.execute(command)
+        assert result.ok, result.stderr
+    return (time.monotonic() - start) * 1000 / commands
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--commands', type=int, default=200,
+                        help='commands per mode')
+    parser.add_argument('--command', default='true',
+                        help='command to run')
+    args = parser.parse_args()
+    command = shlex.split(args.command)
+    # The server logs the readiness probes hanging up as errors
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        server = SSHServer(key_dir)
+        instance = InstanceSubclass(
+            key_pair=KeyPair(server.client_key_path + '.pub', name='bench')
+        )
+        instance.ip = '127.0.0.1'
+        instance.port = str(server.port)
+        try:
+            for use_agent in (False, True):
+                instance.use_agent = use_agent
+                print('%-20s %6.1f ms/command' % (
+                    'exec agent' if use_agent else 'channel per command',
+                    latency(instance, args.commands, command)
+                ))
+            assert 1 == server.connections
+        finally:
+            instance.__del__()
+            BaseInstance.ssh_connections.clear()
+            server.close()
+
+
+if __name__ == '__main__':
+    main()
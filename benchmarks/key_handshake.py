@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Measure SSH handshakes with file, cached and generated keys.
+
+Connects repeatedly to the local paramiko SSH server stand-in used by
+the tests:
+
+  - with a 4096-bit RSA key file parsed for the passphrase check and
+    again by paramiko through key_filename on every connect, as before
+    KeyPair cached parsed keys
+  - with the same key parsed once by KeyPair.private_key
+  - with an ed25519 key from KeyPair.generate()
+
+Usage: PYTHONPATH=. python3 benchmarks/key_handshake.py [--connects N]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import paramiko
+
+from pycloudlib.key import KeyPair
+from pycloudlib.tests.sshd import SSHServer
+
+
+def connect(server, **kwargs):
+    """Authenticate to server once and disconnect.
+
+    Args:
+        server: SSHServer to connect to
+        kwargs: key arguments of SSHClient.connect()
+    """
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect('127.0.0.1', port=server.port, username='ubuntu',
+                   allow_agent=False, look_for_keys=False, **kwargs)
+    client.close()
+
+
+def timed(connects, function):
+    """Return milliseconds taken by connects calls of function."""
+    start = time.monotonic()
+    for _ in range(connects):
+        function()
+    return (time.monotonic() - start) * 1000
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--connects', type=int, default=20,
+                        help='connects per key setup')
+    args = parser.parse_args()
+    # The server logs the readiness probes hanging up as errors
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        server = SSHServer(key_dir)
+        rsa_path = os.path.join(key_dir, 'id_rsa')
+        rsa_key = paramiko.RSAKey.generate(4096)
+        rsa_key.write_private_key_file(rsa_path)
+        generated = KeyPair.generate()
+        server.authorized_keys = [rsa_key, generated.private_key]
+        try:
+            def before():
+                paramiko.RSAKey.from_private_key_file(rsa_path)
+                connect(server, key_filename=rsa_path)
+
+            cached = KeyPair(None, private_key_path=rsa_path)
+            cached_key = cached.private_key
+            results = [
+                ('4096-bit RSA via key_filename (before)', before),
+                ('4096-bit RSA via cached pkey',
+                 lambda: connect(server, pkey=cached_key)),
+                ('generated ed25519 via pkey',
+                 lambda: connect(server, pkey=generated.private_key)),
+            ]
+            print('%d connects each:' % args.connects)
+            for name, function in results:
+                print('  %-40s %6.0f ms' % (
+                    name, timed(args.connects, function)
+                ))
+            print('Parsing the 4096-bit RSA key once: %.0f ms' % timed(
+                1, lambda: paramiko.RSAKey.from_private_key_file(rsa_path)
+            ))
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Measure push_file and pull_file throughput over a delayed link.
+
+The paramiko SSH server stand-in used by the tests runs in a separate
+process, behind a local TCP proxy delaying data by --delay milliseconds
+in each direction. A file is then pushed and pulled with one SFTP
+channel and with parallel ranges over several channels.
+
+Usage: PYTHONPATH=. python3 benchmarks/sftp_parallel.py
+           [--size MIB] [--delay MS]
+"""
+
+import argparse
+import heapq
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from pycloudlib.instance import BaseInstance
+from pycloudlib.key import KeyPair
+from pycloudlib.tests.helpers import InstanceSubclass
+from pycloudlib.tests.sshd import SSHServer
+
+CONFIGURATIONS = [
+    ('1 channel (before)', 1, None),
+    ('4 workers', 4, None),
+    ('8 workers', 8, None),
+    ('4 workers, 8M window', 4, 8 * 1024 * 1024),
+]
+
+
+def serve(key_dir, conn):
+    """Run the SSH server, sending its port through conn."""
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+    server = SSHServer(key_dir, max_sessions=20)
+    conn.send(server.port)
+    conn.recv()
+    server.close()
+
+
+class DelayProxy:
+    """Forward local TCP connections to a port, delaying all data.
+
+    Attributes:
+        port: port the proxy listens on
+    """
+
+    def __init__(self, target_port, delay):
+        """Start listening.
+
+        Args:
+            target_port: local port to forward to
+            delay: seconds to hold back data in each direction
+        """
+        self.delay = delay
+        self.target_port = target_port
+        self._sock = socket.socket()
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(100)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        """Accept connections until closed."""
+        while True:
+            try:
+                client, _addr = self._sock.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(
+                ('127.0.0.1', self.target_port)
+            )
+            for source, target in ((client, upstream), (upstream, client)):
+                self._pipe(source, target)
+
+    def _pipe(self, source, target):
+        """Relay source to target, each chunk delay seconds later."""
+        pending = []
+        ready = threading.Condition()
+        counter = [0]
+
+        def read():
+            while True:
+                try:
+                    data = source.recv(262144)
+                except OSError:
+                    data = b''
+                with ready:
+                    counter[0] += 1
+                    heapq.heappush(pending, (
+                        time.monotonic() + self.delay, counter[0], data
+                    ))
+                    ready.notify()
+                if not data:
+                    return
+
+        def write():
+            while True:
+                with ready:
+                    while not pending:
+                        ready.wait()
+                    due, _, data = pending[0]
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        ready.wait(wait)
+                        continue
+                    heapq.heappop(pending)
+                if not data:
+                    try:
+                        target.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+                try:
+                    target.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+    def close(self):
+        """Stop accepting connections."""
+        self._sock.close()
+
+
+def throughput(function, size):
+    """Return MB/s of function moving size bytes."""
+    start = time.monotonic()
+    function()
+    return size / (time.monotonic() - start) / 1e6
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=64,
+                        help='MiB to transfer')
+    parser.add_argument('--delay', type=float, default=20,
+                        help='milliseconds of delay each way')
+    args = parser.parse_args()
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+    size = args.size * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, child_conn = multiprocessing.Pipe()
+        server = multiprocessing.Process(
+            target=serve, args=(tmp, child_conn), daemon=True
+        )
+        server.start()
+        proxy = DelayProxy(conn.recv(), args.delay / 1000)
+
+        local = os.path.join(tmp, 'local.bin')
+        remote = os.path.join(tmp, 'remote.bin')
+        pulled = os.path.join(tmp, 'pulled.bin')
+        with open(local, 'wb') as local_file:
+            local_file.write(os.urandom(size))
+
+        print('%d MiB with %gms delay each way:' % (args.size, args.delay))
+        try:
+            for name, workers, window in CONFIGURATIONS:
+                instance = InstanceSubclass(key_pair=KeyPair(
+                    os.path.join(tmp, 'id_ecdsa.pub'), name='bench'
+                ))
+                instance.ip = '127.0.0.1'
+                instance.port = str(proxy.port)
+                instance.max_channels = 20
+                instance.sftp_workers = workers
+                instance.sftp_window_size = window
+                instance.sftp_parallel_size = 0
+                try:
+                    # Connect before timing
+                    instance.execute('true')
+                    push = throughput(
+                        lambda: instance.push_file(local, remote), size
+                    )
+                    pull = throughput(
+                        lambda: instance.pull_file(remote, pulled), size
+                    )
+                finally:
+                    instance.__del__()
+                    BaseInstance.ssh_connections.clear()
+                print('  %-22s push %5.1f MB/s  pull %5.1f MB/s' % (
+                    name, push, pull
+                ))
+        finally:
+            proxy.close()
+            conn.send('stop')
+            server.join(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Compare shell_pack with the pure Python shell_safe and getopt.
+
+shell_safe used to run 'getopt --shell sh' for every command. This times
+shell_pack on a typical command with the current shell_safe and with a
+copy of the getopt based implementation, after checking that both quote
+the command the same way.
+
+Usage: PYTHONPATH=. python3 benchmarks/shell_safe.py [--number N]
+"""
+
+import argparse
+import subprocess
+import timeit
+from unittest import mock
+
+from pycloudlib import util
+
+COMMAND = [
+    'sh', '-c', 'cat > "$1" && chmod +x "$1" && "$1" "$@"', 'runscript',
+    '/tmp/pycloudlib-0001', "it's", '$HOME', 'a b;c|d&e', '"quoted"',
+]
+
+
+def getopt_shell_safe(cmd):
+    """Quote cmd like shell_safe did before, through getopt."""
+    out = subprocess.check_output(
+        ["getopt", "--shell", "sh", "--options", "", "--", "--"] + list(cmd))
+
+    # out contains ' -- <data>\n'. drop the ' -- ' and the '\n'
+    return out.decode()[4:-1]
+
+
+def rate(number, shell_safe=None):
+    """Return shell_pack calls per second.
+
+    Args:
+        number: calls to time
+        shell_safe: optional, shell_safe implementation to use
+    """
+    if shell_safe is None:
+        seconds = timeit.timeit(
+            lambda: util.shell_pack(COMMAND), number=number
+        )
+    else:
+        with mock.patch.object(util, 'shell_safe', shell_safe):
+            seconds = timeit.timeit(
+                lambda: util.shell_pack(COMMAND), number=number
+            )
+    return number / seconds
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=2000,
+                        help='shell_pack calls per implementation')
+    args = parser.parse_args()
+
+    assert util.shell_safe(COMMAND) == getopt_shell_safe(COMMAND)
+    print('getopt subprocess  %10.0f commands/s' % rate(
+        args.number, getopt_shell_safe
+    ))
+    print('pure Python        %10.0f commands/s' % rate(args.number * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,32 @@
 # This file is part of pycloudlib. See LICENSE file for license information.
-"""Main pycloud module __init__."""
+"""Main pycloud module __init__.
 
+Cloud classes are imported on first access, so using one cloud does not
+pay for importing the SDKs of all the others.
+"""
+
+import importlib
 import logging
+import sys
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Static analysers and IDEs see the clouds as plain imports
+    from pycloudlib.azure.cloud import Azure
+    from pycloudlib.ec2.cloud import EC2
+    from pycloudlib.gce.cloud import GCE
+    from pycloudlib.kvm.cloud import KVM
+    from pycloudlib.lxd.cloud import LXD
+    from pycloudlib.oci.cloud import OCI
 
-from pycloudlib.azure.cloud import Azure
-from pycloudlib.ec2.cloud import EC2
-from pycloudlib.gce.cloud import GCE
-from pycloudlib.lxd.cloud import LXD
-from pycloudlib.kvm.cloud import KVM
-from pycloudlib.oci.cloud import OCI
+_CLOUD_MODULES = {
+    'Azure': 'pycloudlib.azure.cloud',
+    'EC2': 'pycloudlib.ec2.cloud',
+    'GCE': 'pycloudlib.gce.cloud',
+    'LXD': 'pycloudlib.lxd.cloud',
+    'KVM': 'pycloudlib.kvm.cloud',
+    'OCI': 'pycloudlib.oci.cloud',
+}
 
 __all__ = [
     'Azure',
@@ -19,4 +37,28 @@ __all__ = [
     'OCI',
 ]
 
+
+def __getattr__(name):
+    """Import a cloud class the first time it is accessed."""
+    try:
+        module = _CLOUD_MODULES[name]
+    except KeyError:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name)
+        ) from None
+    cloud = getattr(importlib.import_module(module), name)
+    globals()[name] = cloud
+    return cloud
+
+
+def __dir__():
+    """List module attributes including not yet imported clouds."""
+    return sorted(set(globals()) | set(__all__))
+
+
+# Module level __getattr__ (PEP 562) needs Python 3.7
+if sys.version_info < (3, 7):
+    for _name in __all__:
+        __getattr__(_name)
+
 logging.getLogger(__name__).addHandler(logging.NullHandler())
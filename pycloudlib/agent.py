@@ -0,0 +1,191 @@
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Helper process on an instance running commands sent over one channel."""
+
+import logging
+import struct
+import threading
+import weakref
+
+from paramiko.ssh_exception import SSHException
+
+from pycloudlib.result import Result
+from pycloudlib.util import shell_pack
+
+# Requests are a (argv length, stdin length) header followed by the NUL
+# separated argv and stdin. Responses are a (return code, stdout length,
+# stderr length) header followed by stdout and stderr.
+_REQUEST = struct.Struct('!II')
+_RESPONSE = struct.Struct('!iII')
+_GREETING = b'pycloudlib-agent 1\n'
+
+# Runs on the instance. cloud-init depends on python3, so it is present
+# on every image pycloudlib launches.
+_HELPER = r'''
+import struct, subprocess, sys
+fin, fout = sys.stdin.buffer, sys.stdout.buffer
+def read(n):
+    data = b''
+    while len(data) < n:
+        chunk = fin.read(n - len(data))
+        if not chunk:
+            sys.exit(0)
+        data += chunk
+    return data
+fout.write(b'pycloudlib-agent 1\n')
+fout.flush()
+while True:
+    argv_len, stdin_len = struct.unpack('!II', read(8))
+    argv = read(argv_len).split(b'\0')
+    data = read(stdin_len)
+    try:
+        proc = subprocess.Popen(
+            argv, stdin=subprocess.PIPE if data else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate(data or None)
+        rc = proc.returncode if proc.returncode >= 0 else 128 - proc.returncode
+    except OSError as e:
+        out, err = b'', ('%s: %s\n' % (argv[0].decode(), e.strerror)).encode()
+        rc = 127 if isinstance(e, FileNotFoundError) else 126
+    fout.write(struct.pack('!iII', rc, len(out), len(err)) + out + err)
+    fout.flush()
+'''
+
+
+class ExecAgent:
+    """Run commands through a long-lived helper process on an instance.
+
+    The helper is a small python3 script started once in its own SSH
+    channel. Each command is then a framed request written to the
+    helper's stdin, which the helper runs and answers with a frame of
+    exit code, stdout and stderr. This avoids opening a channel and
+    starting a shell per command, at the cost of running the commands
+    of one agent one at a time.
+
+    The agent keeps one of the instance's max_channels slots while it
+    runs, BaseInstance.execute() therefore only uses an agent when
+    max_channels leaves other channels a slot.
+    """
+
+    def __init__(self, instance):
+        """Initialize agent, the helper starts with the first command.
+
+        Args:
+            instance: BaseInstance connecting via SSH
+        """
+        self._log = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._channel = None
+        # The instance owns its agent, a proxy avoids a reference cycle
+        # delaying the instance's __del__
+        self.instance = weakref.proxy(instance)
+
+    def __repr__(self):
+        """Create string representation of class."""
+        return 'ExecAgent(instance={})'.format(self.instance.name)
+
+    @property
+    def running(self):
+        """Whether the helper process is up."""
+        channel = self._channel
+        return (channel is not None and not channel.closed and
+                not channel.exit_status_ready() and
+                channel.get_transport().is_active())
+
+    def run(self, command, stdin=None):
+        """Run a command through the helper, starting it as needed.
+
+        Args:
+            command: list of the command and its arguments
+            stdin: optional, bytes, string or binary file object to be
+                   passed in
+
+        Returns:
+            Result object
+
+        Raises:
+            SSHException: the helper channel closed while running the
+                command
+
+        """
+        if hasattr(stdin, 'read'):
+            stdin = stdin.read()
+        elif isinstance(stdin, str):
+            stdin = stdin.encode()
+        stdin = stdin or b''
+        argv = b'\0'.join(
+            arg.encode() if isinstance(arg, str) else arg
+            for arg in command
+        )
+
+        with self._lock:
+            if not self.running:
+                self._start()
+            try:
+                self._channel.sendall(
+                    _REQUEST.pack(len(argv), len(stdin)) + argv + stdin
+                )
+                return_code, out_len, err_len = _RESPONSE.unpack(
+                    self._recv(_RESPONSE.size)
+                )
+                out = self._recv(out_len)
+                err = self._recv(err_len)
+            except BaseException:
+                # The response stream is out of sync, never reuse it
+                self._stop()
+                raise
+
+        return Result(
+            out.rstrip().decode('utf-8'), err.rstrip().decode('utf-8'),
+            return_code
+        )
+
+    def close(self):
+        """Stop the helper process."""
+        with self._lock:
+            self._stop()
+
+    def _start(self):
+        """Start the helper in a new channel and wait for its greeting."""
+        self._stop()
+        self._channel = self.instance.open_channel(
+            shell_pack(['python3', '-u', '-c', _HELPER])
+        )
+        try:
+            greeting = self._recv(len(_GREETING))
+        except BaseException:
+            self._stop()
+            raise
+        if greeting != _GREETING:
+            self._stop()
+            raise SSHException(
+                'Unexpected exec agent greeting: %r' % greeting
+            )
+        self._log.debug('exec agent started on %s', self.instance.name)
+
+    def _stop(self):
+        """Close the helper channel, ending the helper."""
+        if self._channel is not None:
+            self.instance.close_channel(self._channel)
+            self._channel = None
+
+    def _recv(self, size):
+        """Read exactly size bytes from the helper.
+
+        Raises:
+            SSHException: the helper exited or the channel closed first
+
+        """
+        chunks = []
+        while size:
+            chunk = self._channel.recv(min(size, 65536))
+            if not chunk:
+                error = b''
+                while self._channel.recv_stderr_ready():
+                    error += self._channel.recv_stderr(65536)
+                raise SSHException(
+                    'Exec agent channel closed: %s' %
+                    error.decode('utf-8', 'replace').strip()
+                )
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
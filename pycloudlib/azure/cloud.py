@@ -588,6 +588,7 @@ class Azure(BaseCloud):
             client=self.compute_client,
             instance=instance_info
         )
+        instance.prewarm_ssh()
 
         if wait:
             instance.wait()
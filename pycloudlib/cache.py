@@ -0,0 +1,203 @@
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""On-disk cache for remote content shared between processes."""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from pycloudlib.util import rmfile
+
+
+def default_cache_dir():
+    """Return the default pycloudlib cache directory.
+
+    Honors $XDG_CACHE_HOME and falls back to ~/.cache.
+
+    Returns:
+        string, path to the pycloudlib cache directory
+
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'
+    )
+    return os.path.join(cache_home, 'pycloudlib')
+
+
+def _same_file(file_obj, path):
+    """Return boolean if path still refers to the open file_obj."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    own = os.fstat(file_obj.fileno())
+    return (stat.st_dev, stat.st_ino) == (own.st_dev, own.st_ino)
+
+
+class UrlCache:
+    """Cache URL content on disk with a TTL and conditional revalidation.
+
+    Each URL gets a JSON entry file holding the (optionally verified)
+    content together with the ETag and Last-Modified headers returned by
+    the server. Entries younger than the TTL are served without touching
+    the network. Older entries are revalidated with If-None-Match and
+    If-Modified-Since, so an unchanged remote file costs a single 304
+    response and no re-verification.
+
+    Access to an entry is serialized with an flock on a sibling lock
+    file, so concurrent processes sharing the directory download each
+    URL only once.
+    """
+
+    def __init__(self, cache_dir=None, ttl=600, timeout=30):
+        """Initialize the cache.
+
+        Args:
+            cache_dir: directory to store entries in, defaults to
+                default_cache_dir()
+            ttl: seconds an entry is served without revalidation
+            timeout: seconds to wait for the remote server
+        """
+        self._log = logging.getLogger(__name__)
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.ttl = ttl
+        self.timeout = timeout
+
+    def get(self, url, verify=None):
+        """Return the content of url, downloading it only when needed.
+
+        Args:
+            url: string, URL to read
+            verify: optional callable applied to freshly downloaded
+                content, e.g. a signature check. Its return value is
+                what gets cached and returned.
+
+        Returns:
+            string with the (verified) content of url
+
+        """
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        with self._lock(key):
+            entry = self._load(key)
+            now = time.time()
+            if entry and now - entry['checked'] < self.ttl:
+                self._log.debug('cache hit for %s', url)
+                return entry['content']
+
+            headers = {}
+            if entry and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+            try:
+                with urlopen(
+                    Request(url, headers=headers), timeout=self.timeout
+                ) as response:
+                    raw = response.read().decode('utf-8')
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+            except HTTPError as error:
+                if error.code != 304 or not entry:
+                    raise
+                self._log.debug('cache revalidated for %s', url)
+                entry['checked'] = now
+                self._store(key, entry)
+                return entry['content']
+
+            self._log.debug('cache miss for %s', url)
+            entry = {
+                'url': url,
+                'etag': etag,
+                'last_modified': last_modified,
+                'checked': now,
+                'content': verify(raw) if verify else raw,
+            }
+            self._store(key, entry)
+            return entry['content']
+
+    def clear(self):
+        """Remove all entries and their lock files from the cache directory.
+
+        Each entry is removed while holding its lock, so that clearing
+        does not race with a concurrent get() of the same URL.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        keys = set()
+        for name in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(name)
+            if ext in ('.json', '.lock'):
+                keys.add(key)
+        for key in keys:
+            with self._lock(key) as lock_path:
+                rmfile(os.path.join(self.cache_dir, '%s.json' % key))
+                rmfile(lock_path)
+
+    @contextmanager
+    def _lock(self, key):
+        """Hold an exclusive lock on a cache entry.
+
+        clear() deletes lock files while holding them, so a lock taken
+        on a file which was deleted meanwhile is dropped and taken again
+        on the file now at the path.
+
+        Args:
+            key: string, cache entry key
+
+        Yields:
+            string, path of the held lock file
+        """
+        lock_path = os.path.join(self.cache_dir, '%s.lock' % key)
+        while True:
+            with open(lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if _same_file(lock_file, lock_path):
+                        yield lock_path
+                        return
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self, key):
+        """Load a cache entry.
+
+        Args:
+            key: string, cache entry key
+
+        Returns:
+            dictionary with the entry or None if missing or unreadable
+
+        """
+        path = os.path.join(self.cache_dir, '%s.json' % key)
+        try:
+            with open(path) as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, entry):
+        """Atomically write a cache entry.
+
+        Args:
+            key: string, cache entry key
+            entry: dictionary to write
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(
+                tmp_path, os.path.join(self.cache_dir, '%s.json' % key)
+            )
+        except BaseException:
+            rmfile(tmp_path)
+            raise
@@ -5,8 +5,8 @@ import getpass
 import logging
 from abc import ABC, abstractmethod
 
+from pycloudlib.cache import UrlCache
 from pycloudlib.key import KeyPair
-from pycloudlib.streams import Streams
 from pycloudlib.util import get_timestamped_tag, validate_tag
 
 
@@ -14,6 +14,12 @@ class BaseCloud(ABC):
     """Base Cloud Class."""
 
     _type = 'base'
+    _streams_cache = UrlCache()
+    _streams = {}
+
+    # Set to True to sync each cloud-images mirror once per process into
+    # an in-memory index answering every later image query.
+    use_streams_index = False
 
     def __init__(self, tag, timestamp_suffix=True):
         """Initialize base cloud class.
@@ -148,27 +154,44 @@ class BaseCloud(ABC):
         self._log.debug('using SSH key from %s', public_key_path)
         self.key_pair = KeyPair(public_key_path, private_key_path, name)
 
-    @staticmethod
-    def _streams_query(filters, daily=True):
+    @classmethod
+    def _streams_query(cls, filters, daily=True, latest=None):
         """Query the cloud-images streams applying a filter.
 
+        Verified index and product JSON are kept in an on-disk cache
+        shared by all clouds and processes, see pycloudlib.cache. With
+        use_streams_index set, queries are answered from one in-memory
+        index per mirror shared by all clouds.
+
         Args:
             filters: list of 'field=value' strings, filters to apply
             daily: bool, query the 'daily' stream (default: True)
+            latest: optional int, only return the newest 'latest' images
+                of each matching product, newest first
 
         Returns:
             a list of dictionaries containing the streams metadata of the
             images matching 'filters'.
 
         """
+        # simplestreams is only needed, and imported, once a query runs
+        from pycloudlib.streams import Streams  # pylint: disable=C0415
+
         if daily:
             mirror_url = 'https://cloud-images.ubuntu.com/daily'
         else:
             mirror_url = 'https://cloud-images.ubuntu.com/releases'
 
-        stream = Streams(
-            mirror_url=mirror_url,
-            keyring_path='/usr/share/keyrings/ubuntu-cloudimage-keyring.gpg'
-        )
-
-        return stream.query(filters)
+        stream = cls._streams.get(mirror_url)
+        if stream is None or stream.indexed != cls.use_streams_index:
+            stream = Streams(
+                mirror_url=mirror_url,
+                keyring_path=(
+                    '/usr/share/keyrings/ubuntu-cloudimage-keyring.gpg'
+                ),
+                cache=cls._streams_cache,
+                indexed=cls.use_streams_index
+            )
+            cls._streams[mirror_url] = stream
+
+        return stream.query(filters, latest=latest)
@@ -0,0 +1,198 @@
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Process-wide cache of SSH connections shared between instances."""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from paramiko.ssh_exception import SSHException
+
+
+def is_active(client):
+    """Check whether an SSH client still has a live transport.
+
+    Args:
+        client: paramiko SSHClient
+
+    Returns:
+        boolean, True if the transport is connected
+
+    """
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class _Entry:
+    """A cached client with the number of instances holding it."""
+
+    def __init__(self, client):
+        """Hold client, used by the caller."""
+        self.client = client
+        self.users = 1
+        self.last_used = time.monotonic()
+
+
+class ConnectionCache:
+    """Share SSH connections between instances of the same host.
+
+    Connections are keyed by (ip, port, username, private key, instance
+    name), so every BaseInstance object of the same instance talking to
+    it as the same user reuses one authenticated transport instead of
+    repeating the TCP connect, key exchange and authentication. The
+    instance name keeps a new instance reusing the IP address of a
+    deleted one from getting the old transport.
+
+    An instance holds its connection from acquire() or add() until it
+    calls release(). Connections no instance holds stay cached for
+    reuse until they have been idle for idle_timeout seconds, or until
+    more than max_size connections are cached, in which case the least
+    recently used idle ones are closed first. A daemon thread closes
+    expired idle connections while there are any, also when the cache
+    is not used meanwhile. Held connections are never closed by the
+    cache.
+    """
+
+    def __init__(self, max_size=32, idle_timeout=300):
+        """Initialize the cache.
+
+        Args:
+            max_size: number of cached connections beyond which idle ones
+                are closed
+            idle_timeout: seconds an unheld connection is kept open
+        """
+        self._log = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._reaper = None
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+    def __len__(self):
+        """Return the number of cached connections."""
+        return len(self._entries)
+
+    def acquire(self, key):
+        """Hold the cached connection for key if it is still alive.
+
+        Args:
+            key: (ip, port, username, private key, instance name) tuple
+
+        Returns:
+            paramiko SSHClient, or None if no live connection is cached
+
+        """
+        with self._lock:
+            self._evict()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not is_active(entry.client):
+                del self._entries[key]
+                self._close(key, entry.client)
+                return None
+            entry.users += 1
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(key)
+            self._log.debug('reusing ssh connection to %s@%s:%s',
+                            key[2], key[0], key[1])
+            return entry.client
+
+    def add(self, key, client):
+        """Cache a new connection, held by the caller.
+
+        If another thread cached a live connection for key meanwhile,
+        that one is held and returned instead and client is closed.
+
+        Args:
+            key: (ip, port, username, private key, instance name) tuple
+            client: connected paramiko SSHClient
+
+        Returns:
+            paramiko SSHClient to use
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and is_active(entry.client):
+                entry.users += 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+                self._close(key, client)
+                return entry.client
+            self._entries[key] = _Entry(client)
+            self._entries.move_to_end(key)
+            self._evict()
+            self._schedule()
+            return client
+
+    def release(self, key, client):
+        """Stop holding a connection.
+
+        Connections which are no longer cached, e.g. replaced after
+        they died, are closed.
+
+        Args:
+            key: (ip, port, username, private key, instance name) tuple
+            client: paramiko SSHClient from acquire() or add()
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.client is not client:
+                self._close(key, client)
+                return
+            entry.users = max(entry.users - 1, 0)
+            entry.last_used = time.monotonic()
+            self._evict()
+            self._schedule()
+
+    def clear(self):
+        """Close and forget all cached connections."""
+        with self._lock:
+            while self._entries:
+                key, entry = self._entries.popitem(last=False)
+                self._close(key, entry.client)
+
+    def _evict(self):
+        """Close idle connections that expired or exceed max_size."""
+        now = time.monotonic()
+        idle = [key for key, entry in self._entries.items()
+                if not entry.users]
+        for key in idle:
+            entry = self._entries[key]
+            if (len(self._entries) > self.max_size or
+                    now - entry.last_used >= self.idle_timeout or
+                    not is_active(entry.client)):
+                del self._entries[key]
+                self._close(key, entry.client)
+
+    def _reap(self):
+        """Close idle connections as they expire, while there are any."""
+        while True:
+            with self._lock:
+                self._evict()
+                idle = [entry.last_used for entry in self._entries.values()
+                        if not entry.users]
+                if not idle:
+                    self._reaper = None
+                    return
+                delay = min(idle) + self.idle_timeout - time.monotonic()
+            # Unlike time.sleep(), unaffected by tests mocking time
+            threading.Event().wait(max(delay, 0.1))
+
+    def _schedule(self):
+        """Start the reaper thread if connections are idle."""
+        if self._reaper is not None or all(
+                entry.users for entry in self._entries.values()):
+            return
+        self._reaper = threading.Thread(target=self._reap, daemon=True)
+        self._reaper.start()
+
+    def _close(self, key, client):
+        """Close a connection dropped from the cache."""
+        self._log.debug('closing ssh connection to %s@%s:%s',
+                        key[2], key[0], key[1])
+        try:
+            client.close()
+        except SSHException:
+            self._log.warning('Failed to close SSH connection.')
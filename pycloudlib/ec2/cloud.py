@@ -1,14 +1,24 @@
 # This file is part of pycloudlib. See LICENSE file for license information.
 """AWS EC2 Cloud type."""
 
+from concurrent.futures import ThreadPoolExecutor
+
 import botocore
 
 from pycloudlib.cloud import BaseCloud
 from pycloudlib.ec2.instance import EC2Instance
-from pycloudlib.ec2.util import _get_session, _tag_resource
+from pycloudlib.ec2.util import (
+    _describe_instances, _get_session, _tag_resource
+)
 from pycloudlib.ec2.vpc import VPC
 from pycloudlib.key import KeyPair
 
+# Instance ids per DescribeInstances call, the API maximum
+_DESCRIBE_BATCH_SIZE = 1000
+
+# Instances launch_many() waits for at the same time
+_LAUNCH_WAIT_WORKERS = 32
+
 
 class EC2(BaseCloud):
     """EC2 Cloud Class."""
@@ -158,6 +168,34 @@ class EC2(BaseCloud):
         instance = self.resource.Instance(instance_id)
         return EC2Instance(self.key_pair, self.client, instance)
 
+    def get_instances(self, instance_ids):
+        """Get many instances by id with few API calls.
+
+        The instances are described by DescribeInstances calls of up to
+        1000 ids, and their descriptions are reused by the returned
+        objects instead of each loading its own.
+
+        Args:
+            instance_ids: list of instance ids
+
+        Returns:
+            list of instance objects, in the order of instance_ids
+
+        Raises:
+            botocore.exceptions.ClientError: an instance id is unknown
+
+        """
+        descriptions = {}
+        for start in range(0, len(instance_ids), _DESCRIBE_BATCH_SIZE):
+            batch = instance_ids[start:start + _DESCRIBE_BATCH_SIZE]
+            for description in _describe_instances(
+                    self.client, InstanceIds=batch):
+                descriptions[description['InstanceId']] = description
+        return [
+            self._instance_from_description(descriptions[instance_id])
+            for instance_id in instance_ids
+        ]
+
     def launch(self, image_id, instance_type='t2.micro', user_data=None,
                wait=True, vpc=None, **kwargs):
         """Launch instance on EC2.
@@ -174,46 +212,98 @@ class EC2(BaseCloud):
             EC2 Instance object
 
         """
-        args = {
-            'ImageId': image_id,
-            'InstanceType': instance_type,
-            'KeyName': self.key_pair.name,
-            'MaxCount': 1,
-            'MinCount': 1,
-            'TagSpecifications': [{
-                'ResourceType': 'instance',
-                'Tags': [{'Key': 'Name', 'Value': self.tag}]
-            }],
-        }
-
-        if user_data:
-            args['UserData'] = user_data
-
-        for key, value in kwargs.items():
-            args[key] = value
-
-        if vpc:
-            try:
-                [subnet_id] = [s.id for s in vpc.vpc.subnets.all()]
-            except ValueError as e:
-                raise RuntimeError(
-                    "Too many subnets in vpc {}. pycloudlib does not support"
-                    " launching into VPCs with multiple subnets".format(vpc.id)
-                ) from e
-            args['SubnetId'] = subnet_id
-            args['SecurityGroupIds'] = [
-                sg.id for sg in vpc.vpc.security_groups.all()
-            ]
+        args = self._launch_args(
+            image_id, instance_type, user_data, vpc, kwargs
+        )
 
         self._log.debug('launching instance')
         instances = self.resource.create_instances(**args)
         instance = EC2Instance(self.key_pair, self.client, instances[0])
+        instance.prewarm_ssh()
 
         if wait:
             instance.wait()
 
         return instance
 
+    def launch_many(self, image_id, count, instance_type='t2.micro',
+                    user_data=None, wait=True, vpc=None, min_count=1,
+                    **kwargs):
+        """Launch several identical instances with a single request.
+
+        If EC2 lacks the capacity for all count instances, it launches
+        as many as it can, but fails unless at least min_count fit.
+        Instances are waited for concurrently, those failing to come up
+        are deleted and left out of the result.
+
+        Args:
+            image_id: string, AMI ID to use default: latest Ubuntu LTS
+            count: number of instances to launch
+            instance_type: string, instance type to launch
+            user_data: string, user-data to pass to instances
+            wait: boolean, wait for instances to come up
+            vpc: optional vpc object to create instances under
+            min_count: fewest instances to accept launching
+            kwargs: other named arguments to add to instance JSON
+
+        Returns:
+            list of EC2 Instance objects
+
+        Raises:
+            the error of the first instance failing to come up, if fewer
+            than min_count did, after all launched instances were deleted
+
+        """
+        args = self._launch_args(
+            image_id, instance_type, user_data, vpc, kwargs,
+            count=count, min_count=min_count
+        )
+
+        self._log.debug('launching %d instances', count)
+        instances = [
+            EC2Instance(self.key_pair, self.client, instance)
+            for instance in self.resource.create_instances(**args)
+        ]
+        if len(instances) < count:
+            self._log.warning(
+                'launched %d of %d instances, EC2 capacity is short',
+                len(instances), count
+            )
+        for instance in instances:
+            instance.prewarm_ssh()
+
+        if wait:
+            instances = self._wait_launched(instances, min_count)
+
+        return instances
+
+    def list_instances(self, tag=None):
+        """List the instances named with a tag.
+
+        Instances are filtered by EC2, terminated ones are left out.
+
+        Args:
+            tag: Name tag of the instances, may contain * and ?
+                 wildcards, defaults to the tag of this cloud
+
+        Returns:
+            list of instance objects
+
+        """
+        filters = [
+            {'Name': 'tag:Name', 'Values': [tag or self.tag]},
+            {'Name': 'instance-state-name', 'Values': [
+                'pending', 'running', 'shutting-down', 'stopping', 'stopped'
+            ]},
+        ]
+        return [
+            self._instance_from_description(description)
+            for description in _describe_instances(
+                self.client, Filters=filters,
+                PaginationConfig={'PageSize': _DESCRIBE_BATCH_SIZE}
+            )
+        ]
+
     def list_keys(self):
         """List all ssh key pair names loaded on this EC2 region."""
         keypair_names = []
@@ -304,7 +394,128 @@ class EC2(BaseCloud):
             'virt=hvm',
         ]
 
-        return self._streams_query(filters, daily)[0]
+        return self._streams_query(filters, daily, latest=1)[0]
+
+    def _instance_from_description(self, description):
+        """Create an instance object from its DescribeInstances entry.
+
+        Args:
+            description: dictionary describing the instance
+
+        Returns:
+            An instance object which does not need to load itself
+
+        """
+        instance = self.resource.Instance(description['InstanceId'])
+        instance.meta.data = description
+        return EC2Instance(self.key_pair, self.client, instance)
+
+    def _launch_args(self, image_id, instance_type, user_data, vpc, kwargs,
+                     count=1, min_count=1):
+        """Build the RunInstances arguments of launch() and launch_many().
+
+        Args:
+            image_id: string, AMI ID to use
+            instance_type: string, instance type to launch
+            user_data: string, user-data to pass to instances
+            vpc: optional vpc object to create instances under
+            kwargs: other named arguments to add to instance JSON
+            count: number of instances to launch at most
+            min_count: number of instances to launch at least
+
+        Returns:
+            dictionary of create_instances() arguments
+
+        """
+        args = {
+            'ImageId': image_id,
+            'InstanceType': instance_type,
+            'KeyName': self.key_pair.name,
+            'MaxCount': count,
+            'MinCount': min_count,
+            'TagSpecifications': [{
+                'ResourceType': 'instance',
+                'Tags': [{'Key': 'Name', 'Value': self.tag}]
+            }],
+        }
+
+        if user_data:
+            args['UserData'] = user_data
+
+        for key, value in kwargs.items():
+            args[key] = value
+
+        if vpc:
+            try:
+                [subnet_id] = [s.id for s in vpc.vpc.subnets.all()]
+            except ValueError as e:
+                raise RuntimeError(
+                    "Too many subnets in vpc {}. pycloudlib does not support"
+                    " launching into VPCs with multiple subnets".format(vpc.id)
+                ) from e
+            args['SubnetId'] = subnet_id
+            args['SecurityGroupIds'] = [
+                sg.id for sg in vpc.vpc.security_groups.all()
+            ]
+        return args
+
+    def _wait_launched(self, instances, min_count=1):
+        """Wait for launched instances, deleting those failing to come up.
+
+        Up to _LAUNCH_WAIT_WORKERS instances are waited for at a time,
+        their states are polled together by the shared StatePoller.
+
+        Args:
+            instances: list of EC2 Instance objects
+            min_count: fewest instances to accept coming up
+
+        Returns:
+            list of the EC2 Instance objects which came up
+
+        Raises:
+            the error of the first instance failing to come up, if fewer
+            than min_count did, after all instances were deleted
+
+        """
+        workers = min(len(instances), _LAUNCH_WAIT_WORKERS) or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(instance.wait)
+                       for instance in instances]
+        survivors = []
+        failed = []
+        first_error = None
+        for instance, future in zip(instances, futures):
+            error = future.exception()
+            if error is None:
+                survivors.append(instance)
+                continue
+            self._log.error('instance %s failed to come up: %s',
+                            instance.id, error)
+            failed.append(instance)
+            first_error = first_error or error
+
+        if failed and len(survivors) < min_count:
+            self._log.error(
+                '%d of %d launched instances came up, %d required, '
+                'deleting all', len(survivors), len(instances), min_count
+            )
+            self._delete_all(instances)
+            raise first_error
+        self._delete_all(failed)
+        return survivors
+
+    def _delete_all(self, instances):
+        """Start deleting instances, logging failures instead of raising.
+
+        Args:
+            instances: list of EC2 Instance objects
+        """
+        for instance in instances:
+            try:
+                instance.delete(wait=False)
+            except Exception as e:  # pylint: disable=broad-except
+                self._log.error('failed to delete instance %s: %s',
+                                instance.id, e)
 
     def _wait_for_snapshot(self, image):
         """Wait for snapshot image to be created.
@@ -8,8 +8,12 @@ from paramiko.ssh_exception import (
     SSHException
 )
 
+from pycloudlib.ec2.poller import StatePoller
 from pycloudlib.instance import BaseInstance
 
+# States in which attributes like the public IP are about to change
+_TRANSITIONAL_STATES = ('pending', 'stopping', 'shutting-down')
+
 
 class EC2Instance(BaseInstance):
     """EC2 backed instance."""
@@ -29,8 +33,13 @@ class EC2Instance(BaseInstance):
         self._instance = instance
         self._ip = None
         self._client = client
+        # When the description in instance.meta.data was loaded
+        self._loaded = time.monotonic() if instance.meta.data else None
 
         self.boot_timeout = 300
+        # Seconds attributes are served from the last instance
+        # description, at most 5 seconds in transitional states
+        self.attribute_ttl = 60
 
     def __repr__(self):
         """Create string representation for class."""
@@ -44,13 +53,12 @@ class EC2Instance(BaseInstance):
     @property
     def availability_zone(self):
         """Return availability zone."""
-        return self._instance.placement['AvailabilityZone']
+        return self._description().placement['AvailabilityZone']
 
     @property
     def ip(self):
         """Return IP address of instance."""
-        self._instance.reload()
-        return self._instance.public_ip_address
+        return self._description().public_ip_address
 
     @property
     def id(self):
@@ -65,7 +73,7 @@ class EC2Instance(BaseInstance):
     @property
     def image_id(self):
         """Return id of instance."""
-        return self._instance.image_id
+        return self._description().image_id
 
     def add_network_interface(self):
         """Add network interface to instance.
@@ -120,10 +128,20 @@ class EC2Instance(BaseInstance):
         """Delete instance."""
         self._log.debug('deleting instance %s', self._instance.id)
         self._instance.terminate()
+        self._loaded = None
 
         if wait:
             self.wait_for_delete()
 
+    def refresh(self):
+        """Reload the instance description from EC2.
+
+        Attributes are otherwise served from the description for up to
+        attribute_ttl seconds.
+        """
+        self._instance.reload()
+        self._loaded = time.monotonic()
+
     def restart(self, wait=True):
         """Restart the instance."""
         self._log.debug('restarting instance %s', self._instance.id)
@@ -191,6 +209,7 @@ class EC2Instance(BaseInstance):
         """
         self._log.debug('shutting down instance %s', self._instance.id)
         self._instance.stop()
+        self._loaded = None
 
         if wait:
             self.wait_for_stop()
@@ -201,11 +220,13 @@ class EC2Instance(BaseInstance):
         Args:
             wait: wait for the instance to start.
         """
+        self.refresh()
         if self._instance.state['Name'] == 'running':
             return
 
         self._log.debug('starting instance %s', self._instance.id)
         self._instance.start()
+        self._loaded = None
 
         if wait:
             self.wait()
@@ -213,20 +234,16 @@ class EC2Instance(BaseInstance):
     def wait(self):
         """Wait for instance to be up and cloud-init to be complete."""
         self._log.debug('wait for instance running %s', self._instance.id)
-        self._instance.wait_until_running()
-        self._log.debug('reloading instance state %s', self._instance.id)
-        self._instance.reload()
+        self._wait_for_state('running')
         self._wait_for_system()
 
     def wait_for_delete(self):
         """Wait for instance to be deleted."""
-        self._instance.wait_until_terminated()
-        self._instance.reload()
+        self._wait_for_state('terminated')
 
     def wait_for_stop(self):
         """Wait for instance stop."""
-        self._instance.wait_until_stopped()
-        self._instance.reload()
+        self._wait_for_state('stopped')
 
     def _attach_ebs_volume(self, volume):
         """Attach EBS volume to an instance.
@@ -251,7 +268,7 @@ class EC2Instance(BaseInstance):
         waiter = self._client.get_waiter('volume_in_use')
         waiter.wait(VolumeIds=[volume['VolumeId']])
 
-        self._instance.reload()
+        self.refresh()
 
         self._instance.modify_attribute(
             BlockDeviceMappings=[{
@@ -282,7 +299,7 @@ class EC2Instance(BaseInstance):
 
         response = self._client.attach_network_interface(**args)
 
-        self._instance.reload()
+        self.refresh()
 
         for nic in self._instance.network_interfaces:
             if nic.attachment['AttachmentId'] == response['AttachmentId']:
@@ -333,7 +350,8 @@ class EC2Instance(BaseInstance):
         """
         args = {
             'Groups': [
-                group['GroupId'] for group in self._instance.security_groups
+                group['GroupId']
+                for group in self._description().security_groups
             ],
             'SubnetId': self._instance.subnet_id
         }
@@ -363,7 +381,7 @@ class EC2Instance(BaseInstance):
         all_index = range(0, 16)
 
         used_index = set()
-        for nic in self._instance.network_interfaces:
+        for nic in self._description().network_interfaces:
             used_index.add(nic.attachment['DeviceIndex'])
 
         return list(all_index - used_index)[0]
@@ -392,11 +410,28 @@ class EC2Instance(BaseInstance):
                 all_device_names.append("/dev/sd%s" % name)
 
         used_device_names = set()
-        for device in self._instance.block_device_mappings:
+        for device in self._description().block_device_mappings:
             used_device_names.add(device['DeviceName'])
 
         return list(set(all_device_names) - used_device_names)[0]
 
+    def _description(self):
+        """Return the boto3 instance, refreshed if its data is stale.
+
+        Returns:
+            boto3 instance object with a description no older than
+            attribute_ttl seconds
+
+        """
+        ttl = self.attribute_ttl
+        data = self._instance.meta.data
+        if data and data['State']['Name'] in _TRANSITIONAL_STATES:
+            ttl = min(ttl, 5)
+        if (self._loaded is None or not data or
+                time.monotonic() - self._loaded > ttl):
+            self.refresh()
+        return self._instance
+
     def _get_boot_id(self):
         """Get the instance boot_id.
 
@@ -406,3 +441,21 @@ class EC2Instance(BaseInstance):
         """
         boot_id = self.execute("cat /proc/sys/kernel/random/boot_id")
         return boot_id
+
+    def _wait_for_state(self, state):
+        """Wait for the instance state through the shared StatePoller.
+
+        The instance description is updated from the poll, so no reload
+        is needed afterwards.
+
+        Args:
+            state: 'running', 'stopped' or 'terminated'
+        """
+        description = StatePoller.for_client(self._client).wait(
+            self._instance.id, state
+        )
+        if description:
+            self._instance.meta.data = description
+            self._loaded = time.monotonic()
+        else:
+            self._loaded = None
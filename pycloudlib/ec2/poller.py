@@ -0,0 +1,307 @@
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Shared polling of EC2 instance states."""
+
+import logging
+import re
+import threading
+import time
+import weakref
+
+from botocore.exceptions import BotoCoreError, ClientError, WaiterError
+
+from pycloudlib.ec2.util import _describe_instances
+
+# States ending a wait for the key state unsuccessfully, as in the
+# instance_running, instance_stopped and instance_terminated waiters
+_FAILURE_STATES = {
+    'running': ('shutting-down', 'terminated', 'stopping'),
+    'stopped': ('pending', 'terminated'),
+    'terminated': ('pending', 'stopping'),
+}
+
+
+class _Waiter:
+    """A caller waiting for an instance to reach a state."""
+
+    def __init__(self, state):
+        """Wait for state."""
+        self.state = state
+        self.done = threading.Event()
+        self.description = None
+        self.error = None
+
+    def update(self, state, description):
+        """Check a polled state, returning True once the wait is over.
+
+        Instances EC2 no longer knows count as terminated.
+        """
+        if state == self.state or (
+                state is None and self.state == 'terminated'):
+            self.description = description
+        elif state in _FAILURE_STATES[self.state]:
+            self.description = description
+            self.error = 'instance is %s' % state
+        else:
+            return False
+        self.done.set()
+        return True
+
+    def fail(self, error):
+        """End the wait with an error."""
+        self.error = error
+        self.done.set()
+
+
+class StatePoller:
+    """Wait for the states of many EC2 instances with few API calls.
+
+    Instead of every waiting caller polling its own instance, one
+    thread per EC2 client polls the states of all instances waited for
+    with DescribeInstances calls of up to batch_size instance IDs, and
+    wakes each caller once its instance reached the state it waits for.
+
+    The thread polls every min_interval seconds while states change and
+    backs off up to max_interval seconds while they do not, or when EC2
+    throttles the requests. It exits when nobody waits anymore.
+
+    Pollers only keep a weak reference to their client, so the shared
+    poller of a client goes away together with the client.
+    """
+
+    batch_size = 1000
+    min_interval = 2
+    max_interval = 15
+
+    _pollers = weakref.WeakKeyDictionary()
+    _pollers_lock = threading.Lock()
+
+    def __init__(self, client):
+        """Initialize poller.
+
+        Args:
+            client: boto3 EC2 client to poll with
+        """
+        self._log = logging.getLogger(__name__)
+        self._client = weakref.ref(client)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._waiters = {}
+        self._states = {}
+
+    @classmethod
+    def for_client(cls, client):
+        """Return the poller shared by all users of client.
+
+        Args:
+            client: boto3 EC2 client
+
+        Returns:
+            StatePoller object
+
+        """
+        with cls._pollers_lock:
+            poller = cls._pollers.get(client)
+            if poller is None:
+                poller = cls._pollers[client] = cls(client)
+            return poller
+
+    def wait(self, instance_id, state, timeout=600):
+        """Wait for an instance to reach a state.
+
+        Args:
+            instance_id: string, id of the instance
+            state: 'running', 'stopped' or 'terminated'
+            timeout: seconds to wait at most
+
+        Returns:
+            DescribeInstances description of the instance in that
+            state, None for terminated instances EC2 forgot already
+
+        Raises:
+            WaiterError: the instance reached a state it cannot get to
+                the desired one from, polling failed or timed out
+
+        """
+        return self.wait_all([instance_id], state, timeout)[0]
+
+    def wait_all(self, instance_ids, state, timeout=600):
+        """Wait for several instances to reach the same state.
+
+        All instances are polled for together from the start.
+
+        Args:
+            instance_ids: list of instance ids
+            state: 'running', 'stopped' or 'terminated'
+            timeout: seconds to wait at most for all instances
+
+        Returns:
+            list of descriptions as returned by wait(), in the order of
+            instance_ids
+
+        Raises:
+            WaiterError: as wait(), for the first instance failing
+
+        """
+        waiters = [(instance_id, _Waiter(state))
+                   for instance_id in instance_ids]
+        with self._lock:
+            for instance_id, waiter in waiters:
+                self._waiters.setdefault(instance_id, []).append(waiter)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+        deadline = time.monotonic() + timeout
+        try:
+            for instance_id, waiter in waiters:
+                waiter.done.wait(max(deadline - time.monotonic(), 0))
+                with self._lock:
+                    if not waiter.done.is_set():
+                        waiter.fail(
+                            'Max wait time of %s seconds exceeded' % timeout
+                        )
+                if waiter.error:
+                    raise WaiterError(
+                        name='instance_%s' % state,
+                        reason='%s: %s' % (instance_id, waiter.error),
+                        last_response=waiter.description or {}
+                    )
+        finally:
+            self._discard(waiters)
+        return [waiter.description for _, waiter in waiters]
+
+    def _run(self):
+        """Poll until nobody waits anymore."""
+        interval = self.min_interval
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self._thread = None
+                    return
+                instance_ids = list(self._waiters)
+            self._wakeup.clear()
+            polled = time.monotonic()
+
+            client = self._client()
+            if client is None:
+                self._fail(instance_ids, 'EC2 client was garbage collected')
+                continue
+            try:
+                descriptions = self._describe(client, instance_ids)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'RequestLimitExceeded':
+                    self._fail(instance_ids, str(e))
+                    continue
+                interval = min(interval * 2, self.max_interval)
+                self._log.debug('throttled, polling every %ss', interval)
+            except BotoCoreError as e:
+                interval = min(interval * 2, self.max_interval)
+                self._log.debug('polling failed, retrying in %ss: %s',
+                                interval, e)
+            else:
+                if self._dispatch(instance_ids, descriptions):
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * 1.5, self.max_interval)
+
+            # New waiters are polled for after min_interval at the latest
+            next_poll = polled + interval
+            while time.monotonic() < next_poll:
+                if self._wakeup.wait(next_poll - time.monotonic()):
+                    self._wakeup.clear()
+                    next_poll = min(next_poll, polled + self.min_interval)
+
+    def _describe(self, client, instance_ids):
+        """Describe instances in batches.
+
+        Instances EC2 does not know, e.g. just launched ones not visible
+        yet, are left out instead of failing the whole batch.
+
+        Args:
+            client: boto3 EC2 client to describe with
+            instance_ids: list of instance ids
+
+        Returns:
+            dictionary of instance id to description
+
+        """
+        descriptions = {}
+        for start in range(0, len(instance_ids), self.batch_size):
+            batch = instance_ids[start:start + self.batch_size]
+            while batch:
+                try:
+                    for instance in _describe_instances(
+                            client, InstanceIds=batch):
+                        descriptions[instance['InstanceId']] = instance
+                    break
+                except ClientError as e:
+                    error = e.response['Error']
+                    missing = set(re.findall(
+                        r'i-[0-9a-f]+', error.get('Message', '')
+                    ))
+                    if (error['Code'] != 'InvalidInstanceID.NotFound' or
+                            not missing.intersection(batch)):
+                        raise
+                    batch = [
+                        instance_id for instance_id in batch
+                        if instance_id not in missing
+                    ]
+        return descriptions
+
+    def _dispatch(self, instance_ids, descriptions):
+        """Hand polled states to the waiters.
+
+        Args:
+            instance_ids: list of instance ids polled
+            descriptions: dictionary of instance id to description
+
+        Returns:
+            boolean, True if any instance changed its state
+
+        """
+        changed = False
+        with self._lock:
+            for instance_id in instance_ids:
+                description = descriptions.get(instance_id)
+                state = description['State']['Name'] if description else None
+                if self._states.get(instance_id, False) != state:
+                    self._log.debug('%s is %s', instance_id, state)
+                    self._states[instance_id] = state
+                    changed = True
+
+                waiters = [
+                    waiter for waiter in self._waiters.get(instance_id, [])
+                    if not waiter.update(state, description)
+                ]
+                if waiters:
+                    self._waiters[instance_id] = waiters
+                else:
+                    self._waiters.pop(instance_id, None)
+                    self._states.pop(instance_id, None)
+        return changed
+
+    def _discard(self, waiters):
+        """Stop polling for waiters which are not done."""
+        with self._lock:
+            for instance_id, waiter in waiters:
+                remaining = [
+                    other for other in self._waiters.get(instance_id, [])
+                    if other is not waiter
+                ]
+                if remaining:
+                    self._waiters[instance_id] = remaining
+                else:
+                    self._waiters.pop(instance_id, None)
+                    self._states.pop(instance_id, None)
+
+    def _fail(self, instance_ids, error):
+        """End the waits for instance_ids with an error."""
+        with self._lock:
+            for instance_id in instance_ids:
+                for waiter in self._waiters.pop(instance_id, []):
+                    waiter.fail(error)
+                self._states.pop(instance_id, None)
@@ -47,6 +47,23 @@ def _decode_console_output_as_bytes(parsed, **kwargs):
     parsed['OutputBytes'] = base64.b64decode(orig)
 
 
+def _describe_instances(client, **kwargs):
+    """Describe instances over as many DescribeInstances pages as needed.
+
+    Args:
+        client: boto3 EC2 client
+        kwargs: DescribeInstances arguments
+
+    Yields:
+        instance descriptions
+
+    """
+    paginator = client.get_paginator('describe_instances')
+    for page in paginator.paginate(**kwargs):
+        for reservation in page['Reservations']:
+            yield from reservation['Instances']
+
+
 def _get_session(access_key_id, secret_access_key, region):
     """Get EC2 session.
 
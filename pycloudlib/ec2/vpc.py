@@ -1,12 +1,17 @@
 # This file is part of pycloudlib. See LICENSE file for license information.
 """Used to define custom Virtual Private Clouds (VPC)."""
 
+import functools
 import ipaddress
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from botocore.exceptions import ClientError
 
+from pycloudlib.ec2.poller import StatePoller
 from pycloudlib.ec2.util import _tag_resource
+from pycloudlib.util import backoff
 
 
 logger = logging.getLogger(__name__)
@@ -201,33 +206,95 @@ class VPC:
         return vpc
 
     def delete(self):
-        """Terminate all associated instances and delete an entire VPC."""
-        for instance in self.vpc.instances.all():
-            logger.debug('waiting for instance %s termination', instance.id)
-            instance.terminate()
-            instance.wait_until_terminated()
+        """Terminate all associated instances and delete an entire VPC.
 
-        for security_group in self.vpc.security_groups.all():
-            logger.debug(
-                'deleting security group %s', security_group.id
-            )
-            security_group.delete()
+        All instances are terminated with a single call and waited for
+        together. The remaining resources are then deleted in waves,
+        in parallel within each wave, each wave only holding resources
+        whose dependencies the previous waves removed:
 
-        for subnet in self.vpc.subnets.all():
-            logger.debug('deleting subnet %s', subnet.id)
-            subnet.delete()
+        1. security groups, subnets and the internet gateway
+        2. route tables, once no subnet is associated with them
+        3. the VPC itself
 
-        for route_table in self.vpc.route_tables.all():
-            logger.debug('deleting routing table %s', route_table.id)
-            route_table.delete()
+        Deletions EC2 rejects with DependencyViolation, e.g. while it
+        still releases network interfaces of terminated instances, are
+        retried for up to 5 minutes. The default security group and
+        the main route table are deleted along with the VPC.
+        """
+        client = self.vpc.meta.client
+        instance_ids = [instance.id for instance in self.vpc.instances.all()]
+        if instance_ids:
+            logger.debug('terminating instances %s', ', '.join(instance_ids))
+            client.terminate_instances(InstanceIds=instance_ids)
+            StatePoller.for_client(client).wait_all(
+                instance_ids, 'terminated'
+            )
 
+        waves = [[], [], []]
+        for security_group in self.vpc.security_groups.all():
+            if security_group.group_name != 'default':
+                waves[0].append(
+                    ('security group', security_group.id,
+                     security_group.delete)
+                )
+        for subnet in self.vpc.subnets.all():
+            waves[0].append(('subnet', subnet.id, subnet.delete))
         for gateway in self.vpc.internet_gateways.all():
-            logger.debug(
-                'deleting internet gateway %s', gateway.id
+            waves[0].append(
+                ('internet gateway', gateway.id,
+                 functools.partial(_delete_internet_gateway, gateway,
+                                   self.vpc.id))
             )
-            gateway.detach_from_vpc(VpcId=self.vpc.id)
-            gateway.delete()
-
-        if self.vpc:
-            logger.debug('deleting vpc %s', self.vpc.id)
-            self.vpc.delete()
+        for route_table in self.vpc.route_tables.all():
+            if not any(association.get('Main')
+                       for association in route_table.associations_attribute):
+                waves[1].append(
+                    ('routing table', route_table.id, route_table.delete)
+                )
+        waves[2].append(('vpc', self.vpc.id, self.vpc.delete))
+
+        for wave in waves:
+            _delete_parallel(wave)
+
+
+def _delete_internet_gateway(gateway, vpc_id):
+    """Detach an internet gateway from a VPC and delete it."""
+    gateway.detach_from_vpc(VpcId=vpc_id)
+    gateway.delete()
+
+
+def _delete_parallel(deletions, timeout=300):
+    """Run deletions in parallel, retrying on DependencyViolation.
+
+    Args:
+        deletions: list of (kind, id, function) tuples
+        timeout: seconds to retry each deletion for at most
+
+    Raises:
+        ClientError: of the first deletion failing, once all finished
+
+    """
+    def delete(kind, resource_id, function):
+        logger.debug('deleting %s %s', kind, resource_id)
+        deadline = time.time() + timeout
+        delays = backoff(initial=1, maximum=15)
+        while True:
+            try:
+                return function()
+            except ClientError as e:
+                delay = next(delays)
+                if (e.response['Error']['Code'] != 'DependencyViolation' or
+                        time.time() + delay >= deadline):
+                    raise
+                logger.debug('%s %s still in use, retrying in %.1fs',
+                             kind, resource_id, delay)
+            time.sleep(delay)
+
+    if not deletions:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(deletions), 8)) as executor:
+        futures = [executor.submit(delete, *deletion)
+                   for deletion in deletions]
+    for future in futures:
+        future.result()
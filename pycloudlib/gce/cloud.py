@@ -13,7 +13,6 @@ import googleapiclient.discovery
 
 from pycloudlib.cloud import BaseCloud
 from pycloudlib.key import KeyPair
-from pycloudlib.streams import Streams
 
 logging.getLogger('googleapiclient.discovery').setLevel(logging.WARNING)
 
@@ -214,12 +213,7 @@ class GCE(BaseCloud):
             'virt=kvm'
         ]
 
-        stream = Streams(
-            mirror_url='https://cloud-images.ubuntu.com/daily',
-            keyring_path='/usr/share/keyrings/ubuntu-cloudimage-keyring.gpg'
-        )
-
-        return stream.query(filters)
+        return self._streams_query(filters, daily=True, latest=1)
 
     def _wait_for_operation(self, operation):
         """TODO."""
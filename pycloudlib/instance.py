@@ -2,24 +2,29 @@
 """Base class for all instances to provide consistent set of functions."""
 
 from abc import ABC, abstractmethod, abstractproperty
+import io
 import logging
-import time
-
-import paramiko
-from paramiko.ssh_exception import (
-    AuthenticationException,
-    BadHostKeyException,
-    NoValidConnectionsError,
-    PasswordRequiredException,
-    SSHException
+import tempfile
+import threading
+
+from paramiko.ssh_exception import SSHException
+
+from pycloudlib.agent import ExecAgent
+from pycloudlib.job import Job
+from pycloudlib.result import BytesResult, Result
+from pycloudlib.ssh import SSHMixin
+from pycloudlib.transfer import TransferMixin
+from pycloudlib.util import (
+    collect_stream, shell_quote, shell_safe, subp, subp_stream
 )
 
-from pycloudlib.result import Result
-from pycloudlib.util import shell_quote, shell_pack, subp
 
+class BaseInstance(SSHMixin, TransferMixin, ABC):
+    """Base instance object.
 
-class BaseInstance(ABC):
-    """Base instance object."""
+    Running commands over SSH comes from pycloudlib.ssh.SSHMixin, file
+    and directory transfers from pycloudlib.transfer.TransferMixin.
+    """
 
     _type = 'base'
 
@@ -27,7 +32,15 @@ class BaseInstance(ABC):
         """Set up instance."""
         self._log = logging.getLogger(__name__)
         self._ssh_client = None
+        self._ssh_client_key = None
         self._sftp_client = None
+        self._agent = None
+        self._ssh_prewarm = None
+        self._ssh_prewarm_cancel = None
+        self._ssh_prewarm_done = None
+        self._ssh_prewarm_span = None
+        self._ssh_lock = threading.RLock()
+        self._open_channels = {}
         self._tmp_count = 0
 
         self.boot_timeout = 120
@@ -35,6 +48,27 @@ class BaseInstance(ABC):
         self.port = '22'
         self.username = 'ubuntu'
         self.connect_timeout = 60
+        self.ssh_timeout = 600
+        self.ssh_ready_time = None
+        # Seconds of connecting prewarm_ssh() did before the connection
+        # was first needed
+        self.ssh_prewarm_saved = None
+        self.max_channels = 10
+
+        # Files of at least sftp_parallel_size bytes are moved in
+        # sftp_workers ranges over separate SFTP channels. Window and
+        # packet sizes default to paramiko's when None.
+        self.sftp_workers = 4
+        self.sftp_parallel_size = 64 * 1024 * 1024
+        self.sftp_window_size = None
+        self.sftp_max_packet_size = None
+
+        # Bytes of output execute(binary=True) keeps in memory per stream
+        self.output_spool_size = 16 * 1024 * 1024
+
+        # Run execute() over SSH through an ExecAgent helper process,
+        # see pycloudlib.agent
+        self.use_agent = False
 
     @property
     @abstractmethod
@@ -101,6 +135,9 @@ class BaseInstance(ABC):
 
     def __del__(self):
         """Cleanup of instance."""
+        if self._agent:
+            self._agent.close()
+            self._agent = None
         if self._sftp_client:
             try:
                 self._sftp_client.close()
@@ -108,10 +145,9 @@ class BaseInstance(ABC):
                 self._log.warning('Failed to close SFTP connection.')
             self._sftp_client = None
         if self._ssh_client:
-            try:
-                self._ssh_client.close()
-            except SSHException:
-                self._log.warning('Failed to close SSH connection.')
+            self.ssh_connections.release(
+                self._ssh_client_key, self._ssh_client
+            )
             self._ssh_client = None
 
     def clean(self):
@@ -122,23 +158,42 @@ class BaseInstance(ABC):
         self.execute('sudo cloud-init clean --logs')
         self.execute('sudo rm -rf /var/log/syslog')
 
-    def execute(self, command, stdin=None, description=None):
+    def execute(self, command, stdin=None, description=None,
+                binary=False, timeout=None, cancel=None):
         """Execute command in instance, recording output, error and exit code.
 
         Assumes functional networking and execution with the target filesystem
         being available at /.
 
+        With use_agent set, commands over SSH without binary, timeout
+        or cancel run through a persistent helper process instead of a
+        channel and shell of their own, one at a time. The helper keeps
+        a channel open, so it is only used while max_channels leaves at
+        least one more for other commands and transfers.
+
         Args:
             command: the command to execute as root inside the image. If
                      command is a string, then it will be executed as:
                      `['sh', '-c', command]`
             stdin: bytes content for standard in
             description: purpose of command
+            binary: return a BytesResult keeping the raw output, output
+                    beyond output_spool_size bytes is kept on disk
+            timeout: optional, seconds after which the command is stopped
+            cancel: optional, CancelToken stopping the command once
+                    cancelled from another thread
 
         Returns:
-            Result object
+            Result object, or BytesResult object if binary is set. A
+            stopped command has a return_code of None, the output it
+            produced so far and timed_out or cancelled set.
 
         """
+        if binary or timeout is not None or cancel is not None:
+            return self._execute_collect(
+                command, stdin, description, binary, timeout, cancel
+            )
+
         if isinstance(command, str):
             command = ['sh', '-c', command]
 
@@ -159,8 +214,113 @@ class BaseInstance(ABC):
             base_cmd = ['multipass', 'exec', self.name, '--']
             return subp(base_cmd + list(command), shortcircuit_stdin=False)
 
+        if self.use_agent and self.max_channels > 1:
+            with self._ssh_lock:
+                if self._agent is None:
+                    self._agent = ExecAgent(self)
+            return self._agent.run(list(command), stdin=stdin)
+
         return self._ssh(list(command), stdin=stdin)
 
+    def execute_stream(self, command, stdin=None, description=None,
+                       lines=False, timeout=None, cancel=None):
+        """Execute command in instance, yielding output as it arrives.
+
+        Unlike execute(), output is never collected in memory, which
+        allows following long running commands and huge outputs.
+
+        Args:
+            command: the command to execute as root inside the image. If
+                     command is a string, then it will be executed as:
+                     `['sh', '-c', command]`
+            stdin: bytes content or binary file object for standard in,
+                   file objects are read as the command consumes them
+            description: purpose of command
+            lines: yield complete lines instead of arbitrary chunks
+            timeout: optional, seconds after which the command is stopped
+            cancel: optional, CancelToken stopping the command once
+                    cancelled from another thread
+
+        Yields:
+            ('stdout', bytes) and ('stderr', bytes) tuples, followed by a
+            final ('exit', return_code) tuple. return_code is None when
+            the command was stopped by timeout or cancel.
+
+        """
+        if isinstance(command, str):
+            command = ['sh', '-c', command]
+
+        self._log.info('executing: %s', shell_quote(command))
+        if description:
+            self._log.debug(description)
+
+        if self._type == 'lxd':
+            base_cmd = ['lxc', 'exec', self.name, '--']
+            stream = subp_stream(
+                base_cmd + list(command), data=stdin, timeout=timeout,
+                cancel=cancel
+            )
+        elif self._type == 'kvm':
+            base_cmd = ['multipass', 'exec', self.name, '--']
+            stream = subp_stream(
+                base_cmd + list(command), data=stdin,
+                shortcircuit_stdin=False, timeout=timeout, cancel=cancel
+            )
+        else:
+            stream = self._ssh_stream(
+                list(command), stdin=stdin, timeout=timeout, cancel=cancel
+            )
+
+        if lines:
+            stream = _stream_lines(stream)
+        yield from stream
+
+    def execute_many(self, commands, description=None):
+        """Execute several commands in a single round trip.
+
+        All commands run one after the other, each in its own subshell
+        with stdin bound to /dev/null, within one execute() on the
+        instance. Output is framed per command, so every command gets its
+        own Result, which saves a channel and a round trip per command
+        over calling execute() repeatedly.
+
+        Args:
+            commands: list of commands, each a string or a list as
+                      accepted by execute()
+            description: purpose of commands
+
+        Returns:
+            list of Result objects, one per command
+
+        """
+        commands = [
+            ['sh', '-c', command] if isinstance(command, str) else command
+            for command in commands
+        ]
+        script = ['d=$(mktemp -d) || exit 1', 'trap \'rm -rf "$d"\' EXIT']
+        for command in commands:
+            self._log.debug('batching: %s', shell_quote(command))
+            script.append(
+                '(%s) </dev/null >"$d/out" 2>"$d/err"; rc=$?' %
+                shell_safe(command)
+            )
+            script.append(
+                'echo "$rc $(($(wc -c <"$d/out"))) $(($(wc -c <"$d/err")))"'
+                ' && cat "$d/out" "$d/err"'
+            )
+
+        out, err, return_code = collect_stream(self.execute_stream(
+            '\n'.join(script), description=description
+        ))
+        results = _parse_frames(out, len(commands))
+        if return_code != 0 or len(results) != len(commands):
+            raise RuntimeError(
+                'Failed to execute command batch (rc=%s): %s' % (
+                    return_code, err.decode('utf-8', 'replace')
+                )
+            )
+        return results
+
     def install(self, packages):
         """Install specific packages.
 
@@ -182,29 +342,50 @@ class BaseInstance(ABC):
             ] + packages
         )
 
-    def pull_file(self, remote_path, local_path):
-        """Copy file at 'remote_path', from instance to 'local_path'.
+    def spawn(self, command, description=None):
+        """Start command detached on the instance.
 
-        Args:
-            remote_path: path on remote instance
-            local_path: local path
-        """
-        self._log.debug('pulling file %s to %s', remote_path, local_path)
+        The command runs in a new session with stdin bound to /dev/null
+        and its output written to files on the instance, so it keeps
+        running without a connection and survives dropped ones.
 
-        sftp = self._sftp_connect()
-        sftp.get(remote_path, local_path)
+        Args:
+            command: the command to execute as root inside the image. If
+                     command is a string, then it will be executed as:
+                     `['sh', '-c', command]`
+            description: purpose of command
 
-    def push_file(self, local_path, remote_path):
-        """Copy file at 'local_path' to instance at 'remote_path'.
+        Returns:
+            Job object to follow the command with
 
-        Args:
-            local_path: local path
-            remote_path: path on remote instance
         """
-        self._log.debug('pushing file %s to %s', local_path, remote_path)
+        if isinstance(command, str):
+            command = ['sh', '-c', command]
 
-        sftp = self._sftp_connect()
-        sftp.put(local_path, remote_path)
+        # The wrapper outlives signals sent to the job's process group
+        # by Job.kill(), so that it still records the exit code
+        job_script = (
+            'd=$1; shift; trap : HUP INT TERM; '
+            '"$@" >"$d/out" 2>"$d/err" & p=$!; '
+            'while :; do wait $p; rc=$?; kill -0 $p 2>/dev/null || break; '
+            'done; echo $rc >"$d/rc.tmp"; mv "$d/rc.tmp" "$d/rc"'
+        )
+        result = self.execute(
+            'd=$(mktemp -d /tmp/pycloudlib-job.XXXXXX) || exit 1; '
+            'setsid sh -c %s job "$d" %s </dev/null >/dev/null 2>&1 & '
+            'echo "$! $d"' % (shell_safe([job_script]), shell_safe(command)),
+            description=description or 'spawning %s' % shell_quote(command)
+        )
+        if result.failed:
+            raise RuntimeError(
+                'Failed to spawn command (rc=%s): %s' % (
+                    result.return_code, result.stderr
+                )
+            )
+        pid, path = result.stdout.split(' ', 1)
+        self._log.debug('spawned job %s in %s: %s', pid, path,
+                        shell_quote(command))
+        return Job(self, int(pid), path)
 
     def run_script(self, script, description=None):
         """Run script in target and return stdout.
@@ -243,110 +424,61 @@ class BaseInstance(ABC):
             'sudo', 'apt-get', '--yes', 'upgrade'
         ])
 
-    def _ssh(self, command, stdin=None):
-        """Run a command via SSH.
+    def _execute_collect(self, command, stdin=None, description=None,
+                         binary=False, timeout=None, cancel=None):
+        """Execute command, collecting its streamed output.
 
         Args:
-            command: string or list of the command to run
-            stdin: optional, values to be passed in
+            command: command as accepted by execute()
+            stdin: bytes content for standard in
+            description: purpose of command
+            binary: collect output into spooled files for a BytesResult
+            timeout: optional, seconds after which the command is stopped
+            cancel: optional, CancelToken stopping the command
 
         Returns:
-            tuple of stdout, stderr and the return code
+            Result object, or BytesResult object if binary is set
 
         """
-        cmd = shell_pack(command)
-        for _ in range(10):
-            try:
-                client = self._ssh_connect()
-                fp_in, fp_out, fp_err = client.exec_command(cmd)
-                break
-            except (ConnectionResetError, NoValidConnectionsError) as e:
-                last_error = e
-            # On OCI instances, attempting to re-connect without a longer
-            # sleep leaves you locked out of ssh completely
-            time.sleep(5)
+        if binary:
+            out = tempfile.SpooledTemporaryFile(
+                max_size=self.output_spool_size
+            )
+            err = tempfile.SpooledTemporaryFile(
+                max_size=self.output_spool_size
+            )
         else:
-            raise last_error  # noqa
-        channel = fp_in.channel
-
-        if stdin is not None:
-            fp_in.write(stdin)
-            fp_in.close()
-
-        channel.shutdown_write()
-
-        out = fp_out.read()
-        err = fp_err.read()
-        return_code = channel.recv_exit_status()
-
-        out = '' if not out else out.rstrip().decode("utf-8")
-        err = '' if not err else err.rstrip().decode("utf-8")
-
-        return Result(out, err, return_code)
-
-    def _ssh_connect(self):
-        """Connect to instance via SSH."""
-        if self._ssh_client and self._ssh_client.get_transport().is_active():
-            return self._ssh_client
-
-        logging.getLogger("paramiko").setLevel(logging.INFO)
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        # Paramiko can barf on valid keys when initializing this way,
-        # so the check here is _only_ for checking if we have a
-        # password protected keyfile. The filename is passed directly
-        # when connecting
+            out = io.BytesIO()
+            err = io.BytesIO()
         try:
-            paramiko.RSAKey.from_private_key_file(
-                self.key_pair.private_key_path)
-        except PasswordRequiredException:
-            self._log.error('RSA Key requires password!')
+            for name, data in self.execute_stream(
+                    command, stdin=stdin, description=description,
+                    timeout=timeout, cancel=cancel):
+                if name == 'stdout':
+                    out.write(data)
+                elif name == 'stderr':
+                    err.write(data)
+                else:
+                    return_code = data
+        except BaseException:
+            out.close()
+            err.close()
             raise
-        except SSHException:
-            pass
-
-        retries = 60
-        last_exception = None
-        while retries:
-            try:
-                client.connect(
-                    username=self.username,
-                    hostname=self.ip,
-                    port=int(self.port),
-                    timeout=self.connect_timeout,
-                    key_filename=self.key_pair.private_key_path,
-                )
-                self._ssh_client = client
-                return client
-            except (ConnectionRefusedError, AuthenticationException,
-                    BadHostKeyException, ConnectionResetError, SSHException,
-                    OSError) as e:
-                self._log.info(
-                    "%s\nRetrying ssh connection %d more time(s) to  %s@%s:%s",
-                    e, retries, self.username, self.ip, self.port
-                )
-                last_exception = e
-                retries -= 1
-                time.sleep(10)
 
-        self._log.error('Failed ssh connection to %s@%s:%s after 10 minutes',
-                        self.username, self.ip, self.port)
-        raise last_exception
-
-    def _sftp_connect(self):
-        """Connect to instance via SFTP."""
-        if (self._sftp_client and
-                self._sftp_client.get_channel().get_transport().is_active()):
-            return self._sftp_client
-
-        logging.getLogger("paramiko").setLevel(logging.INFO)
-
-        # _ssh_connect() implements the required retry logic.
-        client = self._ssh_connect()
-        sftpclient = client.open_sftp()
-        self._sftp_client = sftpclient
-        return sftpclient
+        stopped = {}
+        if return_code is None:
+            cancelled = cancel is not None and cancel.cancelled
+            stopped = {'timed_out': not cancelled, 'cancelled': cancelled}
+            self._log.warning('command %s: %s',
+                              'cancelled' if cancelled else 'timed out',
+                              command)
+        if binary:
+            return BytesResult(out, err, return_code, **stopped)
+        return Result(
+            out.getvalue().rstrip().decode('utf-8'),
+            err.getvalue().rstrip().decode('utf-8'),
+            return_code, **stopped
+        )
 
     def _tmpfile(self):
         """Get a tmp file in the target.
@@ -355,8 +487,9 @@ class BaseInstance(ABC):
             path to new file in target
 
         """
-        path = "/tmp/%s-%04d" % (type(self).__name__, self._tmp_count)
-        self._tmp_count += 1
+        with self._ssh_lock:
+            path = "/tmp/%s-%04d" % (type(self).__name__, self._tmp_count)
+            self._tmp_count += 1
         return path
 
     def _wait_for_system(self):
@@ -383,3 +516,60 @@ class BaseInstance(ABC):
                      result.stdout, result.stderr
                 )
             )
+
+
+def _parse_frames(output, count):
+    """Split the framed output of execute_many() into Results.
+
+    Each frame is a '<rc> <stdout length> <stderr length>' line followed
+    by the raw stdout and stderr of one command.
+
+    Args:
+        output: bytes, framed output
+        count: number of frames expected
+
+    Returns:
+        list of the Result objects which could be parsed
+
+    """
+    results = []
+    position = 0
+    while len(results) < count:
+        header_end = output.find(b'\n', position)
+        if header_end < 0:
+            break
+        return_code, out_len, err_len = (
+            int(value) for value in output[position:header_end].split()
+        )
+        out_start = header_end + 1
+        err_start = out_start + out_len
+        position = err_start + err_len
+        out = output[out_start:err_start].rstrip().decode('utf-8')
+        err = output[err_start:position].rstrip().decode('utf-8')
+        results.append(Result(out, err, return_code))
+    return results
+
+
+def _stream_lines(stream):
+    """Regroup an execute_stream() stream into complete lines.
+
+    Args:
+        stream: iterable of (name, data) tuples
+
+    Yields:
+        the same tuples with data split into lines, keeping line endings.
+        Incomplete trailing lines are yielded before the exit tuple.
+
+    """
+    partial = {}
+    for name, data in stream:
+        if name == 'exit':
+            for buffered_name in ('stdout', 'stderr'):
+                if partial.get(buffered_name):
+                    yield buffered_name, partial[buffered_name]
+            yield name, data
+            return
+        chunk_lines = (partial.pop(name, b'') + data).split(b'\n')
+        partial[name] = chunk_lines.pop()
+        for line in chunk_lines:
+            yield name, line + b'\n'
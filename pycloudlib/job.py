@@ -0,0 +1,149 @@
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""Handle of a command running detached on an instance."""
+
+import logging
+import time
+
+from paramiko.ssh_exception import SSHException
+
+from pycloudlib.result import Result
+from pycloudlib.util import backoff
+
+
+class Job:
+    """Command started by BaseInstance.spawn().
+
+    The command runs in its own session on the instance, with stdout,
+    stderr and eventually its exit code written to files in a job
+    directory. No connection is held while it runs. Every method runs a
+    short command of its own, reconnecting as needed, so a controller
+    can follow many jobs and outlive dropped connections.
+
+    A Job can be recreated from its pid and path, e.g. by another
+    process.
+    """
+
+    def __init__(self, instance, pid, path):
+        """Initialize job handle.
+
+        Args:
+            instance: BaseInstance the job runs on
+            pid: process id of the job's session leader
+            path: job directory on the instance
+        """
+        self._log = logging.getLogger(__name__)
+        self.instance = instance
+        self.pid = pid
+        self.path = path
+        self.return_code = None
+
+    def __repr__(self):
+        """Create string representation of class."""
+        return 'Job(instance={}, pid={}, path={})'.format(
+            self.instance.name, self.pid, self.path
+        )
+
+    def poll(self):
+        """Check whether the job finished.
+
+        Returns:
+            exit code of the job, or None while it is running
+
+        """
+        if self.return_code is None:
+            result = self.instance.execute(
+                ['cat', '%s/rc' % self.path],
+                description='polling job %s' % self.pid
+            )
+            if result.ok and result.stdout:
+                self.return_code = int(result.stdout)
+        return self.return_code
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish.
+
+        Polls with exponentially growing intervals of up to 30 seconds.
+        Connection errors while polling are logged and retried.
+
+        Args:
+            timeout: optional, seconds to wait at most
+
+        Returns:
+            exit code of the job
+
+        Raises:
+            TimeoutError: the job did not finish within timeout
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        delays = backoff(initial=1, maximum=30)
+        while True:
+            try:
+                if self.poll() is not None:
+                    return self.return_code
+            except (SSHException, OSError) as e:
+                self._log.info('Failed to poll job %s, retrying: %s',
+                               self.pid, e)
+            delay = next(delays)
+            if deadline is not None:
+                if time.time() >= deadline:
+                    raise TimeoutError(
+                        'Job %s still running after %s seconds' % (
+                            self.pid, timeout
+                        )
+                    )
+                delay = min(delay, max(0, deadline - time.time()))
+            time.sleep(delay)
+
+    def tail(self, lines=10, stderr=False):
+        """Return the last lines of the job output so far.
+
+        Args:
+            lines: number of lines to return
+            stderr: read stderr instead of stdout
+
+        Returns:
+            string with the last lines
+
+        """
+        return self.instance.execute(
+            ['tail', '-n', str(lines),
+             '%s/%s' % (self.path, 'err' if stderr else 'out')],
+            description='tailing job %s' % self.pid
+        ).stdout
+
+    def result(self, timeout=None):
+        """Wait for the job to finish and collect its output.
+
+        Args:
+            timeout: optional, seconds to wait at most
+
+        Returns:
+            Result object of the job
+
+        Raises:
+            TimeoutError: the job did not finish within timeout
+
+        """
+        return_code = self.wait(timeout)
+        out = self.instance.read_bytes('%s/out' % self.path)
+        err = self.instance.read_bytes('%s/err' % self.path)
+        return Result(
+            out.rstrip().decode('utf-8'), err.rstrip().decode('utf-8'),
+            return_code
+        )
+
+    def kill(self, signal='TERM'):
+        """Send a signal to every process of the job.
+
+        Args:
+            signal: name of the signal to send
+        """
+        self.instance.execute(
+            ['kill', '-s', signal, '--', '-%d' % self.pid],
+            description='killing job %s' % self.pid
+        )
+
+    def cleanup(self):
+        """Remove the job directory from the instance."""
+        self.instance.execute(['rm', '-rf', '--', self.path])
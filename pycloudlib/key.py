@@ -1,6 +1,16 @@
 # This file is part of pycloudlib. See LICENSE file for license information.
 """Base Key Class."""
 
+import io
+
+import paramiko
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from paramiko.ssh_exception import PasswordRequiredException, SSHException
+
+# Key types tried, in order, when parsing a private key file
+_KEY_CLASSES = (paramiko.RSAKey, paramiko.ECDSAKey, paramiko.Ed25519Key)
+
 
 class KeyPair:
     """Key Class."""
@@ -21,8 +31,13 @@ class KeyPair:
         self.public_key_path = public_key_path
         if private_key_path:
             self.private_key_path = private_key_path
-        else:
+        elif public_key_path:
             self.private_key_path = self.public_key_path.replace('.pub', '')
+        else:
+            self.private_key_path = None
+        self._private_key = None
+        self._private_key_loaded = False
+        self._public_key_content = None
 
     def __str__(self):
         """Create string representation of class."""
@@ -30,6 +45,65 @@ class KeyPair:
             self.private_key_path, self.public_key_path, self.name
         )
 
+    @classmethod
+    def generate(cls, name=None):
+        """Generate an ed25519 key pair held only in memory.
+
+        Ed25519 authentication is considerably cheaper than with large
+        RSA keys, which makes a key generated per run a good fit for
+        clouds taking the public key content at launch.
+
+        Args:
+            name: Name to reference key by in clouds
+
+        Returns:
+            KeyPair without paths on disk
+
+        """
+        private_pem = ed25519.Ed25519PrivateKey.generate().private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.OpenSSH,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        key = paramiko.Ed25519Key(file_obj=io.StringIO(private_pem.decode()))
+
+        key_pair = cls(None, name=name)
+        key_pair._private_key = key
+        key_pair._private_key_loaded = True
+        key_pair._public_key_content = '%s %s\n' % (
+            key.get_name(), key.get_base64()
+        )
+        return key_pair
+
+    @property
+    def private_key(self):
+        """Parsed private key, loaded from disk on first access.
+
+        RSA, ECDSA and ed25519 keys are supported.
+
+        Returns:
+            paramiko PKey, or None if paramiko cannot parse the file, in
+            which case it is left to paramiko to load it from
+            private_key_path when connecting
+
+        Raises:
+            PasswordRequiredException: the key file is encrypted
+
+        """
+        if not self._private_key_loaded:
+            for key_class in _KEY_CLASSES:
+                try:
+                    self._private_key = key_class.from_private_key_file(
+                        self.private_key_path
+                    )
+                    break
+                except PasswordRequiredException:
+                    raise
+                except SSHException:
+                    continue
+            self._private_key_loaded = True
+        return self._private_key
+
     @property
     def public_key_content(self):
         """Read the contents of the public key.
@@ -38,4 +112,7 @@ class KeyPair:
             output of public key
 
         """
-        return open(self.public_key_path).read()
+        if self._public_key_content is None:
+            with open(self.public_key_path) as public_key:
+                self._public_key_content = public_key.read()
+        return self._public_key_content
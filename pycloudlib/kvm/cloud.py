@@ -205,7 +205,7 @@ class KVM(BaseCloud):  # pylint: disable=W0223
             'release=%s' % release,
         ]
 
-        return self._streams_query(filters, daily)[0]
+        return self._streams_query(filters, daily, latest=1)[0]
 
     def _get_instance_types(self):
         if self._instance_types:
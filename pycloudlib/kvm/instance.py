@@ -2,6 +2,7 @@
 """LXD instance."""
 
 import json
+import os
 
 from pycloudlib.instance import BaseInstance
 from pycloudlib.util import subp
@@ -73,20 +74,25 @@ class KVMInstance(BaseInstance):
         self._log.debug('deleting %s', self.name)
         subp(['multipass', 'delete', '--purge', self.name])
 
-    def pull_file(self, remote_path, local_path):
+    def pull_file(self, remote_path, local_path, callback=None):
         """Pull file from an instance.
 
         Args:
             remote_path: path to remote file to pull down
             local_path: local path to put the file
+            callback: optional, called with the bytes transferred and
+                      the total bytes once the file was pulled
         """
         self._log.debug('pulling file %s to %s', remote_path, local_path)
         result = subp(['multipass', 'transfer', '%s:%s' %
                        (self.name, remote_path), local_path])
         if result.failed:
             raise RuntimeError(result.stderr)
+        if callback:
+            size = os.path.getsize(local_path)
+            callback(size, size)
 
-    def push_file(self, local_path, remote_path):
+    def push_file(self, local_path, remote_path, callback=None):
         """Push file to an instance.
 
         The remote path must be absolute path with LXD due to the way
@@ -96,12 +102,17 @@ class KVMInstance(BaseInstance):
         Args:
             local_path: local path to file to push up
             remote_path: absolute path to push file
+            callback: optional, called with the bytes transferred and
+                      the total bytes once the file was pushed
         """
         self._log.debug('pushing file %s to %s', local_path, remote_path)
         result = subp(['multipass', 'transfer', local_path,
                        '%s:%s' % (self.name, remote_path)])
         if result.failed:
             raise RuntimeError(result.stderr)
+        if callback:
+            size = os.path.getsize(local_path)
+            callback(size, size)
 
     def restart(self, wait=True):
         """Restart an instance."""
@@ -270,4 +270,4 @@ class LXD(BaseCloud):
             'release=%s' % release,
         ]
 
-        return self._streams_query(filters, daily)[0]
+        return self._streams_query(filters, daily, latest=1)[0]
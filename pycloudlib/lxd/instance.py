@@ -1,5 +1,6 @@
 # This file is part of pycloudlib. See LICENSE file for license information.
 """LXD instance."""
+import os
 import re
 
 from pycloudlib.instance import BaseInstance
@@ -128,7 +129,7 @@ class LXDInstance(BaseInstance):
         self._log.debug('editing %s with %s=%s', self.name, key, value)
         subp(['lxc', 'config', 'set', self.name, key, value])
 
-    def pull_file(self, remote_path, local_path):
+    def pull_file(self, remote_path, local_path, callback=None):
         """Pull file from an instance.
 
         The remote path must be absolute path with LXD due to the way
@@ -138,6 +139,8 @@ class LXDInstance(BaseInstance):
         Args:
             remote_path: path to remote file to pull down
             local_path: local path to put the file
+            callback: optional, called with the bytes transferred and
+                      the total bytes once the file was pulled
         """
         self._log.debug('pulling file %s to %s', remote_path, local_path)
 
@@ -148,8 +151,11 @@ class LXDInstance(BaseInstance):
 
         subp(['lxc', 'file', 'pull', '%s%s' %
               (self.name, remote_path), local_path])
+        if callback:
+            size = os.path.getsize(local_path)
+            callback(size, size)
 
-    def push_file(self, local_path, remote_path):
+    def push_file(self, local_path, remote_path, callback=None):
         """Push file to an instance.
 
         The remote path must be absolute path with LXD due to the way
@@ -159,6 +165,8 @@ class LXDInstance(BaseInstance):
         Args:
             local_path: local path to file to push up
             remote_path: path to push file
+            callback: optional, called with the bytes transferred and
+                      the total bytes once the file was pushed
         """
         self._log.debug('pushing file %s to %s', local_path, remote_path)
 
@@ -169,6 +177,9 @@ class LXDInstance(BaseInstance):
 
         subp(['lxc', 'file', 'push', local_path,
               '%s%s' % (self.name, remote_path)])
+        if callback:
+            size = os.path.getsize(local_path)
+            callback(size, size)
 
     def restart(self, wait=True):
         """Restart an instance.
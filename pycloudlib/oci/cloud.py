@@ -174,10 +174,8 @@ class OCI(BaseCloud):
         subnet_id = subnet.id
         availability_domain = subnet.availability_domain
 
-        with open(self.key_pair.public_key_path) as f:
-            key_data = f.read()
         metadata = {
-            'ssh_authorized_keys': key_data,
+            'ssh_authorized_keys': self.key_pair.public_key_content,
         }
         if user_data:
             metadata['user_data'] = base64.b64encode(
@@ -202,7 +200,9 @@ class OCI(BaseCloud):
                 current_data=instance_data,
                 desired_state='RUNNING',
             )
-        return self.get_instance(instance_data.id)
+        instance = self.get_instance(instance_data.id)
+        instance.prewarm_ssh()
+        return instance
 
     def snapshot(self, instance, clean=True, name=None):
         """Snapshot an instance and generate an image from it.
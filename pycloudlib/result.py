@@ -1,19 +1,29 @@
 # This file is part of pycloudlib. See LICENSE file for license information.
 """Base Result Class."""
 
+import io
+
 
 class Result(str):  # pylint: disable=too-many-ancestors
-    """Result Class."""
+    """Result Class.
+
+    Commands stopped before they exited have a return_code of None and
+    timed_out or cancelled set.
+    """
 
-    def __init__(self, stdout, stderr='', return_code=0):
+    def __init__(self, stdout, stderr='', return_code=0, timed_out=False,
+                 cancelled=False):
         """Initialize class."""
         super().__init__()
 
         self.stdout = stdout
         self.stderr = stderr
         self.return_code = return_code
+        self.timed_out = timed_out
+        self.cancelled = cancelled
 
-    def __new__(cls, stdout, stderr, return_code):
+    def __new__(cls, stdout, stderr, return_code, timed_out=False,
+                cancelled=False):
         """Create new class."""
         obj = str.__new__(cls, stdout)
         obj.stderr = stderr
@@ -35,3 +45,98 @@ class Result(str):  # pylint: disable=too-many-ancestors
         if self.return_code == 0:
             return True
         return False
+
+
+class BytesResult:
+    """Result keeping the raw output bytes of a command.
+
+    Output is decoded only when stdout or stderr are accessed, non-UTF-8
+    sequences being replaced. Output larger than the spool size of the
+    underlying files lives in temporary files on disk, which
+    stdout_file() and stderr_file() expose for streaming or mmap.
+    """
+
+    def __init__(self, stdout=b'', stderr=b'', return_code=0,
+                 timed_out=False, cancelled=False):
+        """Initialize class.
+
+        Args:
+            stdout: bytes or binary file object holding stdout
+            stderr: bytes or binary file object holding stderr
+            return_code: exit code of the command, None if it was stopped
+            timed_out: the command was stopped by a timeout
+            cancelled: the command was stopped by a CancelToken
+        """
+        self._stdout = _as_file(stdout)
+        self._stderr = _as_file(stderr)
+        self.return_code = return_code
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    def __bool__(self):
+        """Boolean behavior."""
+        return self.ok
+
+    def __enter__(self):
+        """Use as context manager closing the output files."""
+        return self
+
+    def __exit__(self, *_args):
+        """Close the output files."""
+        self.close()
+
+    def __str__(self):
+        """Return decoded stdout, as Result does."""
+        return self.stdout
+
+    @property
+    def failed(self):
+        """Return boolean if result was failure."""
+        return not self.ok
+
+    @property
+    def ok(self):
+        """Return boolean if result was success."""
+        return self.return_code == 0
+
+    @property
+    def stdout(self):
+        """Decoded stdout without trailing whitespace."""
+        return self.stdout_bytes.rstrip().decode('utf-8', 'replace')
+
+    @property
+    def stderr(self):
+        """Decoded stderr without trailing whitespace."""
+        return self.stderr_bytes.rstrip().decode('utf-8', 'replace')
+
+    @property
+    def stdout_bytes(self):
+        """Raw stdout bytes."""
+        return self.stdout_file().read()
+
+    @property
+    def stderr_bytes(self):
+        """Raw stderr bytes."""
+        return self.stderr_file().read()
+
+    def stdout_file(self):
+        """Return a binary file object of stdout, rewound to its start."""
+        self._stdout.seek(0)
+        return self._stdout
+
+    def stderr_file(self):
+        """Return a binary file object of stderr, rewound to its start."""
+        self._stderr.seek(0)
+        return self._stderr
+
+    def close(self):
+        """Close the output files, removing any temporary files."""
+        self._stdout.close()
+        self._stderr.close()
+
+
+def _as_file(output):
+    """Wrap bytes output in a file object."""
+    if isinstance(output, (bytes, bytearray)):
+        return io.BytesIO(output)
+    return output
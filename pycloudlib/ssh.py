@@ -0,0 +1,527 @@
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""SSH connections and channels of instances."""
+
+import logging
+import select
+import socket
+import threading
+import time
+
+import paramiko
+from paramiko.ssh_exception import (
+    AuthenticationException,
+    BadHostKeyException,
+    NoValidConnectionsError,
+    PasswordRequiredException,
+    SSHException
+)
+
+from pycloudlib.connection import ConnectionCache, is_active
+from pycloudlib.result import Result
+from pycloudlib.util import (
+    CancelToken, Deadline, backoff, collect_stream, probe_ssh, shell_pack
+)
+
+
+class SSHMixin:
+    """Run commands on an instance over a shared SSH connection.
+
+    Mixed into BaseInstance, which sets up the connection state and
+    settings in its __init__.
+    """
+
+    # SSH connections shared by all instances of the process
+    ssh_connections = ConnectionCache()
+
+    @property
+    def max_channels(self):
+        """Maximum number of concurrent SSH channels to the instance.
+
+        execute() is safe to call from several threads, each command
+        runs in its own channel multiplexed over one shared SSH
+        connection. Callers beyond this limit wait for a free channel.
+        The default matches the OpenSSH MaxSessions default.
+        """
+        return self._max_channels
+
+    @max_channels.setter
+    def max_channels(self, value):
+        """Set the maximum number of concurrent SSH channels."""
+        self._max_channels = value
+        self._channel_slots = threading.BoundedSemaphore(value)
+
+    def close_channel(self, channel):
+        """Close a channel from open_channel(), freeing its slot.
+
+        Args:
+            channel: paramiko Channel returned by open_channel()
+        """
+        channel.close()
+        self._open_channels.pop(channel).release()
+
+    def open_channel(self, command, deadline=None):
+        """Open an SSH channel executing command, within max_channels.
+
+        Waits for one of the max_channels slots first, which is held
+        until the channel is passed to close_channel().
+
+        Args:
+            command: string of the command to run
+            deadline: optional, Deadline of the command
+
+        Returns:
+            paramiko Channel running the command
+
+        """
+        channel_slots = self._channel_slots
+        channel_slots.acquire()
+        try:
+            channel = self._ssh_channel(command, deadline)
+        except BaseException:
+            channel_slots.release()
+            raise
+        # Released to the semaphore acquired from, even if max_channels
+        # changed in the meantime
+        self._open_channels[channel] = channel_slots
+        return channel
+
+    def prewarm_ssh(self):
+        """Start connecting via SSH in a background thread.
+
+        Clouds call this as soon as an instance is created, so the
+        connection is negotiated while waiting for the cloud API to
+        report the instance running. The thread first waits for the
+        instance to get an IP, then connects like the first execute()
+        would, which then finds the connection open. A foreground
+        connection attempt starting before the prewarm succeeded waits
+        for it, up to the deadline of the command, and only connects
+        itself once the prewarm failed or the deadline passed. Failures
+        are only logged, the next foreground connection attempt retries.
+
+        ssh_prewarm_saved holds how much of the connecting happened
+        ahead of the first execute() once it ran.
+
+        Returns:
+            the started thread, or None for instances not using SSH
+
+        """
+        if self._type in ('lxd', 'kvm'):
+            return None
+        with self._ssh_lock:
+            if self._ssh_prewarm is None or not self._ssh_prewarm.is_alive():
+                self._ssh_prewarm_cancel = CancelToken()
+                self._ssh_prewarm_done = threading.Event()
+                self._ssh_prewarm = threading.Thread(
+                    target=self._ssh_prewarm_run,
+                    args=(self._ssh_prewarm_cancel, self._ssh_prewarm_done),
+                    daemon=True
+                )
+                self._ssh_prewarm.start()
+            return self._ssh_prewarm
+
+    def _ssh(self, command, stdin=None):
+        """Run a command via SSH.
+
+        Args:
+            command: string or list of the command to run
+            stdin: optional, values to be passed in
+
+        Returns:
+            tuple of stdout, stderr and the return code
+
+        """
+        out, err, return_code = collect_stream(
+            self._ssh_stream(command, stdin=stdin)
+        )
+        return Result(
+            out.rstrip().decode("utf-8"), err.rstrip().decode("utf-8"),
+            return_code
+        )
+
+    def _ssh_channel(self, command, deadline=None):
+        """Open an SSH session channel executing command.
+
+        Args:
+            command: string of the command to run
+            deadline: optional, Deadline of the command, see
+                _ssh_connect()
+
+        Returns:
+            paramiko Channel running the command
+
+        """
+        # On OCI instances, attempting to re-connect without a longer
+        # sleep leaves you locked out of ssh completely, so retries wait
+        # between 5 and 10s, jittered, never less than the old fixed 5s
+        delays = backoff(initial=10, maximum=10)
+        for _ in range(10):
+            try:
+                client = self._ssh_connect(deadline)
+                channel = client.get_transport().open_session()
+                channel.exec_command(command)
+                return channel
+            except (ConnectionResetError, NoValidConnectionsError) as e:
+                last_error = e
+            time.sleep(next(delays))
+        raise last_error  # noqa
+
+    def _ssh_stream(self, command, stdin=None, chunk_size=65536,
+                    timeout=None, cancel=None):
+        """Run a command via SSH, yielding output as it arrives.
+
+        Args:
+            command: string or list of the command to run
+            stdin: optional, values or binary file object to be passed in
+            chunk_size: maximum number of bytes per yielded chunk
+            timeout: optional, seconds after which the channel is closed
+            cancel: optional, CancelToken closing the channel once
+                    cancelled
+
+        Yields:
+            ('stdout', bytes) and ('stderr', bytes) tuples, followed by a
+            final ('exit', return_code) tuple, return_code being None if
+            the command was stopped
+
+        """
+        deadline = Deadline(timeout, cancel)
+        channel = self.open_channel(shell_pack(command), deadline)
+        try:
+            for data in _stdin_blocks(stdin, chunk_size):
+                if channel.closed:
+                    break
+                if not _channel_send(channel, data, deadline):
+                    yield 'exit', None
+                    return
+            channel.shutdown_write()
+
+            while True:
+                # Checked first, so that chatty commands are stopped too
+                if deadline.expired():
+                    channel.close()
+                    yield 'exit', None
+                    return
+                if channel.recv_stderr_ready():
+                    yield 'stderr', channel.recv_stderr(chunk_size)
+                elif channel.recv_ready():
+                    yield 'stdout', channel.recv(chunk_size)
+                elif channel.eof_received:
+                    # Output arriving after the checks above is buffered
+                    # before the EOF, drain it before leaving
+                    if not (channel.recv_stderr_ready() or
+                            channel.recv_ready()):
+                        break
+                else:
+                    # The channel becomes readable on new output or EOF
+                    select.select([channel], [], [], deadline.wait(1))
+
+            yield 'exit', channel.recv_exit_status()
+        finally:
+            self.close_channel(channel)
+
+    def _ssh_connect(self, deadline=None):
+        """Connect to instance via SSH.
+
+        Threads share the connection, only the first one connects.
+        Connections are also shared with other objects of the same
+        instance through ssh_connections, see pycloudlib.connection.
+
+        Args:
+            deadline: optional, Deadline up to which a running
+                prewarm_ssh() is waited for, defaults to ssh_timeout
+        """
+        requested = time.time()
+        with self._ssh_lock:
+            self._ssh_prewarm_account(requested)
+            if self._ssh_client:
+                if is_active(self._ssh_client):
+                    return self._ssh_client
+                self.ssh_connections.release(
+                    self._ssh_client_key, self._ssh_client
+                )
+                self._ssh_client = None
+
+            key = self._ssh_key()
+            client = self.ssh_connections.acquire(key)
+            if client is None and self._ssh_prewarm_wait(deadline):
+                self._ssh_prewarm_account(requested)
+                client = self.ssh_connections.acquire(key)
+            if client is None:
+                # A prewarm still connecting would only compete
+                if self._ssh_prewarm_cancel is not None:
+                    self._ssh_prewarm_cancel.cancel()
+                client = self.ssh_connections.add(key, self._ssh_open())
+            self._ssh_client = client
+            self._ssh_client_key = key
+            return client
+
+    def _ssh_prewarm_account(self, requested):
+        """Set ssh_prewarm_saved once the prewarm connected.
+
+        Args:
+            requested: time.time() the connection was first needed at
+        """
+        if (self._ssh_prewarm_span is not None and
+                self.ssh_prewarm_saved is None):
+            started, ready = self._ssh_prewarm_span
+            self.ssh_prewarm_saved = max(0, min(requested, ready) - started)
+            self._log.info('ssh prewarm saved %.1fs connecting to %s',
+                           self.ssh_prewarm_saved, self.name)
+
+    def _ssh_prewarm_wait(self, deadline=None):
+        """Wait for a running prewarm_ssh() to finish connecting.
+
+        The prewarm adds its connection to ssh_connections before it
+        needs _ssh_lock, so this is safe to call holding the lock.
+
+        Args:
+            deadline: optional, Deadline to wait up to, defaults to
+                ssh_timeout
+
+        Returns:
+            boolean, True if a prewarm was running and finished
+
+        """
+        done = self._ssh_prewarm_done
+        if done is None or done.is_set():
+            return False
+        if deadline is None:
+            deadline = Deadline(self.ssh_timeout)
+        self._log.debug('waiting for ssh prewarm to %s', self.name)
+        while not done.is_set() and not deadline.expired():
+            done.wait(deadline.wait(1))
+        return done.is_set()
+
+    def _ssh_key(self):
+        """Return the ssh_connections key of the instance."""
+        # Generated key pairs have no path, only their public key
+        return (self.ip, int(self.port), self.username,
+                self.key_pair.private_key_path or
+                self.key_pair.public_key_content, self.name)
+
+    def _ssh_prewarm_run(self, cancel, done):
+        """Wait for the instance IP, then connect, see prewarm_ssh().
+
+        The connection is opened without holding _ssh_lock, so that
+        foreground callers are never stuck behind it, and only published
+        under the lock once it is up.
+
+        Args:
+            cancel: CancelToken stopping the prewarm
+            done: threading.Event set once the prewarm stopped trying
+        """
+        try:
+            client = self._ssh_prewarm_open(cancel)
+        finally:
+            done.set()
+        if client is None:
+            return
+
+        key = self._ssh_key()
+        with self._ssh_lock:
+            if self._ssh_client is None:
+                self._ssh_client = client
+                self._ssh_client_key = key
+            else:
+                # A foreground caller took over, possibly this connection
+                self.ssh_connections.release(key, client)
+
+    def _ssh_prewarm_open(self, cancel):
+        """Wait for the instance IP and connect it, see prewarm_ssh().
+
+        Args:
+            cancel: CancelToken stopping the prewarm
+
+        Returns:
+            connection added to ssh_connections, or None on failure
+
+        """
+        deadline = time.time() + self.ssh_timeout
+        delays = backoff(maximum=10)
+        while not cancel.cancelled:
+            try:
+                if self.ip:
+                    break
+            except Exception as e:  # pylint: disable=broad-except
+                self._log.debug('no ip to prewarm ssh with yet: %s', e)
+            delay = next(delays)
+            if time.time() + delay >= deadline:
+                self._log.info('ssh prewarm gave up waiting for an ip')
+                return None
+            time.sleep(delay)
+
+        started = time.time()
+        try:
+            key = self._ssh_key()
+            client = self.ssh_connections.acquire(key)
+            if client is None:
+                client = self.ssh_connections.add(
+                    key, self._ssh_open(cancel=cancel)
+                )
+        except Exception as e:  # pylint: disable=broad-except
+            self._log.info('ssh prewarm failed: %s', e)
+            return None
+        self._ssh_prewarm_span = (started, time.time())
+        return client
+
+    def _ssh_open(self, cancel=None):
+        """Open a new SSH connection to the instance, with retries.
+
+        Args:
+            cancel: optional, CancelToken to stop retrying with
+
+        Raises:
+            ConnectionAbortedError: cancel was cancelled
+
+        """
+        logging.getLogger("paramiko").setLevel(logging.INFO)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        # The key is parsed once per KeyPair. Keys paramiko cannot parse
+        # up front are left to it to load from the file when connecting.
+        try:
+            pkey = self.key_pair.private_key
+        except PasswordRequiredException:
+            self._log.error('Private key requires password!')
+            raise
+
+        start = time.time()
+        deadline = start + self.ssh_timeout
+        delays = backoff(maximum=10)
+        last_exception = None
+        while True:
+            _check_cancel(cancel)
+            ip = self.ip
+            try:
+                self._wait_for_ssh(ip, deadline, cancel)
+                client.connect(
+                    username=self.username,
+                    hostname=ip,
+                    port=int(self.port),
+                    timeout=self.connect_timeout,
+                    pkey=pkey,
+                    key_filename=(
+                        None if pkey else self.key_pair.private_key_path
+                    ),
+                )
+                self.ssh_ready_time = time.time() - start
+                self._log.debug(
+                    'ssh connection to %s@%s:%s ready after %.1fs',
+                    self.username, ip, self.port, self.ssh_ready_time
+                )
+                return client
+            except ConnectionAbortedError:
+                raise
+            except (ConnectionRefusedError, AuthenticationException,
+                    BadHostKeyException, ConnectionResetError, SSHException,
+                    OSError) as e:
+                last_exception = e
+            delay = next(delays)
+            if time.time() + delay >= deadline:
+                break
+            self._log.info(
+                "%s\nRetrying ssh connection in %.1fs to %s@%s:%s",
+                last_exception, delay, self.username, ip, self.port
+            )
+            time.sleep(delay)
+
+        self._log.error('Failed ssh connection to %s@%s:%s after %d seconds',
+                        self.username, self.ip, self.port, self.ssh_timeout)
+        raise last_exception
+
+    def _wait_for_ssh(self, ip, deadline, cancel=None):
+        """Wait for the instance SSH server to send its banner.
+
+        Probes the port with plain TCP connections, backing off
+        exponentially between attempts, so that the more expensive SSH
+        handshake only starts once sshd is up.
+
+        Args:
+            ip: string, address of the instance
+            deadline: time.time() value to give up at
+            cancel: optional, CancelToken to stop waiting with
+
+        Returns:
+            seconds it took for sshd to answer
+
+        Raises:
+            TimeoutError: sshd did not answer before the deadline
+            ConnectionAbortedError: cancel was cancelled
+
+        """
+        start = time.time()
+        delays = backoff(initial=0.25, maximum=5)
+        while not probe_ssh(ip, int(self.port)):
+            _check_cancel(cancel)
+            delay = next(delays)
+            if time.time() + delay >= deadline:
+                raise TimeoutError(
+                    'No ssh banner from %s:%s' % (ip, self.port)
+                )
+            time.sleep(delay)
+        elapsed = time.time() - start
+        self._log.debug('ssh port %s:%s answered after %.1fs',
+                        ip, self.port, elapsed)
+        return elapsed
+
+
+# Bytes of stdin handed to a channel at a time, its maximum packet size
+def _stdin_blocks(stdin, chunk_size):
+    """Return an iterable of the bytes blocks to send as stdin.
+
+    Args:
+        stdin: None, str, bytes or binary file object
+        chunk_size: maximum number of bytes per block read from a file
+    """
+    if isinstance(stdin, str):
+        stdin = stdin.encode()
+    if hasattr(stdin, 'read'):
+        return iter(lambda: stdin.read(chunk_size), b'')
+    return [] if stdin is None else [stdin]
+
+
+_SEND_BLOCK_SIZE = 32768
+
+
+def _channel_send(channel, data, deadline):
+    """Send all of data to channel unless the deadline passes first.
+
+    Sending blocks while the remote command does not read its stdin, so
+    the deadline is checked at least every second. Data is dropped once
+    the command closed the channel, its exit status tells why.
+
+    Args:
+        channel: paramiko Channel
+        data: bytes to send
+        deadline: Deadline of the command
+
+    Returns:
+        boolean, False if the deadline passed before all data was sent
+
+    """
+    view = memoryview(data)
+    try:
+        while view:
+            if deadline.expired():
+                return False
+            channel.settimeout(deadline.wait(1))
+            try:
+                sent = channel.send(view[:_SEND_BLOCK_SIZE].tobytes())
+            except socket.timeout:
+                continue
+            except OSError:
+                if not channel.closed:
+                    raise
+                break
+            if not sent:
+                break
+            view = view[sent:]
+    finally:
+        channel.settimeout(None)
+    return True
+
+
+def _check_cancel(cancel):
+    """Raise ConnectionAbortedError if the CancelToken was cancelled."""
+    if cancel is not None and cancel.cancelled:
+        raise ConnectionAbortedError('ssh connection attempt cancelled')
@@ -1,55 +1,275 @@
 # This file is part of pycloudlib. See LICENSE file for license information.
 """Wrapper class around Simplestreams."""
 
-import importlib
+import heapq
 import logging
+import re
+import time
+from collections import defaultdict
 
-from simplestreams import filters, mirrors
-from simplestreams import util as s_util
+# Simplestreams grabs the root logger on import and sets it up how it
+# thinks it should be. This is bad and breaks end-user logging, and as
+# this module is only imported once a query runs, the user has likely
+# configured logging already. Restore the root logger afterwards.
+_root_logger = logging.getLogger()
+_root_level = _root_logger.level
+_root_handlers = list(_root_logger.handlers)
 
-# Simplestreams import's above grab the root logger and set the
-# log level up how it thinks they should be. This is bad and breaks
-# end-user logging. This reloads the logging module to ignore the
-# settings set by simplestreams.
-logging.shutdown()
-importlib.reload(logging)
+from simplestreams import filters, mirrors  # noqa: E402 pylint: disable=C0413
+from simplestreams import util as s_util  # noqa: E402 pylint: disable=C0413
+
+_root_logger.setLevel(_root_level)
+_root_logger.handlers[:] = _root_handlers
 
 
 class Streams:
     """Streams Class."""
 
-    def __init__(self, mirror_url, keyring_path):
-        """Initialize Steams Class."""
+    def __init__(self, mirror_url, keyring_path, cache=None, indexed=False,
+                 index_ttl=600):
+        """Initialize Steams Class.
+
+        Args:
+            mirror_url: string, URL of the simplestreams mirror
+            keyring_path: string, path to keyring used to verify signatures
+            cache: optional UrlCache used to store verified index and
+                product JSON across queries and processes
+            indexed: bool, sync the whole mirror once into an ImageIndex
+                and answer every query from it
+            index_ttl: seconds before an indexed mirror is synced again
+        """
         self._log = logging.getLogger(__name__)
         self.mirror_url = mirror_url
         self.keyring_path = keyring_path
+        self.cache = cache
+        self.indexed = indexed
+        self.index_ttl = index_ttl
+        self._index = None
+        self._index_time = None
 
-    def query(self, img_filter):
+    def query(self, img_filter, latest=None):
         """Query streams for latest image given a specific filter.
 
         Args:
             img_filter: array of filters as strings format 'key=value'
+            latest: optional int, only return the newest 'latest' matching
+                items of each product, newest first. Older versions are
+                skipped during the sync instead of being collected.
 
         Returns:
             dictionary with latest image information or empty
 
         """
+        if self.indexed:
+            return self.index().query(img_filter, latest=latest)
+
+        config = {'filters': filters.get_filters(img_filter), 'latest': latest}
+
+        self._log.debug('looking for image with the following config:')
+        self._log.debug(config)
+
+        t_mirror = FilterMirror(config)
+        self._sync(t_mirror)
+
+        return t_mirror.json_entries
+
+    def index(self):
+        """Return an ImageIndex of every item in the mirror.
+
+        The mirror is synced on first use and again once the index is
+        older than index_ttl seconds.
+
+        Returns:
+            ImageIndex of the mirror
+
+        """
+        now = time.time()
+        if self._index is None or now - self._index_time >= self.index_ttl:
+            self._log.debug('indexing %s', self.mirror_url)
+            t_mirror = IndexMirror()
+            self._sync(t_mirror)
+            self._index = t_mirror.index
+            self._index_time = now
+        return self._index
+
+    def _sync(self, t_mirror):
+        """Sync the mirror into a target mirror writer.
+
+        Args:
+            t_mirror: mirrors.BasicMirrorWriter receiving the items
+        """
         def policy(content, path):  # pylint: disable=W0613
             """TODO."""
             return s_util.read_signed(content, keyring=self.keyring_path)
 
         (url, path) = s_util.path_from_mirror_url(self.mirror_url, None)
-        s_mirror = mirrors.UrlMirrorReader(url, policy=policy)
+        if self.cache:
+            s_mirror = CachingMirrorReader(url, self.cache, policy=policy)
+        else:
+            s_mirror = mirrors.UrlMirrorReader(url, policy=policy)
 
-        config = {'filters': filters.get_filters(img_filter)}
+        t_mirror.sync(s_mirror, path)
 
-        self._log.debug('looking for image with the following config:')
-        self._log.debug(config)
 
-        t_mirror = FilterMirror(config)
-        t_mirror.sync(s_mirror, path)
+class ImageIndex:
+    """Items of a simplestreams mirror indexed by common filter keys.
 
-        return t_mirror.json_entries
+    Only the products trees and the pedigree of each item are kept, the
+    flattened item dictionaries are built for query results alone.
+    Equality filters with a value on one of the KEYS are answered from
+    the index, any other filter is applied to the remaining candidates.
+    """
+
+    KEYS = (
+        'content_id',
+        'release',
+        'arch',
+        'region',
+        'ftype',
+        'sha256',
+        'combined_squashfs_sha256',
+    )
+
+    # Same grammar as simplestreams.filters.ItemFilter
+    _FILTER_RE = re.compile(r"([\w|\-]+)[ ]*([!]{0,1}[=~])[ ]*(.*)[ ]*$")
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._items = []
+        self._keys = {key: defaultdict(list) for key in self.KEYS}
+
+    def __len__(self):
+        """Return the number of indexed items."""
+        return len(self._items)
+
+    def add(self, src, pedigree, item_url=None):
+        """Add an item to the index.
+
+        Args:
+            src: products tree the item belongs to
+            pedigree: tuple of product, version and item names
+            item_url: optional URL of the item content
+        """
+        data = s_util.products_exdata(src, pedigree)
+        position = len(self._items)
+        self._items.append((src, pedigree, item_url))
+        for key in self.KEYS:
+            if key in data:
+                self._keys[key][str(data[key])].append(position)
+
+    def query(self, img_filter, latest=None):
+        """Return the items matching a filter, in mirror order.
+
+        Args:
+            img_filter: array of filters as strings format 'key=value'
+            latest: optional int, only return the newest 'latest' matching
+                items of each product, newest first
+
+        Returns:
+            list of dictionaries of matching items
+
+        """
+        positions = None
+        for img_filt in img_filter:
+            match = self._FILTER_RE.match(img_filt)
+            if not match:
+                continue
+            key, op, value = match.groups()
+            # An empty value also matches items without the key, which
+            # the index does not list, so leave those to the full scan.
+            if op != '=' or key not in self._keys or not value:
+                continue
+            matching = self._keys[key].get(value, ())
+            if positions is None:
+                positions = set(matching)
+            else:
+                positions.intersection_update(matching)
+
+        if positions is None:
+            positions = range(len(self._items))
+        else:
+            positions = sorted(positions)
+
+        item_filters = filters.get_filters(img_filter)
+        if not latest:
+            return [
+                entry for entry in map(self._entry, positions)
+                if filters.filter_dict(item_filters, entry)
+            ]
+
+        # Walk each product from its newest version down and stop once
+        # enough items of that product matched.
+        products = defaultdict(list)
+        for position in positions:
+            src, pedigree, _item_url = self._items[position]
+            products[(src.get('content_id'), pedigree[0])].append(position)
+
+        newest = []
+        for product_positions in products.values():
+            product_positions.sort(
+                key=lambda position: self._items[position][1][1],
+                reverse=True
+            )
+            found = 0
+            for position in product_positions:
+                entry = self._entry(position)
+                if filters.filter_dict(item_filters, entry):
+                    newest.append(entry)
+                    found += 1
+                    if found == latest:
+                        break
+        newest.sort(key=lambda entry: entry['version_name'], reverse=True)
+        return newest
+
+    def _entry(self, position):
+        """Build the flattened dictionary of an indexed item.
+
+        Args:
+            position: int, position of the item in the index
+
+        Returns:
+            dictionary with the item information
+
+        """
+        src, pedigree, item_url = self._items[position]
+        data = s_util.products_exdata(src, pedigree)
+        if item_url is not None:
+            data.update({'item_url': item_url})
+        return data
+
+
+class CachingMirrorReader(mirrors.UrlMirrorReader):
+    """Mirror reader serving verified JSON through a UrlCache."""
+
+    def __init__(self, prefix, cache, policy):
+        """Initialize caching mirror reader.
+
+        Args:
+            prefix: string, URL prefix of the mirror
+            cache: UrlCache to read through
+            policy: callable verifying downloaded content
+        """
+        super().__init__(prefix, policy=policy)
+        self.cache = cache
+
+    def read_json(self, path):
+        """Read and verify JSON at path, using the cache when possible.
+
+        The signature policy only runs on freshly downloaded content, the
+        cache stores its verified output.
+
+        Args:
+            path: path of the JSON file relative to the mirror prefix
+
+        Returns:
+            tuple of raw content and verified payload
+
+        """
+        content = self.cache.get(
+            self.prefix + path,
+            verify=lambda raw: self.policy(content=raw, path=path)
+        )
+        return content, content
 
 
 class FilterMirror(mirrors.BasicMirrorWriter):
@@ -66,7 +286,23 @@ class FilterMirror(mirrors.BasicMirrorWriter):
             config = {}
         self.config = config
         self.filters = config.get('filters', [])
-        self.json_entries = []
+        self.latest = config.get('latest')
+        self._entries = []
+        self._newest = defaultdict(list)
+        self._count = 0
+
+    @property
+    def json_entries(self):
+        """List of matching items.
+
+        With 'latest' set in the config only the newest items of each
+        product are kept, sorted newest first.
+        """
+        if not self.latest:
+            return self._entries
+        items = [item for heap in self._newest.values() for item in heap]
+        items.sort(key=lambda item: item[:2], reverse=True)
+        return [data for (_version, _count, data) in items]
 
     def load_products(self, path=None, content_id=None):
         """Load each product.
@@ -84,6 +320,10 @@ class FilterMirror(mirrors.BasicMirrorWriter):
     def filter_item(self, data, src, target, pedigree):
         """Filter items based on filter.
 
+        Simplestreams hands over the versions of a product newest first,
+        so with 'latest' set an item no newer than the oldest of a full
+        set of kept items is skipped before the filters flatten it.
+
         Args:
             data: TBD
             src: TBD
@@ -94,6 +334,10 @@ class FilterMirror(mirrors.BasicMirrorWriter):
             Filtered items
 
         """
+        if self.latest:
+            heap = self._newest[(src.get('content_id'), pedigree[0])]
+            if len(heap) >= self.latest and pedigree[1] <= heap[0][0]:
+                return False
         return filters.filter_item(self.filters, data, src, pedigree)
 
     def insert_item(self, data, src, target, pedigree, contentsource):
@@ -113,4 +357,55 @@ class FilterMirror(mirrors.BasicMirrorWriter):
         data = s_util.products_exdata(src, pedigree)
         if 'path' in data:
             data.update({'item_url': contentsource.url})
-        self.json_entries.append(data)
+        if not self.latest:
+            self._entries.append(data)
+            return
+
+        # Min-heap of the newest items of the product. Earlier items win
+        # ties within a version, as in the unbounded listing.
+        self._count -= 1
+        heap = self._newest[(src.get('content_id'), pedigree[0])]
+        item = (pedigree[1], self._count, data)
+        if len(heap) < self.latest:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+
+class IndexMirror(mirrors.BasicMirrorWriter):
+    """Mirror writer collecting every item into an ImageIndex."""
+
+    def __init__(self, config=None):
+        """Initialize index mirror.
+
+        Args:
+            config: custom config to use
+        """
+        super().__init__(config=config)
+        self.index = ImageIndex()
+
+    def load_products(self, path=None, content_id=None):
+        """Load each product.
+
+        Args:
+            path: path the product
+            content_id: ID of product
+
+        Returns:
+            dictionary of products
+
+        """
+        return {'content_id': content_id, 'products': {}}
+
+    def insert_item(self, data, src, target, pedigree, contentsource):
+        """Index item received.
+
+        Args:
+            data: Data from simplestreams
+            src: products tree the item belongs to
+            target: TBD
+            pedigree: tuple of product, version and item names
+            contentsource: ContentSource if 'path' exists in data or None
+        """
+        item_url = contentsource.url if 'path' in data else None
+        self.index.add(src, pedigree, item_url)
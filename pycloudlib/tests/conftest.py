@@ -0,0 +1,55 @@
+"""Fixtures shared by the pycloudlib tests."""
+import boto3
+import mock
+import pytest
+
+from pycloudlib.ec2.cloud import EC2
+from pycloudlib.instance import BaseInstance
+from pycloudlib.key import KeyPair
+from pycloudlib.tests.helpers import InstanceSubclass
+from pycloudlib.tests.sshd import SSHServer
+
+
+@pytest.fixture
+def instance():
+    """Return an SSH backed instance."""
+    return InstanceSubclass(key_pair=None)
+
+
+@pytest.fixture
+def sshd(tmpdir):
+    """Run a local SSH server stand-in."""
+    server = SSHServer(tmpdir.strpath, max_sessions=4)
+    yield server
+    BaseInstance.ssh_connections.clear()
+    server.close()
+
+
+@pytest.fixture
+def ssh_instance(sshd):
+    """Return an instance connecting to the local SSH server."""
+    inst = InstanceSubclass(
+        key_pair=KeyPair(sshd.client_key_path + '.pub', name='test')
+    )
+    inst.ip = '127.0.0.1'
+    inst.port = str(sshd.port)
+    yield inst
+    inst.__del__()
+
+
+@pytest.fixture
+def ec2():
+    """Return an EC2 cloud whose API calls can be stubbed.
+
+    Use botocore.stub.Stubber on ec2.client, or on ec2.resource.meta.client
+    for calls made through boto3 resources.
+    """
+    session = boto3.Session(
+        aws_access_key_id='testing', aws_secret_access_key='testing',
+        region_name='us-east-1'
+    )
+    with mock.patch('pycloudlib.ec2.cloud._get_session',
+                    return_value=session):
+        with mock.patch('pycloudlib.cloud.getpass.getuser',
+                        return_value='tester'):
+            return EC2(tag='test', timestamp_suffix=False)
@@ -0,0 +1,85 @@
+"""Helpers shared by the pycloudlib tests."""
+from pycloudlib.instance import BaseInstance
+
+
+class InstanceSubclass(BaseInstance):
+    """Create a concrete subclass of BaseInstance for testing."""
+
+    name = 'myinstance'
+    ip = '10.0.0.2'
+
+    def console_log(self):
+        """Skeletal console_log."""
+
+    def delete(self, wait=True):
+        """Skeletal delete."""
+
+    def restart(self, wait=True):
+        """Skeletal restart."""
+
+    def shutdown(self, wait=True):
+        """Skeletal shutdown."""
+
+    def start(self, wait=True):
+        """Skeletal start."""
+
+    def wait(self):
+        """Skeletal wait."""
+
+    def wait_for_delete(self):
+        """Skeletal wait_for_delete."""
+
+    def wait_for_stop(self):
+        """Skeletal wait_for_stop."""
+
+
+class FakeChannel:
+    """Minimal paramiko Channel replaying canned output."""
+
+    def __init__(self, stdout=(), stderr=(), exit_status=0):
+        """Queue output chunks to return."""
+        self.stdout = list(stdout)
+        self.stderr = list(stderr)
+        self.exit_status = exit_status
+        self.sent = b''
+        self.closed = False
+
+    @property
+    def eof_received(self):
+        """EOF arrives once all output was read."""
+        return not self.stdout and not self.stderr
+
+    def recv_ready(self):
+        """Return whether stdout is pending."""
+        return bool(self.stdout)
+
+    def recv_stderr_ready(self):
+        """Return whether stderr is pending."""
+        return bool(self.stderr)
+
+    def recv(self, _size):
+        """Return next stdout chunk."""
+        return self.stdout.pop(0)
+
+    def recv_stderr(self, _size):
+        """Return next stderr chunk."""
+        return self.stderr.pop(0)
+
+    def recv_exit_status(self):
+        """Return the exit status."""
+        return self.exit_status
+
+    def send(self, data):
+        """Record stdin."""
+        self.sent += data
+        return len(data)
+
+    def settimeout(self, timeout):
+        """Accept a timeout, sending never blocks."""
+
+    def shutdown_write(self):
+        """Accept the end of stdin."""
+
+    def close(self):
+        """Record closing."""
+        self.closed = True
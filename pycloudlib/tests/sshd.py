@@ -0,0 +1,248 @@
+"""Local SSH server stand-in for tests, built on paramiko.
+
+Commands are run locally through 'sh -c' and the 'sftp' subsystem serves
+the local filesystem, which is enough to drive a BaseInstance end to end
+without a real instance.
+"""
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    """Accept the client key and run exec requests locally."""
+
+    def __init__(self, server):
+        """Keep a reference to the owning server."""
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        """Only public key authentication is supported."""
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        """Accept the authorized client keys."""
+        if key.get_base64() in (
+                authorized.get_base64()
+                for authorized in self.server.authorized_keys):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        """Open session channels up to the session limit."""
+        if kind != 'session':
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        with self.server.lock:
+            if self.server.sessions >= self.server.max_sessions:
+                return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+            self.server.sessions += 1
+            self.server.max_seen_sessions = max(
+                self.server.max_seen_sessions, self.server.sessions
+            )
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        """Run the command in a thread."""
+        threading.Thread(
+            target=self.server.run_command, args=(channel, command),
+            daemon=True
+        ).start()
+        return True
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    """File handle on the local filesystem."""
+
+    def stat(self):
+        """Stat the open file."""
+        return paramiko.SFTPAttributes.from_stat(
+            os.fstat(self.readfile.fileno())
+        )
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    """Serve the local filesystem."""
+
+    def open(self, path, flags, attr):
+        """Open a local file."""
+        mode = attr.st_mode if attr.st_mode is not None else 0o666
+        try:
+            fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), mode)
+        except OSError as error:
+            return paramiko.SFTPServer.convert_errno(error.errno)
+        if flags & os.O_WRONLY:
+            fmode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            fmode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            fmode = 'rb'
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, fmode)
+        return handle
+
+    def stat(self, path):
+        """Stat a local path."""
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as error:
+            return paramiko.SFTPServer.convert_errno(error.errno)
+
+    lstat = stat
+
+    def remove(self, path):
+        """Remove a local file."""
+        try:
+            os.remove(path)
+        except OSError as error:
+            return paramiko.SFTPServer.convert_errno(error.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        """Rename a local file."""
+        try:
+            os.rename(oldpath, newpath)
+        except OSError as error:
+            return paramiko.SFTPServer.convert_errno(error.errno)
+        return paramiko.SFTP_OK
+
+    posix_rename = rename
+
+    def chattr(self, path, attr):
+        """Apply mode changes."""
+        if attr.st_mode is not None:
+            os.chmod(path, attr.st_mode)
+        return paramiko.SFTP_OK
+
+
+class _SFTPSubsystem(paramiko.SFTPServer):
+    """SFTP subsystem releasing its session slot when done."""
+
+    def finish_subsystem(self):
+        """Release the session slot."""
+        super().finish_subsystem()
+        server = self.get_server().server
+        with server.lock:
+            server.sessions -= 1
+
+
+class SSHServer:
+    """Threaded SSH server listening on localhost.
+
+    Attributes:
+        port: port the server listens on
+        client_key: paramiko key clients authenticate with
+        client_key_path: path of the private client key file
+        authorized_keys: list of paramiko keys clients may authenticate
+            with, initially only client_key
+        connections: number of negotiated SSH connections
+        max_seen_sessions: highest number of concurrent session channels
+    """
+
+    def __init__(self, key_dir, max_sessions=10):
+        """Generate keys and start listening.
+
+        Args:
+            key_dir: directory to write the client key pair to
+            max_sessions: concurrent session channels allowed per server
+        """
+        self.host_key = paramiko.ECDSAKey.generate()
+        self.client_key = paramiko.ECDSAKey.generate()
+        self.client_key_path = os.path.join(key_dir, 'id_ecdsa')
+        self.client_key.write_private_key_file(self.client_key_path)
+        with open(self.client_key_path + '.pub', 'w') as pub:
+            pub.write('%s %s\n' % (
+                self.client_key.get_name(), self.client_key.get_base64()
+            ))
+        self.authorized_keys = [self.client_key]
+
+        self.max_sessions = max_sessions
+        self.sessions = 0
+        self.max_seen_sessions = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._transports = []
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(100)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        """Accept connections until closed."""
+        while True:
+            try:
+                conn, _addr = self._sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler(
+                'sftp', _SFTPSubsystem, _SFTPServer
+            )
+            self._transports.append(transport)
+            try:
+                transport.start_server(server=_ServerInterface(self))
+            except (EOFError, paramiko.SSHException):
+                # readiness probes hang up before negotiating
+                transport.close()
+                continue
+            with self.lock:
+                self.connections += 1
+
+    def run_command(self, channel, command):
+        """Run command locally, relaying stdio over channel."""
+        process = subprocess.Popen(
+            ['sh', '-c', command], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        def feed_stdin():
+            while True:
+                data = channel.recv(32768)
+                if not data:
+                    break
+                try:
+                    process.stdin.write(data)
+                    process.stdin.flush()
+                except BrokenPipeError:
+                    break
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        def relay(pipe, send):
+            for data in iter(lambda: pipe.read1(32768), b''):
+                send(data)
+
+        threads = [
+            threading.Thread(target=feed_stdin, daemon=True),
+            threading.Thread(
+                target=relay, args=(process.stdout, channel.sendall)
+            ),
+            threading.Thread(
+                target=relay, args=(process.stderr, channel.sendall_stderr)
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads[1:]:
+            thread.join()
+        channel.send_exit_status(process.wait())
+        channel.shutdown_write()
+        with self.lock:
+            self.sessions -= 1
+        channel.close()
+
+    def close(self):
+        """Stop listening and close all connections."""
+        self._sock.close()
+        for transport in self._transports:
+            transport.close()
@@ -0,0 +1,85 @@
+"""Tests related to pycloudlib.agent module."""
+import mock
+
+import pytest
+from paramiko.ssh_exception import SSHException
+
+from pycloudlib.agent import ExecAgent
+
+
+class TestExecAgent:
+    """Tests covering execute() through ExecAgent."""
+
+    @pytest.fixture
+    def agent_instance(self, ssh_instance):
+        """Return an SSH instance executing through its agent."""
+        ssh_instance.use_agent = True
+        return ssh_instance
+
+    def test_runs_commands_over_one_channel(self, agent_instance):
+        """Commands are answered by one helper started on first use."""
+        with mock.patch.object(
+                agent_instance, 'open_channel',
+                wraps=agent_instance.open_channel) as m_channel:
+            result = agent_instance.execute(
+                'echo out; echo err >&2; exit 3'
+            )
+            assert ('out', 'err', 3) == (
+                result, result.stderr, result.return_code
+            )
+            for number in range(5):
+                assert str(number) == agent_instance.execute(
+                    ['echo', str(number)]
+                )
+        assert 1 == m_channel.call_count
+
+    def test_stdin_and_binary_arguments(self, agent_instance):
+        """Stdin and arguments are passed through unchanged."""
+        result = agent_instance.execute(
+            ['sh', '-c', 'cat; printf %s "$1"', 'sh', 'a b\n"c"'],
+            stdin='in\n'
+        )
+        assert 'in\na b\n"c"' == result
+
+    def test_missing_command(self, agent_instance):
+        """Commands which cannot be started fail like in a shell."""
+        result = agent_instance.execute(['/nonexistent/command'])
+        assert 127 == result.return_code
+        assert 'No such file or directory' in result.stderr
+
+    def test_restarts_after_channel_closed(self, agent_instance):
+        """A helper whose channel closed is started again."""
+        agent_instance.execute(['true'])
+        agent_instance._agent._channel.close()
+        assert 'again' == agent_instance.execute(['echo', 'again'])
+
+    def test_releases_channel_slot(self, agent_instance):
+        """The helper channel counts against max_channels until closed."""
+        agent_instance.max_channels = 2
+        slots = agent_instance._channel_slots
+        agent_instance.execute(['true'])
+        assert slots.acquire(blocking=False)
+        assert not slots.acquire(blocking=False)
+        agent_instance._agent.close()
+        assert slots.acquire(blocking=False)
+
+    def test_single_channel_runs_without_agent(self, agent_instance):
+        """With max_channels = 1 the agent never takes the only slot."""
+        agent_instance.max_channels = 1
+        assert 'one' == agent_instance.execute(['echo', 'one'])
+        assert agent_instance._agent is None
+
+        stream = agent_instance.execute_stream(['echo', 'two'])
+        assert ('stdout', b'two\n') == next(stream)
+        assert ('exit', 0) == list(stream)[-1]
+        result = agent_instance.execute(['echo', 'three'], timeout=30)
+        assert 'three' == result
+
+    def test_missing_helper(self, ssh_instance):
+        """Instances without python3 fail with the helper's error."""
+        agent = ExecAgent(ssh_instance)
+        with mock.patch('pycloudlib.agent.shell_pack',
+                        return_value='echo no python3 >&2; exit 127'):
+            with pytest.raises(SSHException, match='no python3'):
+                agent.run(['true'])
+        assert not agent.running
@@ -0,0 +1,124 @@
+"""Tests related to pycloudlib.cache module."""
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.error import HTTPError
+
+import mock
+
+import pytest
+
+from pycloudlib.cache import UrlCache
+
+# mock module path
+MPATH = "pycloudlib.cache."
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """Serve a single document with ETag support, counting requests."""
+
+    content = b'{"format": "index:1.0"}'
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        """Answer GET, honoring If-None-Match."""
+        self.requests.append(dict(self.headers))
+        if self.path != '/streams/v1/index.sjson':
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.content)))
+        self.end_headers()
+        self.wfile.write(self.content)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        """Silence request logging."""
+
+
+@pytest.fixture
+def mirror():
+    """Run a local HTTP mirror stand-in and return its base URL."""
+    MirrorHandler.requests = []
+    MirrorHandler.etag = '"v1"'
+    MirrorHandler.content = b'{"format": "index:1.0"}'
+    server = HTTPServer(('127.0.0.1', 0), MirrorHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+class TestUrlCache:
+    """Tests covering UrlCache.get."""
+
+    def test_fresh_entry_skips_network(self, mirror, tmpdir):
+        """Entries younger than the TTL are served from disk."""
+        url = mirror + '/streams/v1/index.sjson'
+        verify = mock.Mock(side_effect=lambda raw: raw.upper())
+        cache = UrlCache(cache_dir=tmpdir.strpath, ttl=600)
+
+        assert '{"FORMAT": "INDEX:1.0"}' == cache.get(url, verify=verify)
+        assert '{"FORMAT": "INDEX:1.0"}' == cache.get(url, verify=verify)
+        assert 1 == len(MirrorHandler.requests)
+        assert 1 == verify.call_count
+
+    def test_cache_is_shared_between_instances(self, mirror, tmpdir):
+        """A second UrlCache on the same directory reuses the entry."""
+        url = mirror + '/streams/v1/index.sjson'
+        UrlCache(cache_dir=tmpdir.strpath).get(url)
+        UrlCache(cache_dir=tmpdir.strpath).get(url)
+        assert 1 == len(MirrorHandler.requests)
+
+    @mock.patch(MPATH + 'time.time')
+    def test_expired_entry_is_revalidated(self, m_time, mirror, tmpdir):
+        """Stale entries send If-None-Match and reuse content on 304."""
+        url = mirror + '/streams/v1/index.sjson'
+        verify = mock.Mock(side_effect=lambda raw: raw)
+        cache = UrlCache(cache_dir=tmpdir.strpath, ttl=10)
+
+        m_time.return_value = 1000
+        cache.get(url, verify=verify)
+        m_time.return_value = 1011
+        assert '{"format": "index:1.0"}' == cache.get(url, verify=verify)
+
+        assert 2 == len(MirrorHandler.requests)
+        assert '"v1"' == MirrorHandler.requests[1]['If-None-Match']
+        assert 1 == verify.call_count
+
+    @mock.patch(MPATH + 'time.time')
+    def test_changed_content_is_downloaded(self, m_time, mirror, tmpdir):
+        """Stale entries are replaced when the server has new content."""
+        url = mirror + '/streams/v1/index.sjson'
+        cache = UrlCache(cache_dir=tmpdir.strpath, ttl=10)
+
+        m_time.return_value = 1000
+        cache.get(url)
+        MirrorHandler.etag = '"v2"'
+        MirrorHandler.content = b'{"format": "products:1.0"}'
+        m_time.return_value = 1011
+        assert '{"format": "products:1.0"}' == cache.get(url)
+
+    def test_errors_are_not_cached(self, mirror, tmpdir):
+        """HTTP errors are raised and leave nothing behind."""
+        cache = UrlCache(cache_dir=tmpdir.strpath)
+        with pytest.raises(HTTPError):
+            cache.get(mirror + '/missing')
+        assert not tmpdir.listdir(lambda p: p.ext == '.json')
+
+    def test_clear_removes_entries_and_locks(self, mirror, tmpdir):
+        """clear() leaves neither entries nor lock files behind."""
+        cache = UrlCache(cache_dir=tmpdir.strpath)
+        cache.get(mirror + '/streams/v1/index.sjson')
+        assert tmpdir.listdir(lambda p: p.ext == '.lock')
+
+        cache.clear()
+        assert not tmpdir.listdir()
+
+        cache.get(mirror + '/streams/v1/index.sjson')
+        assert 2 == len(MirrorHandler.requests)
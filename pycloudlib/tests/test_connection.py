@@ -0,0 +1,111 @@
+"""Tests related to pycloudlib.connection module."""
+import time
+
+import mock
+
+import pytest
+
+from pycloudlib.connection import ConnectionCache
+
+# mock module path
+MPATH = "pycloudlib.connection."
+
+
+def _client(active=True):
+    """Return a mocked paramiko SSHClient."""
+    client = mock.Mock()
+    client.get_transport.return_value.is_active.return_value = active
+    return client
+
+
+def _key(number):
+    """Return a connection cache key."""
+    return ('10.0.0.%d' % number, 22, 'ubuntu', '/root/.ssh/id_rsa',
+            'instance-%d' % number)
+
+
+@pytest.fixture
+def m_time():
+    """Control the clock used for idle timeouts."""
+    with mock.patch(MPATH + 'time.monotonic', return_value=1000) as m_time:
+        yield m_time
+
+
+class TestConnectionCache:
+    """Tests covering ConnectionCache."""
+
+    def test_released_connection_is_reused(self):
+        """A connection released by one instance serves the next."""
+        cache = ConnectionCache()
+        client = _client()
+        assert cache.acquire(_key(1)) is None
+        assert client is cache.add(_key(1), client)
+        cache.release(_key(1), client)
+
+        assert client is cache.acquire(_key(1))
+        assert cache.acquire(_key(2)) is None
+        assert not client.close.called
+
+    def test_dead_connection_is_dropped(self):
+        """Connections whose transport died are closed, not returned."""
+        cache = ConnectionCache()
+        client = _client()
+        cache.add(_key(1), client)
+        client.get_transport.return_value.is_active.return_value = False
+
+        assert cache.acquire(_key(1)) is None
+        assert client.close.called
+        assert 0 == len(cache)
+
+    def test_concurrent_add_keeps_first(self):
+        """A second connection for the same key is closed."""
+        cache = ConnectionCache()
+        first, second = _client(), _client()
+        cache.add(_key(1), first)
+        assert first is cache.add(_key(1), second)
+        assert second.close.called
+        assert not first.close.called
+
+    def test_idle_connections_expire(self, m_time):
+        """Unheld connections are closed after idle_timeout."""
+        cache = ConnectionCache(idle_timeout=10)
+        idle, held = _client(), _client()
+        cache.add(_key(1), idle)
+        cache.add(_key(2), held)
+        cache.release(_key(1), idle)
+
+        m_time.return_value = 1011
+        assert cache.acquire(_key(3)) is None
+        assert idle.close.called
+        assert not held.close.called
+        assert [_key(2)] == list(cache._entries)
+
+    def test_lru_eviction_spares_held_connections(self, m_time):
+        """Beyond max_size the least recently used idle ones close."""
+        cache = ConnectionCache(max_size=2)
+        clients = [_client() for _ in range(3)]
+        for number, client in enumerate(clients):
+            m_time.return_value += 1
+            cache.add(_key(number), client)
+        # 0 stays held while 1 and 2 are released, 2 being used last
+        for number in (1, 2):
+            m_time.return_value += 1
+            cache.release(_key(number), clients[number])
+
+        assert [False, True, False] == [
+            client.close.called for client in clients
+        ]
+        assert [_key(0), _key(2)] == list(cache._entries)
+
+    def test_idle_connections_expire_unattended(self):
+        """Idle connections are closed without the cache being used."""
+        cache = ConnectionCache(idle_timeout=0.1)
+        client = cache.add(_key(1), _client())
+        cache.release(_key(1), client)
+
+        for _ in range(50):
+            if client.close.called:
+                break
+            time.sleep(0.1)
+        assert client.close.called
+        assert 0 == len(cache)
@@ -0,0 +1,484 @@
+"""Tests related to pycloudlib.ec2 package."""
+import gc
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import mock
+
+import pytest
+from botocore.exceptions import ClientError, WaiterError
+from botocore.stub import ANY, Stubber
+
+from pycloudlib.ec2.poller import StatePoller
+from pycloudlib.ec2.vpc import VPC
+
+# mock module path
+MPATH = "pycloudlib.ec2."
+
+
+def _run_instances_params(count, min_count):
+    """Return the RunInstances parameters launching count instances."""
+    return {
+        'ImageId': 'ami-1', 'InstanceType': 't2.micro',
+        'KeyName': 'tester', 'MaxCount': count, 'MinCount': min_count,
+        'TagSpecifications': ANY,
+    }
+
+
+def _run_instances_response(count):
+    """Return a RunInstances response with count instances."""
+    return {'Instances': [
+        {'InstanceId': 'i-%d' % number} for number in range(count)
+    ]}
+
+
+def _fail_i_1(instance):
+    """Wait for an instance, failing for i-1."""
+    if instance.id == 'i-1':
+        raise OSError('no boot')
+
+
+@mock.patch(MPATH + 'instance.EC2Instance.prewarm_ssh')
+class TestLaunch:
+    """Tests covering EC2.launch and EC2.launch_many."""
+
+    def test_launch_one(self, m_prewarm, ec2):
+        """launch() asks for exactly one instance."""
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'run_instances', _run_instances_response(1),
+                _run_instances_params(1, 1)
+            )
+            instance = ec2.launch('ami-1', wait=False)
+        assert 'i-0' == instance.id
+        assert 1 == m_prewarm.call_count
+
+    def test_launch_many_in_one_request(self, m_prewarm, ec2, caplog):
+        """Short capacity returns the instances EC2 could launch."""
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'run_instances', _run_instances_response(3),
+                _run_instances_params(5, 2)
+            )
+            instances = ec2.launch_many(
+                'ami-1', 5, min_count=2, wait=False
+            )
+            stubber.assert_no_pending_responses()
+        assert ['i-0', 'i-1', 'i-2'] == [
+            instance.id for instance in instances
+        ]
+        assert 3 == m_prewarm.call_count
+        assert 'launched 3 of 5 instances' in caplog.text
+
+    def test_launch_many_waits_concurrently(self, m_prewarm, ec2):
+        """All instances are waited for at the same time."""
+        barrier = threading.Barrier(3, timeout=10)
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'run_instances', _run_instances_response(3),
+                _run_instances_params(3, 1)
+            )
+            with mock.patch(MPATH + 'instance.EC2Instance.wait',
+                            side_effect=barrier.wait) as m_wait:
+                ec2.launch_many('ami-1', 3)
+        assert 3 == m_wait.call_count
+
+    @mock.patch(MPATH + 'instance.EC2Instance.delete', autospec=True)
+    def test_launch_many_wait_failure(self, m_delete, m_prewarm, ec2):
+        """Instances failing to come up are deleted and left out."""
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'run_instances', _run_instances_response(3),
+                _run_instances_params(3, 1)
+            )
+            with mock.patch(MPATH + 'instance.EC2Instance.wait',
+                            autospec=True, side_effect=_fail_i_1):
+                instances = ec2.launch_many('ami-1', 3)
+        assert ['i-0', 'i-2'] == [instance.id for instance in instances]
+        assert ['i-1'] == [
+            call[0][0].id for call in m_delete.call_args_list
+        ]
+        assert all({'wait': False} == call[1]
+                   for call in m_delete.call_args_list)
+
+    @mock.patch(MPATH + 'instance.EC2Instance.delete', autospec=True)
+    def test_launch_many_below_min_count(self, m_delete, m_prewarm, ec2):
+        """Fewer than min_count instances up deletes all, then raises."""
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'run_instances', _run_instances_response(3),
+                _run_instances_params(3, 3)
+            )
+            with mock.patch(MPATH + 'instance.EC2Instance.wait',
+                            autospec=True, side_effect=_fail_i_1):
+                with pytest.raises(OSError, match='no boot'):
+                    ec2.launch_many('ami-1', 3, min_count=3)
+        assert ['i-0', 'i-1', 'i-2'] == [
+            call[0][0].id for call in m_delete.call_args_list
+        ]
+
+    @mock.patch(MPATH + 'cloud._LAUNCH_WAIT_WORKERS', 2)
+    def test_launch_many_caps_wait_threads(self, m_prewarm, ec2):
+        """No more than _LAUNCH_WAIT_WORKERS instances wait at a time."""
+        lock = threading.Lock()
+        waiting = []
+
+        def wait():
+            with lock:
+                waiting.append(threading.get_ident())
+
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'run_instances', _run_instances_response(5),
+                _run_instances_params(5, 1)
+            )
+            with mock.patch(MPATH + 'instance.EC2Instance.wait',
+                            side_effect=wait):
+                assert 5 == len(ec2.launch_many('ami-1', 5))
+        assert 5 == len(waiting)
+        assert len(set(waiting)) <= 2
+
+
+class FakeEC2:
+    """Answer DescribeInstances from a scripted list of states."""
+
+    def __init__(self, states, missing=()):
+        """Serve states, a dict of instance id to list of states.
+
+        Each poll of an instance pops its next state, the last one is
+        kept. Instances in missing are unknown to EC2 on the first poll.
+        """
+        self.states = states
+        self.missing = set(missing)
+        self.calls = []
+        self.client = mock.Mock()
+        self.client.get_paginator.return_value.paginate.side_effect = (
+            self.paginate
+        )
+
+    def paginate(self, InstanceIds):  # noqa: N803
+        """Return pages describing InstanceIds."""
+        self.calls.append(sorted(InstanceIds))
+        missing = self.missing.intersection(InstanceIds)
+        if missing:
+            self.missing -= missing
+            raise ClientError({'Error': {
+                'Code': 'InvalidInstanceID.NotFound',
+                'Message': "The instance IDs '%s' do not exist" % (
+                    ', '.join(sorted(missing))
+                )
+            }}, 'DescribeInstances')
+        instances = []
+        for instance_id in InstanceIds:
+            states = self.states[instance_id]
+            state = states.pop(0) if len(states) > 1 else states[0]
+            if state is not None:
+                instances.append({
+                    'InstanceId': instance_id, 'State': {'Name': state}
+                })
+        return [{'Reservations': [{'Instances': instances}]}]
+
+
+class TestStatePoller:
+    """Tests covering StatePoller."""
+
+    @pytest.fixture
+    def poller(self):
+        """Return a poller factory polling without delay."""
+        def make(fake):
+            poller = StatePoller(fake.client)
+            poller.min_interval = poller.max_interval = 0.01
+            return poller
+        return make
+
+    def test_waiters_share_polls(self, poller):
+        """Concurrent waits are answered by batched calls."""
+        fake = FakeEC2({
+            'i-%d' % number: ['pending'] * (number + 2) + ['running']
+            for number in range(10)
+        })
+        states = poller(fake)
+        states.batch_size = 4
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(
+                lambda instance_id: states.wait(instance_id, 'running'),
+                sorted(fake.states)
+            ))
+        assert ['running'] * 10 == [
+            result['State']['Name'] for result in results
+        ]
+        assert all(len(call) <= 4 for call in fake.calls)
+        # One call per instance per poll would take at least 65 calls
+        assert len(fake.calls) < 40
+
+    def test_failure_state(self, poller):
+        """Instances ending up in the wrong state raise WaiterError."""
+        fake = FakeEC2({'i-1': ['pending', 'terminated']})
+        with pytest.raises(WaiterError, match='i-1: instance is terminated'):
+            poller(fake).wait('i-1', 'running')
+
+    def test_unknown_instances(self, poller):
+        """Unknown instances are not visible yet or long terminated."""
+        fake = FakeEC2({'i-1': ['running'], 'i-2': [None]}, missing=['i-1'])
+        states = poller(fake)
+        assert 'running' == states.wait('i-1', 'running')['State']['Name']
+        assert states.wait('i-2', 'terminated') is None
+
+    def test_wait_all(self, poller):
+        """Instances waited for together share every poll."""
+        fake = FakeEC2({
+            'i-1': ['shutting-down', 'terminated'], 'i-2': [None]
+        })
+        first, second = poller(fake).wait_all(['i-1', 'i-2'], 'terminated')
+        assert 'terminated' == first['State']['Name']
+        assert second is None
+        assert [['i-1', 'i-2'], ['i-1']] == fake.calls
+
+    def test_timeout(self, poller):
+        """Waits ending without the state raise WaiterError."""
+        fake = FakeEC2({'i-1': ['pending']})
+        with pytest.raises(WaiterError, match='exceeded'):
+            poller(fake).wait('i-1', 'running', timeout=0.1)
+
+    def test_for_client_lets_go_of_client(self):
+        """Shared pollers do not keep their clients alive."""
+        client = mock.Mock()
+        poller = StatePoller.for_client(client)
+        assert poller is StatePoller.for_client(client)
+
+        client_ref = weakref.ref(client)
+        del client
+        gc.collect()
+        assert client_ref() is None
+        assert poller not in StatePoller._pollers.values()
+
+    def test_instance_wait_uses_description(self, ec2):
+        """EC2Instance.wait takes the polled description, no reload."""
+        instance = ec2.get_instance('i-1')
+        with Stubber(ec2.client) as stubber:
+            stubber.add_response('describe_instances', {'Reservations': [
+                {'Instances': [{
+                    'InstanceId': 'i-1', 'State': {'Name': 'running'},
+                    'PublicIpAddress': '10.0.0.1'
+                }]}
+            ]}, {'InstanceIds': ['i-1']})
+            with mock.patch.object(instance, '_wait_for_system'):
+                instance.wait()
+        assert '10.0.0.1' == instance._instance.public_ip_address
+
+
+def _describe_response(state='running', ip='10.0.0.1'):
+    """Return a DescribeInstances response for instance i-1."""
+    return {'Reservations': [{'Instances': [{
+        'InstanceId': 'i-1', 'State': {'Name': state},
+        'PublicIpAddress': ip, 'ImageId': 'ami-1',
+        'Placement': {'AvailabilityZone': 'us-east-1a'},
+    }]}]}
+
+
+class TestInstanceAttributes:
+    """Tests covering cached EC2Instance attributes."""
+
+    def test_attributes_share_one_description(self, ec2):
+        """Attributes read within attribute_ttl cost one API call."""
+        instance = ec2.get_instance('i-1')
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'describe_instances', _describe_response(),
+                {'InstanceIds': ['i-1']}
+            )
+            for _ in range(3):
+                assert '10.0.0.1' == instance.ip
+            assert 'ami-1' == instance.image_id
+            assert 'us-east-1a' == instance.availability_zone
+            stubber.assert_no_pending_responses()
+
+    @mock.patch(MPATH + 'instance.time.monotonic')
+    def test_ttl(self, m_monotonic, ec2):
+        """Descriptions expire, early while the state is changing."""
+        m_monotonic.return_value = 0
+        instance = ec2.get_instance('i-1')
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'describe_instances', _describe_response('pending', '')
+            )
+            stubber.add_response(
+                'describe_instances', _describe_response('running')
+            )
+            stubber.add_response(
+                'describe_instances', _describe_response('running', '1.2.3.4')
+            )
+            assert '' == instance.ip
+            m_monotonic.return_value = 6
+            assert '10.0.0.1' == instance.ip
+            m_monotonic.return_value = 60
+            assert '10.0.0.1' == instance.ip
+            m_monotonic.return_value = 67
+            assert '1.2.3.4' == instance.ip
+            stubber.assert_no_pending_responses()
+
+    def test_refresh_and_state_changes(self, ec2):
+        """refresh() and actions changing the state reload."""
+        instance = ec2.get_instance('i-1')
+        with Stubber(ec2.resource.meta.client) as stubber:
+            stubber.add_response(
+                'describe_instances', _describe_response()
+            )
+            stubber.add_response(
+                'describe_instances', _describe_response(ip='1.2.3.4')
+            )
+            stubber.add_response('stop_instances', {})
+            stubber.add_response(
+                'describe_instances', _describe_response('stopping', '')
+            )
+            assert '10.0.0.1' == instance.ip
+            instance.refresh()
+            assert '1.2.3.4' == instance.ip
+            instance.shutdown(wait=False)
+            assert '' == instance.ip
+            stubber.assert_no_pending_responses()
+
+
+def _reservations(*instance_ids, **kwargs):
+    """Return a DescribeInstances page of running instances."""
+    page = {'Reservations': [{'Instances': [
+        {'InstanceId': instance_id, 'State': {'Name': 'running'},
+         'PublicIpAddress': '10.0.0.%s' % instance_id[2:]}
+        for instance_id in instance_ids
+    ]}]}
+    page.update(kwargs)
+    return page
+
+
+class TestGetInstances:
+    """Tests covering EC2.get_instances and EC2.list_instances."""
+
+    @mock.patch(MPATH + 'cloud._DESCRIBE_BATCH_SIZE', 2)
+    def test_get_instances_in_batches(self, ec2):
+        """Instances come in the order asked for, fully described."""
+        with Stubber(ec2.client) as stubber:
+            stubber.add_response(
+                'describe_instances', _reservations('i-2', 'i-1'),
+                {'InstanceIds': ['i-1', 'i-2']}
+            )
+            stubber.add_response(
+                'describe_instances', _reservations('i-3'),
+                {'InstanceIds': ['i-3']}
+            )
+            instances = ec2.get_instances(['i-1', 'i-2', 'i-3'])
+            stubber.assert_no_pending_responses()
+        with Stubber(ec2.resource.meta.client):
+            assert ['10.0.0.1', '10.0.0.2', '10.0.0.3'] == [
+                instance.ip for instance in instances
+            ]
+
+    def test_unknown_instance(self, ec2):
+        """Unknown instance ids raise the EC2 error."""
+        with Stubber(ec2.client) as stubber:
+            stubber.add_client_error(
+                'describe_instances', 'InvalidInstanceID.NotFound'
+            )
+            with pytest.raises(ClientError):
+                ec2.get_instances(['i-1'])
+
+    def test_list_instances_by_tag(self, ec2):
+        """Instances are filtered by EC2 and read from every page."""
+        filters = [
+            {'Name': 'tag:Name', 'Values': ['test-*']},
+            {'Name': 'instance-state-name', 'Values': [
+                'pending', 'running', 'shutting-down', 'stopping', 'stopped'
+            ]},
+        ]
+        with Stubber(ec2.client) as stubber:
+            stubber.add_response(
+                'describe_instances', _reservations('i-1', NextToken='t'),
+                {'Filters': filters, 'MaxResults': 1000}
+            )
+            stubber.add_response(
+                'describe_instances', _reservations('i-2'),
+                {'Filters': filters, 'MaxResults': 1000, 'NextToken': 't'}
+            )
+            instances = ec2.list_instances(tag='test-*')
+        assert ['i-1', 'i-2'] == [instance.id for instance in instances]
+
+
+def _dependency_violation():
+    """Return the error EC2 raises deleting resources still in use."""
+    return ClientError(
+        {'Error': {'Code': 'DependencyViolation', 'Message': 'in use'}},
+        'DeleteSubnet'
+    )
+
+
+class TestVpcDelete:
+    """Tests covering VPC.delete."""
+
+    @pytest.fixture
+    def vpc(self):
+        """Return a VPC of mocked resources recording their deletion."""
+        deleted = []
+
+        def resource(resource_id, **attributes):
+            mocked = mock.Mock(id=resource_id, **attributes)
+            mocked.delete.side_effect = lambda: deleted.append(resource_id)
+            return mocked
+
+        aws_vpc = resource('vpc-1')
+        aws_vpc.instances.all.return_value = [
+            mock.Mock(id='i-1'), mock.Mock(id='i-2')
+        ]
+        aws_vpc.security_groups.all.return_value = [
+            resource('sg-default', group_name='default'),
+            resource('sg-1', group_name='test'),
+        ]
+        aws_vpc.subnets.all.return_value = [resource('subnet-1')]
+        aws_vpc.internet_gateways.all.return_value = [
+            resource('igw-1')
+        ]
+        aws_vpc.route_tables.all.return_value = [
+            resource('rtb-main',
+                     associations_attribute=[{'Main': True}]),
+            resource('rtb-1',
+                     associations_attribute=[{'SubnetId': 'subnet-1'}]),
+        ]
+        vpc = VPC(aws_vpc)
+        vpc.deleted = deleted
+        return vpc
+
+    @mock.patch(MPATH + 'vpc.StatePoller.for_client')
+    def test_teardown_order(self, m_for_client, vpc):
+        """Instances go at once, resources in dependency order."""
+        vpc.delete()
+        vpc.vpc.meta.client.terminate_instances.assert_called_once_with(
+            InstanceIds=['i-1', 'i-2']
+        )
+        m_for_client.return_value.wait_all.assert_called_once_with(
+            ['i-1', 'i-2'], 'terminated'
+        )
+        assert {'sg-1', 'subnet-1', 'igw-1'} == set(vpc.deleted[:3])
+        assert ['rtb-1', 'vpc-1'] == vpc.deleted[3:]
+
+    @mock.patch(MPATH + 'vpc.time.sleep')
+    @mock.patch(MPATH + 'vpc.StatePoller.for_client')
+    def test_dependency_violation_is_retried(self, m_for_client, m_sleep,
+                                             vpc):
+        """Resources still in use are deleted again after a while."""
+        subnet = vpc.vpc.subnets.all.return_value[0]
+        subnet.delete.side_effect = [_dependency_violation(), None]
+        vpc.delete()
+        assert 2 == subnet.delete.call_count
+        assert 1 == m_sleep.call_count
+        assert 'vpc-1' == vpc.deleted[-1]
+
+    @mock.patch(MPATH + 'vpc.StatePoller.for_client')
+    def test_failure_stops_teardown(self, m_for_client, vpc):
+        """Other errors are raised before later waves run."""
+        subnet = vpc.vpc.subnets.all.return_value[0]
+        subnet.delete.side_effect = ClientError(
+            {'Error': {'Code': 'UnauthorizedOperation', 'Message': 'no'}},
+            'DeleteSubnet'
+        )
+        with pytest.raises(ClientError, match='UnauthorizedOperation'):
+            vpc.delete()
+        assert {'sg-1', 'igw-1'} == set(vpc.deleted)
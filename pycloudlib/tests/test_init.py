@@ -0,0 +1,56 @@
+"""Tests related to the pycloudlib package __init__."""
+import json
+import subprocess
+import sys
+
+import pytest
+
+import pycloudlib
+
+# Cloud SDKs which must not be imported until their cloud is used
+HEAVY_MODULES = (
+    'azure',
+    'boto3',
+    'botocore',
+    'googleapiclient',
+    'knack',
+    'oci',
+    'simplestreams',
+)
+
+
+def _imported_top_level_modules(code):
+    """Run code in a fresh interpreter and return its imported modules."""
+    script = code + (
+        '\nimport json, sys\n'
+        'print(json.dumps(sorted({m.split(".")[0] for m in sys.modules})))'
+    )
+    out = subprocess.check_output([sys.executable, '-c', script])
+    return set(json.loads(out.decode().splitlines()[-1]))
+
+
+class TestLazyImport:
+    """Tests covering the cold-start import budget of pycloudlib."""
+
+    def test_import_does_not_import_cloud_sdks(self):
+        """Importing pycloudlib imports none of the cloud SDKs."""
+        modules = _imported_top_level_modules('import pycloudlib')
+        assert not modules.intersection(HEAVY_MODULES)
+
+    def test_lxd_does_not_import_cloud_sdks(self):
+        """Using LXD only imports what LXD needs."""
+        modules = _imported_top_level_modules(
+            'import pycloudlib\npycloudlib.LXD'
+        )
+        assert not modules.intersection(HEAVY_MODULES)
+
+    def test_cloud_class_is_imported_on_access(self):
+        """Cloud classes resolve to their backend module's class."""
+        from pycloudlib.lxd.cloud import LXD  # pylint: disable=C0415
+        assert LXD is pycloudlib.LXD
+        assert 'LXD' in dir(pycloudlib)
+
+    def test_unknown_attribute_raises_attribute_error(self):
+        """Names which are not clouds still raise AttributeError."""
+        with pytest.raises(AttributeError):
+            pycloudlib.NotACloud  # pylint: disable=W0104
@@ -0,0 +1,225 @@
+"""Tests related to pycloudlib.instance module."""
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mock
+
+from pycloudlib.tests.helpers import FakeChannel
+from pycloudlib.util import CancelToken
+
+# mock module path
+MPATH = "pycloudlib.instance."
+
+
+class TestExecuteStream:
+    """Tests covering execute_stream."""
+
+    def test_ssh_stream_yields_chunks_and_exit(self, instance):
+        """Output chunks are yielded as received, then the exit status."""
+        channel = FakeChannel(
+            stdout=[b'out1', b'out2'], stderr=[b'err'], exit_status=3
+        )
+        with mock.patch.object(
+            instance, '_ssh_channel', return_value=channel
+        ):
+            stream = list(instance.execute_stream('cmd', stdin='in'))
+        assert [
+            ('stderr', b'err'),
+            ('stdout', b'out1'),
+            ('stdout', b'out2'),
+            ('exit', 3),
+        ] == stream
+        assert b'in' == channel.sent
+        assert channel.closed
+
+    def test_ssh_stream_drains_output_before_eof(self, instance):
+        """Output arriving just before EOF is still yielded."""
+        class LateChannel(FakeChannel):
+            """Receive output together with EOF."""
+
+            @property
+            def eof_received(self):
+                """Turn ready with output when EOF is first checked."""
+                if not self.late_sent:
+                    self.late_sent = True
+                    self.stdout.append(b'late')
+                    self.stderr.append(b'later')
+                return True
+
+        channel = LateChannel()
+        channel.late_sent = False
+        with mock.patch.object(
+            instance, '_ssh_channel', return_value=channel
+        ):
+            stream = list(instance.execute_stream('cmd'))
+        assert [
+            ('stderr', b'later'), ('stdout', b'late'), ('exit', 0)
+        ] == stream
+
+    def test_ssh_execute_collects_stream(self, instance):
+        """execute() over SSH builds its Result from the stream."""
+        channel = FakeChannel(stdout=[b'hel', b'lo\n'], stderr=[b'warn\n'])
+        with mock.patch.object(
+            instance, '_ssh_channel', return_value=channel
+        ):
+            result = instance.execute('cmd')
+        assert 'hello' == result
+        assert 'warn' == result.stderr
+        assert 0 == result.return_code
+
+    @mock.patch(MPATH + 'subp_stream')
+    def test_lxd_stream_lines(self, m_subp_stream, instance):
+        """LXD streams through lxc exec and can be split into lines."""
+        instance._type = 'lxd'
+        m_subp_stream.return_value = iter([
+            ('stdout', b'a\nb'),
+            ('stderr', b'e1\ne'),
+            ('stdout', b'c\nd'),
+            ('exit', 1),
+        ])
+        stream = list(instance.execute_stream(['ls'], lines=True))
+        assert [
+            ('stdout', b'a\n'),
+            ('stderr', b'e1\n'),
+            ('stdout', b'bc\n'),
+            ('stdout', b'd'),
+            ('stderr', b'e'),
+            ('exit', 1),
+        ] == stream
+        m_subp_stream.assert_called_once_with(
+            ['lxc', 'exec', 'myinstance', '--', 'ls'], data=None,
+            timeout=None, cancel=None
+        )
+
+
+class TestBinaryExecute:
+    """Tests covering execute(binary=True)."""
+
+    def test_large_output_is_spooled(self, ssh_instance):
+        """Output is kept in memory up to output_spool_size bytes."""
+        ssh_instance.output_spool_size = 1024
+        with mock.patch(MPATH + 'tempfile.SpooledTemporaryFile',
+                        wraps=tempfile.SpooledTemporaryFile) as m_spool:
+            result = ssh_instance.execute(
+                "head -c 5000 /dev/zero; printf '\\377' >&2; exit 3",
+                binary=True
+            )
+        with result:
+            assert b'\0' * 5000 == result.stdout_bytes
+            assert b'\xff' == result.stderr_bytes
+            assert '\ufffd' == result.stderr
+            assert 3 == result.return_code
+        assert [mock.call(max_size=1024)] * 2 == m_spool.call_args_list
+
+
+class TestExecuteTimeout:
+    """Tests covering execute timeouts and cancellation."""
+
+    def test_timeout_returns_partial_output(self, ssh_instance):
+        """Commands past their timeout are stopped with their output."""
+        start = time.monotonic()
+        result = ssh_instance.execute('echo partial; sleep 5', timeout=0.5)
+
+        assert time.monotonic() - start < 3
+        assert 'partial' == result
+        assert result.return_code is None
+        assert result.timed_out
+        assert not result.cancelled
+        assert result.failed
+
+    def test_timeout_stops_endless_output(self, instance):
+        """Commands which never stop writing still time out."""
+        class EndlessChannel(FakeChannel):
+            """Always have more output, like 'yes'."""
+
+            def recv_ready(self):
+                """Return that stdout is pending."""
+                return True
+
+            def recv(self, _size):
+                """Return more output."""
+                return b'y\n'
+
+        channel = EndlessChannel()
+        start = time.monotonic()
+        with mock.patch.object(
+            instance, '_ssh_channel', return_value=channel
+        ):
+            result = instance.execute('yes', timeout=1)
+        assert time.monotonic() - start < 5
+        assert result.timed_out
+        assert result.stdout.startswith('y\ny')
+        assert channel.closed
+
+    def test_timeout_stops_unread_stdin(self, ssh_instance):
+        """Sending stdin nobody reads is stopped at the timeout."""
+        start = time.monotonic()
+        result = ssh_instance.execute(
+            'exec sleep 10', stdin=b'x' * (16 * 1024 * 1024), timeout=1
+        )
+        assert time.monotonic() - start < 5
+        assert result.timed_out
+
+    def test_cancel_from_other_thread(self, ssh_instance):
+        """Cancelling a token stops the command using it."""
+        token = CancelToken()
+        threading.Timer(0.3, token.cancel).start()
+        result = ssh_instance.execute('sleep 5', cancel=token, binary=True)
+
+        assert result.cancelled
+        assert not result.timed_out
+        assert result.return_code is None
+
+    def test_finished_in_time(self, ssh_instance):
+        """Commands finishing before the timeout are unaffected."""
+        result = ssh_instance.execute('echo done; exit 2', timeout=30)
+        assert ('done', 2, False) == (
+            result, result.return_code, result.timed_out
+        )
+
+
+class TestConcurrentExecute:
+    """Tests covering execute from several threads."""
+
+    def test_threads_share_one_connection(self, ssh_instance, sshd):
+        """Concurrent commands run as channels of a single connection."""
+        ssh_instance.max_channels = 3
+        commands = ['echo %d; sleep 0.05' % i for i in range(24)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(ssh_instance.execute, commands))
+
+        assert [str(i) for i in range(24)] == results
+        assert 1 == sshd.connections
+        assert 3 >= sshd.max_seen_sessions
+
+
+class TestExecuteMany:
+    """Tests covering execute_many."""
+
+    def test_results_are_separated_per_command(self, ssh_instance):
+        """Each command gets its own stdout, stderr and return code."""
+        results = ssh_instance.execute_many([
+            'echo one; echo err >&2',
+            ['printf', "%s\\n\\n", "it's two"],
+            'exit 5',
+            ['export', 'BATCH_VAR=set'],
+            'echo "${BATCH_VAR:-unset}"',
+            'head -c 3 /dev/zero',
+        ])
+        assert [
+            ('one', 'err', 0),
+            ("it's two", '', 0),
+            ('', '', 5),
+            ('', '', 0),
+            ('unset', '', 0),
+            ('\0\0\0', '', 0),
+        ] == [
+            (str(result), result.stderr, result.return_code)
+            for result in results
+        ]
+
+    def test_empty_batch(self, ssh_instance):
+        """An empty batch returns no results."""
+        assert [] == ssh_instance.execute_many([])
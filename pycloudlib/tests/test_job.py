@@ -0,0 +1,58 @@
+"""Tests related to pycloudlib.job module."""
+import mock
+
+import pytest
+
+from pycloudlib.instance import BaseInstance
+from pycloudlib.job import Job
+from pycloudlib.tests.helpers import InstanceSubclass
+
+# mock module path
+MPATH = "pycloudlib.job."
+
+
+class TestJob:
+    """Tests covering spawn() and Job."""
+
+    def test_collects_result(self, ssh_instance):
+        """Output and exit code are collected once the job is done."""
+        job = ssh_instance.spawn(
+            'echo out; echo err >&2; sleep 0.5; echo last; exit 3'
+        )
+        assert job.poll() is None
+        assert 3 == job.wait(timeout=30)
+        assert 'last' == job.tail(lines=1)
+        assert 'err' == job.tail(stderr=True)
+
+        result = job.result()
+        assert ('out\nlast', 'err', 3) == (
+            result, result.stderr, result.return_code
+        )
+        job.cleanup()
+        assert ssh_instance.execute(['test', '-e', job.path]).failed
+
+    def test_survives_dropped_connection(self, ssh_instance, sshd):
+        """Jobs keep running without a connection and are found again."""
+        job = ssh_instance.spawn(['sh', '-c', 'sleep 0.5; echo done'])
+        ssh_instance.__del__()
+        BaseInstance.ssh_connections.clear()
+
+        other = InstanceSubclass(key_pair=ssh_instance.key_pair)
+        other.ip = ssh_instance.ip
+        other.port = ssh_instance.port
+        assert 'done' == Job(other, job.pid, job.path).result(timeout=30)
+        assert 2 == sshd.connections
+
+    def test_kill_records_exit_code(self, ssh_instance):
+        """Killed jobs still record how the command ended."""
+        job = ssh_instance.spawn('sleep 30')
+        job.kill()
+        assert 143 == job.wait(timeout=30)
+
+    @mock.patch(MPATH + 'time.sleep')
+    def test_wait_timeout(self, m_sleep, instance):
+        """Jobs running past the timeout raise TimeoutError."""
+        job = Job(instance, 1, '/tmp/job')
+        with mock.patch.object(job, 'poll', return_value=None):
+            with pytest.raises(TimeoutError):
+                job.wait(timeout=0)
@@ -0,0 +1,96 @@
+"""Tests related to pycloudlib.key module."""
+import mock
+
+import paramiko
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from paramiko.ssh_exception import PasswordRequiredException
+
+from pycloudlib.key import KeyPair
+
+
+class TestPrivateKey:
+    """Tests covering KeyPair.private_key."""
+
+    @pytest.mark.parametrize('key_class,bits', (
+        (paramiko.RSAKey, 1024),
+        (paramiko.ECDSAKey, 256),
+    ))
+    def test_parses_key_once(self, key_class, bits, tmpdir):
+        """Keys are parsed on first access and kept."""
+        key = key_class.generate(bits=bits)
+        path = tmpdir.join('id').strpath
+        key.write_private_key_file(path)
+        key_pair = KeyPair(path + '.pub')
+
+        with mock.patch.object(
+            key_class, 'from_private_key_file',
+            wraps=key_class.from_private_key_file
+        ) as m_from_file:
+            assert key.get_base64() == key_pair.private_key.get_base64()
+            assert key_pair.private_key is key_pair.private_key
+        assert 1 == m_from_file.call_count
+
+    def test_ed25519_file(self, tmpdir):
+        """Ed25519 keys in OpenSSH format are parsed."""
+        key = ed25519.Ed25519PrivateKey.generate()
+        path = tmpdir.join('id_ed25519')
+        path.write_binary(key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.OpenSSH,
+            encryption_algorithm=serialization.NoEncryption()
+        ))
+        public_key = key.public_key().public_bytes(
+            encoding=serialization.Encoding.OpenSSH,
+            format=serialization.PublicFormat.OpenSSH
+        )
+
+        key_pair = KeyPair(path.strpath + '.pub')
+        assert isinstance(key_pair.private_key, paramiko.Ed25519Key)
+        assert public_key.split()[1].decode() == (
+            key_pair.private_key.get_base64()
+        )
+
+    def test_encrypted_key_raises(self, tmpdir):
+        """Keys requiring a password raise PasswordRequiredException."""
+        path = tmpdir.join('id_rsa').strpath
+        paramiko.RSAKey.generate(1024).write_private_key_file(
+            path, password='secret'
+        )
+        with pytest.raises(PasswordRequiredException):
+            KeyPair(path + '.pub').private_key
+
+    def test_unparseable_key_is_none(self, tmpdir):
+        """Files paramiko does not understand are left to connect."""
+        path = tmpdir.join('id_unknown')
+        path.write('not a key')
+        assert KeyPair(path.strpath + '.pub').private_key is None
+
+
+class TestKeyPair:
+    """Tests covering the rest of KeyPair."""
+
+    def test_public_key_content_is_read_once(self, tmpdir):
+        """The public key file is only read on first access."""
+        public_key = tmpdir.join('id_rsa.pub')
+        public_key.write('ssh-rsa AAAA test\n')
+        key_pair = KeyPair(public_key.strpath)
+
+        assert 'ssh-rsa AAAA test\n' == key_pair.public_key_content
+        public_key.remove()
+        assert 'ssh-rsa AAAA test\n' == key_pair.public_key_content
+
+    def test_generate_in_memory(self):
+        """Generated key pairs live in memory only."""
+        key_pair = KeyPair.generate(name='run')
+
+        assert 'run' == key_pair.name
+        assert key_pair.private_key_path is None
+        assert key_pair.public_key_path is None
+        assert isinstance(key_pair.private_key, paramiko.Ed25519Key)
+        assert 'ssh-ed25519 %s\n' % key_pair.private_key.get_base64() == (
+            key_pair.public_key_content
+        )
+        assert (key_pair.public_key_content !=
+                KeyPair.generate().public_key_content)
@@ -0,0 +1,30 @@
+"""Tests related to pycloudlib.result module."""
+import mmap
+import tempfile
+
+from pycloudlib.result import BytesResult
+
+
+class TestBytesResult:
+    """Tests covering BytesResult."""
+
+    def test_decodes_lazily_replacing_invalid_utf8(self):
+        """Raw bytes are kept, decoding replaces invalid sequences."""
+        result = BytesResult(b'\xff\xfeok\n', b'warn\n', 1)
+        assert b'\xff\xfeok\n' == result.stdout_bytes
+        assert '��ok' == result.stdout
+        assert 'warn' == result.stderr
+        assert result.failed
+        assert not result
+
+    def test_spooled_output_can_be_mapped(self):
+        """Output spilled to disk is usable as a file and with mmap."""
+        spool = tempfile.SpooledTemporaryFile(max_size=10)
+        spool.write(b'x' * 1000)
+        with BytesResult(spool) as result:
+            with mmap.mmap(result.stdout_file().fileno(), 0,
+                           access=mmap.ACCESS_READ) as mapped:
+                assert b'x' * 1000 == mapped[:]
+            assert b'xxx' == result.stdout_file().read(3)
+            assert result.ok
+        assert spool.closed
@@ -0,0 +1,234 @@
+"""Tests related to pycloudlib.ssh module."""
+import time
+
+import mock
+
+import paramiko
+import pytest
+
+from pycloudlib.instance import BaseInstance
+from pycloudlib.key import KeyPair
+from pycloudlib.tests.helpers import FakeChannel, InstanceSubclass
+from pycloudlib.util import Deadline
+
+# mock module path
+MPATH = "pycloudlib.ssh."
+
+
+class TestOpenChannel:
+    """Tests covering open_channel and close_channel."""
+
+    def test_slot_held_until_closed(self, instance):
+        """Channels take a max_channels slot until they are closed."""
+        instance.max_channels = 1
+        slots = instance._channel_slots
+        with mock.patch.object(
+            instance, '_ssh_channel', return_value=FakeChannel()
+        ):
+            channel = instance.open_channel('cmd')
+        assert not slots.acquire(blocking=False)
+
+        # The slot goes back where it came from
+        instance.max_channels = 2
+        instance.close_channel(channel)
+        assert channel.closed
+        assert slots.acquire(blocking=False)
+
+
+class TestConnectionSharing:
+    """Tests covering reuse of SSH connections between instances."""
+
+    def test_instances_of_one_host_share_connection(self, ssh_instance,
+                                                    sshd):
+        """Re-fetched instances reuse the cached connection."""
+        assert 'one' == ssh_instance.execute('echo one')
+        ssh_instance.__del__()
+
+        for _ in range(3):
+            inst = InstanceSubclass(key_pair=ssh_instance.key_pair)
+            inst.ip = ssh_instance.ip
+            inst.port = ssh_instance.port
+            assert 'two' == inst.execute('echo two')
+            inst.__del__()
+        assert 1 == sshd.connections
+
+    def test_different_user_connects_again(self, ssh_instance, sshd):
+        """Connections are only shared for the same user."""
+        ssh_instance.execute('true')
+        other = InstanceSubclass(key_pair=ssh_instance.key_pair)
+        other.ip = ssh_instance.ip
+        other.port = ssh_instance.port
+        other.username = 'root'
+        other.execute('true')
+        other.__del__()
+        assert 2 == sshd.connections
+
+    def test_recycled_ip_connects_again(self, ssh_instance, sshd):
+        """A new instance on a recycled IP gets its own connection."""
+        ssh_instance.execute('true')
+        ssh_instance.__del__()
+        other = InstanceSubclass(key_pair=ssh_instance.key_pair)
+        other.name = 'otherinstance'
+        other.ip = ssh_instance.ip
+        other.port = ssh_instance.port
+        other.execute('true')
+        other.__del__()
+        assert 2 == sshd.connections
+
+
+class TestSshKeys:
+    """Tests covering the key used to connect."""
+
+    def test_generated_key(self, ssh_instance, sshd):
+        """In-memory key pairs authenticate without files."""
+        ssh_instance.key_pair = KeyPair.generate()
+        sshd.authorized_keys = [ssh_instance.key_pair.private_key]
+        assert 'ok' == ssh_instance.execute('echo ok')
+
+    def test_key_is_parsed_once(self, ssh_instance):
+        """Reconnecting does not parse the key file again."""
+        with mock.patch('paramiko.ECDSAKey.from_private_key_file',
+                        wraps=paramiko.ECDSAKey.from_private_key_file
+                        ) as m_from_file:
+            for _ in range(2):
+                ssh_instance.execute('true')
+                BaseInstance.ssh_connections.clear()
+        assert 1 == m_from_file.call_count
+
+
+class TestSshReadiness:
+    """Tests covering waiting for SSH to come up."""
+
+    def test_connect_records_ready_time(self, ssh_instance):
+        """Connecting to a live server records how long it took."""
+        assert 'ok' == ssh_instance.execute('echo ok')
+        assert ssh_instance.ssh_ready_time is not None
+
+    @mock.patch(MPATH + 'time.sleep')
+    @mock.patch(MPATH + 'probe_ssh', side_effect=[False, False, True])
+    def test_wait_probes_until_banner(self, m_probe, m_sleep, instance):
+        """The port is probed with growing delays until sshd answers."""
+        instance._wait_for_ssh(instance.ip, float('inf'))
+        assert 3 == m_probe.call_count
+        first, second = [call[0][0] for call in m_sleep.call_args_list]
+        assert first <= 0.25 < second
+
+    @mock.patch(MPATH + 'time.sleep')
+    @mock.patch(MPATH + 'probe_ssh', return_value=False)
+    def test_wait_gives_up_at_deadline(self, m_probe, m_sleep, instance):
+        """No banner before the deadline raises TimeoutError."""
+        with pytest.raises(TimeoutError):
+            instance._wait_for_ssh(instance.ip, 0)
+        assert 1 == m_probe.call_count
+        assert not m_sleep.called
+
+    @mock.patch(MPATH + 'time.sleep')
+    def test_reconnect_keeps_long_delay(self, m_sleep, instance):
+        """Dropped connections are retried after 5 to 10s."""
+        client = mock.Mock()
+        with mock.patch.object(instance, '_ssh_connect', side_effect=[
+                ConnectionResetError(), ConnectionResetError(), client]):
+            instance._ssh_channel('true')
+        delays = [call[0][0] for call in m_sleep.call_args_list]
+        assert 2 == len(delays)
+        assert all(5 <= delay <= 10 for delay in delays)
+
+
+class TestSshPrewarm:
+    """Tests covering prewarm_ssh."""
+
+    def test_execute_uses_prewarmed_connection(self, ssh_instance, sshd):
+        """execute() finds the connection prewarm_ssh() opened."""
+        ssh_instance.prewarm_ssh().join(timeout=30)
+        assert 1 == sshd.connections
+        assert ssh_instance.ssh_prewarm_saved is None
+
+        assert 'ok' == ssh_instance.execute('echo ok')
+        assert 1 == sshd.connections
+        assert ssh_instance.ssh_prewarm_saved > 0
+
+    @mock.patch(MPATH + 'backoff', return_value=iter([0.01] * 100))
+    def test_waits_for_ip(self, m_backoff, ssh_instance, sshd):
+        """The connection is only attempted once the ip is known."""
+        ip = ssh_instance.ip
+        ssh_instance.ip = None
+        thread = ssh_instance.prewarm_ssh()
+        time.sleep(0.1)
+        assert 0 == sshd.connections
+        ssh_instance.ip = ip
+        thread.join(timeout=30)
+        assert 1 == sshd.connections
+
+    def test_failure_is_not_raised(self, instance):
+        """Failed attempts are left for the next execute() to retry."""
+        with mock.patch.object(instance, '_ssh_open',
+                               side_effect=paramiko.SSHException('down')):
+            instance.prewarm_ssh().join(timeout=30)
+        assert instance._ssh_prewarm_span is None
+
+    def test_foreground_waits_for_prewarm(self, ssh_instance, sshd):
+        """execute() uses the connection of a prewarm still connecting."""
+        ssh_open = ssh_instance._ssh_open
+
+        def slow_open(cancel=None):
+            """Connect only after execute() needs the connection."""
+            time.sleep(0.3)
+            return ssh_open(cancel=cancel)
+
+        with mock.patch.object(ssh_instance, '_ssh_open',
+                               side_effect=slow_open) as m_open:
+            thread = ssh_instance.prewarm_ssh()
+            time.sleep(0.1)
+            assert 'ok' == ssh_instance.execute('echo ok', timeout=10)
+            thread.join(timeout=30)
+        assert 1 == m_open.call_count
+        assert 1 == sshd.connections
+        assert 0 < ssh_instance.ssh_prewarm_saved < 0.3
+
+    def test_foreground_connects_after_failed_prewarm(self, ssh_instance,
+                                                      sshd):
+        """A prewarm failing while waited for leaves execute() to connect."""
+        ssh_open = ssh_instance._ssh_open
+
+        def failing_open(cancel=None):
+            """Fail the prewarm after execute() started waiting."""
+            if cancel is None:
+                return ssh_open()
+            time.sleep(0.3)
+            raise paramiko.SSHException('down')
+
+        with mock.patch.object(ssh_instance, '_ssh_open',
+                               side_effect=failing_open):
+            thread = ssh_instance.prewarm_ssh()
+            time.sleep(0.1)
+            assert 'ok' == ssh_instance.execute('echo ok', timeout=10)
+            thread.join(timeout=30)
+        assert 1 == sshd.connections
+        assert ssh_instance._ssh_prewarm_span is None
+
+    def test_foreground_takes_over_at_deadline(self, ssh_instance, sshd):
+        """A prewarm outlasting the deadline is cancelled, not waited on."""
+        ssh_open = ssh_instance._ssh_open
+
+        def stuck_open(cancel=None):
+            """Keep the prewarm connecting until it is cancelled."""
+            if cancel is None:
+                return ssh_open()
+            while not cancel.cancelled:
+                time.sleep(0.01)
+            raise ConnectionAbortedError('cancelled')
+
+        with mock.patch.object(ssh_instance, '_ssh_open',
+                               side_effect=stuck_open):
+            thread = ssh_instance.prewarm_ssh()
+            time.sleep(0.1)
+            assert ssh_instance._ssh_connect(Deadline(0.2)) is not None
+            thread.join(timeout=30)
+        assert not thread.is_alive()
+        assert 1 == sshd.connections
+        assert ssh_instance._ssh_prewarm_span is None
+
+    def test_lxd_does_not_prewarm(self, instance):
+        """Instances not using SSH start no thread."""
+        instance._type = 'lxd'
+        assert instance.prewarm_ssh() is None
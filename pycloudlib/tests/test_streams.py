@@ -0,0 +1,170 @@
+"""Tests related to pycloudlib.streams module."""
+import json
+
+import mock
+import pytest
+from simplestreams import filters
+
+from pycloudlib.streams import FilterMirror, IndexMirror
+
+MPATH = "pycloudlib.streams."
+
+
+def _products(content_id, region):
+    """Build a small products:1.0 tree with two releases and versions."""
+    products = {}
+    for release in ('bionic', 'focal'):
+        for arch in ('amd64', 'arm64'):
+            versions = {}
+            for serial in ('20200901', '20201001'):
+                versions[serial] = {'items': {
+                    'hvm-ssd': {
+                        'id': 'ami-%s-%s-%s' % (release, arch, serial),
+                        'region': region,
+                        'root_store': 'ssd',
+                    },
+                    'hvm-io1': {
+                        'id': 'ami-%s-%s-%s-io1' % (release, arch, serial),
+                        'region': region,
+                        'root_store': 'io1',
+                    },
+                }}
+            name = 'com.ubuntu.cloud:server:%s:%s' % (release, arch)
+            products[name] = {
+                'arch': arch, 'release': release, 'versions': versions
+            }
+    return {
+        'content_id': content_id,
+        'format': 'products:1.0',
+        'products': products,
+    }
+
+
+SOURCES = (
+    _products('com.ubuntu.cloud:released:aws', 'us-east-1'),
+    _products('com.ubuntu.cloud:released:aws-west', 'us-west-2'),
+)
+
+
+class DictMirrorReader:
+    """Mirror reader serving an index of SOURCES from memory."""
+
+    def __init__(self):
+        """Lay SOURCES out under streams/v1 like a real mirror."""
+        self.files = {'streams/v1/index.json': {
+            'format': 'index:1.0',
+            'index': {
+                src['content_id']: {
+                    'format': 'products:1.0',
+                    'path': 'streams/v1/%s.json' % src['content_id'],
+                    'products': sorted(src['products']),
+                }
+                for src in SOURCES
+            },
+        }}
+        for src in SOURCES:
+            self.files['streams/v1/%s.json' % src['content_id']] = src
+
+    def read_json(self, path):
+        """Return the raw and verified content of path."""
+        content = json.dumps(self.files[path])
+        return content, content
+
+
+def _sync(t_mirror):
+    """Sync SOURCES into a target mirror writer, as Streams._sync does."""
+    t_mirror.sync(DictMirrorReader(), 'streams/v1/index.json')
+    return t_mirror
+
+
+def _filter_mirror_query(img_filter, latest=None):
+    """Answer a query with a filtered sync."""
+    mirror = FilterMirror(
+        {'filters': filters.get_filters(img_filter), 'latest': latest}
+    )
+    return _sync(mirror).json_entries
+
+
+def _newest(entries, latest):
+    """Pick the newest entries of each product, newest first."""
+    kept = {}
+    for entry in sorted(
+        entries, key=lambda entry: entry['version_name'], reverse=True
+    ):
+        product = (entry['content_id'], entry['product_name'])
+        kept.setdefault(product, [])
+        if len(kept[product]) < latest:
+            kept[product].append(entry)
+    newest = [entry for product in kept.values() for entry in product]
+    return sorted(
+        newest, key=lambda entry: entry['version_name'], reverse=True
+    )
+
+
+LATEST_FILTERS = (
+    ['release=focal', 'arch=amd64', 'region=us-east-1', 'root_store=ssd'],
+    ['release=focal', 'root_store=io1'],
+    ['region=us-west-2'],
+    ['release=hirsute'],
+)
+
+
+class TestFilterMirror:
+    """Tests covering FilterMirror."""
+
+    @pytest.mark.parametrize('latest', (1, 2, 3))
+    @pytest.mark.parametrize('img_filter', LATEST_FILTERS)
+    def test_latest_keeps_newest_items_per_product(self, img_filter, latest):
+        """Only the newest items of each product are returned."""
+        assert _newest(_filter_mirror_query(img_filter), latest) == (
+            _filter_mirror_query(img_filter, latest=latest)
+        )
+
+    def test_latest_skips_older_items(self):
+        """Once a product is full, older items are never flattened."""
+        with mock.patch(
+            MPATH + 'filters.filter_item', wraps=filters.filter_item
+        ) as m_filter:
+            entries = _filter_mirror_query(['root_store=io1'], latest=1)
+
+        assert 8 == len(entries)
+        checked = {call[0][3] for call in m_filter.call_args_list}
+        assert 16 == len(checked)
+        assert {'20201001'} == {pedigree[1] for pedigree in checked}
+
+
+class TestImageIndex:
+    """Tests covering ImageIndex."""
+
+    @pytest.fixture
+    def index(self):
+        """Index every item of SOURCES."""
+        return _sync(IndexMirror()).index
+
+    def test_indexes_every_item(self, index):
+        """Every item is added to the index."""
+        assert 32 == len(index)
+
+    @pytest.mark.parametrize('img_filter', (
+        [],
+        ['release=focal'],
+        ['release=focal', 'arch=arm64', 'region=us-west-2'],
+        ['release=bionic', 'root_store=io1'],
+        ['release!=bionic', 'region=us-east-1'],
+        ['id~.*-20201001$', 'arch=amd64'],
+        ['content_id=com.ubuntu.cloud:released:aws'],
+        ['release=hirsute'],
+        ['ftype=', 'release=focal'],
+        ['region='],
+    ))
+    def test_query_matches_filtered_sync(self, index, img_filter):
+        """Index queries return what a filtered sync would, in order."""
+        assert _filter_mirror_query(img_filter) == index.query(img_filter)
+
+    @pytest.mark.parametrize('latest', (1, 2, 3))
+    @pytest.mark.parametrize('img_filter', LATEST_FILTERS)
+    def test_query_latest(self, index, img_filter, latest):
+        """Latest queries match the bounded filtered sync."""
+        assert _filter_mirror_query(img_filter, latest=latest) == (
+            index.query(img_filter, latest=latest)
+        )
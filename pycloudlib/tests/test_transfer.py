@@ -0,0 +1,215 @@
+"""Tests related to pycloudlib.transfer module."""
+import io
+import os
+
+import mock
+
+import pytest
+
+from pycloudlib.transfer import _split_ranges
+from pycloudlib.util import subp_stream
+
+
+def _make_tree(root):
+    """Fill root with files, directories and a symlink."""
+    root.join('top.txt').write('top\n', ensure=True)
+    root.join('sub', 'deeper', 'data.bin').write_binary(
+        bytes(range(256)) * 1000, ensure=True
+    )
+    root.join('sub', 'script.sh').write('#!/bin/sh\n')
+    root.join('sub', 'script.sh').chmod(0o755)
+    root.join('empty').ensure(dir=True)
+    root.join('link').mksymlinkto('top.txt')
+
+
+def _tree(root):
+    """Describe files, modes, contents and links below root."""
+    tree = {}
+    for path in root.visit():
+        if path.islink():
+            tree[path.relto(root)] = ('link', path.readlink())
+        elif path.isdir():
+            tree[path.relto(root)] = ('dir',)
+        else:
+            tree[path.relto(root)] = (
+                path.stat().mode, path.read_binary()
+            )
+    return tree
+
+
+class TestTreeTransfer:
+    """Tests covering push_tree and pull_tree."""
+
+    @pytest.mark.parametrize('compression', (None, 'gz', 'xz'))
+    def test_round_trip(self, ssh_instance, tmpdir, compression):
+        """Trees survive a push and a pull unchanged."""
+        local = tmpdir.join('local')
+        _make_tree(local)
+        remote = tmpdir.join('remote', 'dir')
+        pulled = tmpdir.join('pulled')
+
+        ssh_instance.push_tree(local.strpath, remote.strpath, compression)
+        ssh_instance.pull_tree(remote.strpath, pulled.strpath, compression)
+
+        assert _tree(local) == _tree(remote) == _tree(pulled)
+
+    def test_pull_missing_tree(self, ssh_instance, tmpdir):
+        """Failing to archive the remote tree raises."""
+        with pytest.raises(RuntimeError, match='Failed to pull tree'):
+            ssh_instance.pull_tree(
+                tmpdir.join('missing').strpath, tmpdir.join('out').strpath
+            )
+
+    def test_push_to_unwritable_dir(self, ssh_instance, tmpdir):
+        """Failing to unpack on the instance raises."""
+        local = tmpdir.join('local')
+        _make_tree(local)
+        blocker = tmpdir.join('file')
+        blocker.write('')
+        with pytest.raises(RuntimeError, match='Failed to push tree'):
+            ssh_instance.push_tree(
+                local.strpath, blocker.join('dir').strpath
+            )
+
+
+class TestSyncTree:
+    """Tests covering sync_tree."""
+
+    def test_only_changed_files_are_sent(self, ssh_instance, tmpdir):
+        """Unchanged files are skipped, new and modified ones sent."""
+        local = tmpdir.join('local')
+        _make_tree(local)
+        remote = tmpdir.join('remote')
+
+        first = ssh_instance.sync_tree(local.strpath, remote.strpath)
+        assert 0 == first.files_skipped
+        assert 3 == first.files_sent
+        assert _tree(local) == _tree(remote)
+
+        local.join('top.txt').write('changed\n')
+        local.join('sub', 'new.txt').write('new\n')
+        remote.join('sub', 'deeper', 'data.bin').remove()
+        second = ssh_instance.sync_tree(local.strpath, remote.strpath)
+
+        assert (3, 1, 8 + 4 + 256000, 10) == second
+        assert _tree(local) == _tree(remote)
+
+    def test_odd_names(self, ssh_instance, tmpdir):
+        """Names the remote hashing escapes are always sent."""
+        local = tmpdir.join('local')
+        for name in ('new\nline', 'back\\slash', 'sp ace', 'ünï'):
+            local.join(name).write(name, ensure=True)
+        remote = tmpdir.join('remote')
+
+        ssh_instance.sync_tree(local.strpath, remote.strpath)
+        stats = ssh_instance.sync_tree(local.strpath, remote.strpath)
+
+        assert (2, 2) == (stats.files_sent, stats.files_skipped)
+        assert _tree(local) == _tree(remote)
+
+    def test_non_utf8_names(self, ssh_instance, tmpdir):
+        """Names which are not valid UTF-8 are compared too."""
+        local = tmpdir.join('local')
+        local.ensure(dir=True)
+        name = os.path.join(os.fsencode(local.strpath), b'caf\xe9')
+        with open(name, 'wb') as local_file:
+            local_file.write(b'latin-1')
+        remote = tmpdir.join('remote')
+
+        ssh_instance.sync_tree(local.strpath, remote.strpath)
+        stats = ssh_instance.sync_tree(local.strpath, remote.strpath)
+
+        assert (0, 1) == (stats.files_sent, stats.files_skipped)
+        with open(os.path.join(os.fsencode(remote.strpath), b'caf\xe9'),
+                  'rb') as remote_file:
+            assert b'latin-1' == remote_file.read()
+
+
+class TestFileContent:
+    """Tests covering read_* and write_* file content methods."""
+
+    @pytest.fixture
+    def lxd_instance(self, instance):
+        """Return an LXD instance running lxc exec commands locally."""
+        instance._type = 'lxd'
+        with mock.patch(
+                'pycloudlib.instance.subp_stream',
+                side_effect=lambda args, **kwargs: subp_stream(
+                    args[4:], **kwargs)):
+            yield instance
+
+    @pytest.mark.parametrize('kind', ('ssh', 'lxd'))
+    def test_round_trip(self, kind, request, tmpdir):
+        """Bytes, file objects and text are written and read back."""
+        inst = request.getfixturevalue(
+            'ssh_instance' if kind == 'ssh' else 'lxd_instance'
+        )
+        path = tmpdir.join('file').strpath
+        data = bytes(range(256)) * 1000
+
+        inst.write_bytes(path, data)
+        assert data == inst.read_bytes(path)
+        inst.write_bytes(path, io.BytesIO(data[::-1]))
+        assert data[::-1] == tmpdir.join('file').read_binary()
+        inst.write_text(path, 'ünïcode\n')
+        assert 'ünïcode\n' == inst.read_text(path)
+
+    @pytest.mark.parametrize('kind', ('ssh', 'lxd'))
+    def test_missing_file(self, kind, request, tmpdir):
+        """Failures raise OSError on every backend."""
+        inst = request.getfixturevalue(
+            'ssh_instance' if kind == 'ssh' else 'lxd_instance'
+        )
+        with pytest.raises(OSError):
+            inst.read_bytes(tmpdir.join('missing').strpath)
+        with pytest.raises(OSError):
+            inst.write_bytes(tmpdir.join('missing', 'file').strpath, b'')
+
+
+class TestParallelSftp:
+    """Tests covering ranged SFTP transfers of large files."""
+
+    @pytest.fixture
+    def large_file(self, tmpdir):
+        """Write a file of odd size with position dependent content."""
+        path = tmpdir.join('large.bin')
+        path.write_binary(bytes(range(251)) * 4001)
+        return path
+
+    @pytest.mark.parametrize('size,parts,expected', (
+        (10, 3, [(0, 4), (4, 3), (7, 3)]),
+        (2, 4, [(0, 1), (1, 1)]),
+        (5, 1, [(0, 5)]),
+    ))
+    def test_split_ranges(self, size, parts, expected):
+        """Ranges are contiguous, balanced and never empty."""
+        assert expected == _split_ranges(size, parts)
+
+    def test_round_trip(self, ssh_instance, sshd, large_file, tmpdir):
+        """Ranges moved over several channels rebuild the file."""
+        ssh_instance.sftp_parallel_size = 1
+        ssh_instance.sftp_workers = 3
+        remote = tmpdir.join('remote.bin')
+        pulled = tmpdir.join('pulled.bin')
+        progress = []
+
+        ssh_instance.push_file(large_file.strpath, remote.strpath,
+                               callback=lambda *args: progress.append(args))
+        ssh_instance.pull_file(remote.strpath, pulled.strpath)
+
+        assert large_file.read_binary() == remote.read_binary()
+        assert large_file.read_binary() == pulled.read_binary()
+        assert sshd.max_seen_sessions > 2
+        size = large_file.size()
+        assert (size, size) == progress[-1]
+        assert sorted(progress) == progress
+
+    def test_small_files_use_one_channel(self, ssh_instance, large_file,
+                                         tmpdir):
+        """Files below sftp_parallel_size are moved by paramiko."""
+        remote = tmpdir.join('remote.bin')
+        with mock.patch.object(ssh_instance, '_sftp_parallel') as m_par:
+            ssh_instance.push_file(large_file.strpath, remote.strpath)
+            ssh_instance.pull_file(remote.strpath, tmpdir.join('p').strpath)
+        assert not m_par.called
+        assert large_file.read_binary() == remote.read_binary()
@@ -0,0 +1,157 @@
+"""Tests related to pycloudlib.util module."""
+import random
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from itertools import islice
+
+import pytest
+
+from pycloudlib.util import (
+    CancelToken, backoff, probe_ssh, shell_pack, shell_safe, subp_stream
+)
+
+# Characters with a meaning to sh, plus some non-ASCII ones
+SHELL_CHARS = (
+    ' \t\n\'"\\`$!#&*()[]{};:<>?|~^%=,.-_/+@' + 'abcXYZ019' + 'éß€中'
+)
+
+
+def _getopt_shell_safe(cmd):
+    """Quote cmd the way util-linux getopt does."""
+    out = subprocess.check_output(
+        ["getopt", "--shell", "sh", "--options", "", "--", "--"] + list(cmd)
+    )
+    return out.decode()[4:-1]
+
+
+def _random_commands(seed, count=50):
+    """Generate reproducible random argument lists."""
+    rand = random.Random(seed)
+    for _ in range(count):
+        yield [
+            ''.join(
+                rand.choice(SHELL_CHARS)
+                for _ in range(rand.randint(0, 12))
+            )
+            for _ in range(rand.randint(0, 6))
+        ]
+
+
+requires_getopt = pytest.mark.skipif(
+    not shutil.which('getopt') or
+    subprocess.call(['getopt', '--test'], stdout=subprocess.DEVNULL) != 4,
+    reason='requires util-linux getopt'
+)
+
+
+class TestShellSafe:
+    """Tests covering shell_safe and shell_pack."""
+
+    @pytest.mark.parametrize('cmd,expected', (
+        ([], ''),
+        ([''], "''"),
+        (['ls', '-la'], "'ls' '-la'"),
+        (["it's"], "'it'\\''s'"),
+        ([b'bytes'], "'bytes'"),
+    ))
+    def test_quotes_every_argument(self, cmd, expected):
+        """Arguments are single quoted with quotes escaped."""
+        assert expected == shell_safe(cmd)
+
+    @requires_getopt
+    @pytest.mark.parametrize('seed', range(10))
+    def test_matches_getopt(self, seed):
+        """Output is identical to getopt --shell sh."""
+        for cmd in _random_commands(seed):
+            assert _getopt_shell_safe(cmd) == shell_safe(cmd)
+
+    @pytest.mark.parametrize('seed', range(3))
+    def test_shell_pack_round_trips_through_sh(self, seed):
+        """Shell rebuilds the original argument list from shell_pack."""
+        for cmd in _random_commands(seed, count=10):
+            packed = shell_pack(['printf', '%s\\0', 'arg0'] + cmd)
+            out = subprocess.check_output(['sh', '-c', packed])
+            assert ['arg0'] + cmd == out.decode().split('\0')[:-1]
+
+
+@pytest.fixture
+def listener():
+    """Listen on a local port, greeting each client with 'banner'."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    greeting = {}
+
+    def serve():
+        conn, _addr = sock.accept()
+        with conn:
+            conn.sendall(greeting.get('banner', b''))
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield sock.getsockname()[1], greeting
+    sock.close()
+
+
+class TestBackoff:
+    """Tests covering backoff."""
+
+    def test_delays_grow_up_to_maximum(self):
+        """Each delay lies within the half to full current step."""
+        delays = list(islice(backoff(initial=1, maximum=5), 6))
+        for delay, step in zip(delays, (1, 2, 4, 5, 5, 5)):
+            assert step / 2 <= delay <= step
+
+
+class TestProbeSsh:
+    """Tests covering probe_ssh."""
+
+    def test_ssh_banner(self, listener):
+        """A server sending an SSH banner is up."""
+        port, greeting = listener
+        greeting['banner'] = b'SSH-2.0-OpenSSH_8.2\r\n'
+        assert probe_ssh('127.0.0.1', port)
+
+    def test_no_banner(self, listener):
+        """A port closing without a banner is not SSH."""
+        port, _greeting = listener
+        assert not probe_ssh('127.0.0.1', port)
+
+    def test_closed_port(self):
+        """Refused connections are not SSH."""
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            closed_port = sock.getsockname()[1]
+        assert not probe_ssh('127.0.0.1', closed_port)
+
+
+class TestSubpStream:
+    """Tests covering subp_stream."""
+
+    def test_file_object_stdin(self, tmpdir):
+        """File objects are passed to the command as its stdin."""
+        data = tmpdir.join('data')
+        data.write_binary(b'x' * 300000)
+        with open(data.strpath, 'rb') as stdin:
+            out = [chunk for name, chunk in subp_stream(
+                ['wc', '-c'], data=stdin) if name == 'stdout']
+        assert b'300000' == b''.join(out).strip()
+
+    def test_timeout_kills_process(self):
+        """Processes past their timeout are killed, output kept."""
+        start = time.monotonic()
+        stream = list(subp_stream(
+            ['sh', '-c', 'echo partial; sleep 5'], timeout=0.3
+        ))
+        assert time.monotonic() - start < 3
+        assert [('stdout', b'partial\n'), ('exit', None)] == stream
+
+    def test_cancel_kills_process(self):
+        """Cancelled tokens kill the process."""
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        assert [('exit', None)] == list(
+            subp_stream(['sleep', '5'], cancel=token)
+        )
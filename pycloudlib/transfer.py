@@ -0,0 +1,653 @@
+# This file is part of pycloudlib. See LICENSE file for license information.
+"""File and directory transfers between instances and the local host."""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import logging
+import os
+import tarfile
+import threading
+
+import paramiko
+
+from pycloudlib.util import collect_stream
+
+
+class TransferMixin:
+    """Move files and trees over SFTP and tar streams.
+
+    Mixed into BaseInstance, transfers run over its SSH connection or
+    through execute_stream() commands.
+    """
+
+    def pull_file(self, remote_path, local_path, callback=None):
+        """Copy file at 'remote_path', from instance to 'local_path'.
+
+        Files of at least sftp_parallel_size bytes are split into
+        sftp_workers ranges downloaded concurrently, each over its own
+        SFTP channel with pipelined reads.
+
+        Args:
+            remote_path: path on remote instance
+            local_path: local path
+            callback: optional, called with the bytes transferred so far
+                      and the total bytes as the transfer progresses
+        """
+        self._log.debug('pulling file %s to %s', remote_path, local_path)
+
+        sftp = self._sftp_connect()
+        size = sftp.stat(remote_path).st_size
+        if size < self.sftp_parallel_size or self.sftp_workers < 2:
+            sftp.get(remote_path, local_path, callback=callback)
+            return
+
+        with open(local_path, 'wb') as local_file:
+            local_file.truncate(size)
+        self._sftp_parallel(
+            self._pull_range, remote_path, local_path, size, callback
+        )
+        if os.path.getsize(local_path) != size:
+            raise IOError(
+                'size mismatch in get! {} != {}'.format(
+                    os.path.getsize(local_path), size
+                )
+            )
+
+    def push_file(self, local_path, remote_path, callback=None):
+        """Copy file at 'local_path' to instance at 'remote_path'.
+
+        Files of at least sftp_parallel_size bytes are split into
+        sftp_workers ranges uploaded concurrently, each over its own
+        SFTP channel with pipelined writes.
+
+        Args:
+            local_path: local path
+            remote_path: path on remote instance
+            callback: optional, called with the bytes transferred so far
+                      and the total bytes as the transfer progresses
+        """
+        self._log.debug('pushing file %s to %s', local_path, remote_path)
+
+        sftp = self._sftp_connect()
+        size = os.path.getsize(local_path)
+        if size < self.sftp_parallel_size or self.sftp_workers < 2:
+            sftp.put(local_path, remote_path, callback=callback)
+            return
+
+        sftp.open(remote_path, 'wb').close()
+        self._sftp_parallel(
+            self._push_range, local_path, remote_path, size, callback
+        )
+        remote_size = sftp.stat(remote_path).st_size
+        if remote_size != size:
+            raise IOError(
+                'size mismatch in put! {} != {}'.format(remote_size, size)
+            )
+
+    def pull_tree(self, remote_dir, local_dir, compression=None):
+        """Copy directory 'remote_dir' from instance into 'local_dir'.
+
+        The tree is streamed as a tar archive through a single command
+        on the instance and unpacked while it arrives, so neither side
+        writes the archive to disk.
+
+        Args:
+            remote_dir: directory on remote instance
+            local_dir: local directory, created if missing
+            compression: optional, 'gz', 'bz2' or 'xz' to compress the
+                         stream with
+        """
+        self._log.debug('pulling tree %s to %s', remote_dir, local_dir)
+        flag = _TAR_COMPRESSION[compression]
+
+        os.makedirs(local_dir, exist_ok=True)
+        output = _StreamReader(self.execute_stream(
+            ['sh', '-c', 'exec tar -c%sf - -C "$1" .' % flag,
+             'pull_tree', remote_dir],
+            description='pulling tree %s' % remote_dir
+        ))
+        error = None
+        try:
+            with tarfile.open(
+                    fileobj=output, mode='r|' + (compression or '')) as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(local_dir, filter='data')
+                else:
+                    tar.extractall(local_dir)
+        except tarfile.TarError as e:
+            # Most likely a truncated stream, the exit code tells why
+            error = e
+        finally:
+            output.close()
+        if output.return_code != 0:
+            raise RuntimeError(
+                'Failed to pull tree %s (rc=%s): %s' % (
+                    remote_dir, output.return_code, output.stderr
+                )
+            )
+        if error:
+            raise error
+
+    def push_tree(self, local_dir, remote_dir, compression=None):
+        """Copy directory 'local_dir' to instance into 'remote_dir'.
+
+        The tree is streamed as a tar archive through a single command
+        on the instance and unpacked while it arrives, so neither side
+        writes the archive to disk.
+
+        Args:
+            local_dir: local directory
+            remote_dir: directory on remote instance, created if missing
+            compression: optional, 'gz', 'bz2' or 'xz' to compress the
+                         stream with
+        """
+        self._log.debug('pushing tree %s to %s', local_dir, remote_dir)
+        self._push_archive(local_dir, remote_dir, compression)
+
+    def sync_tree(self, local_dir, remote_dir, compression=None):
+        """Copy only changed files of 'local_dir' into 'remote_dir'.
+
+        Files are compared by SHA-256 of their content. The hashes of
+        the remote copies are computed on the instance in one command,
+        while the local ones are computed, and only files whose content
+        differs or which are missing are pushed, like push_tree() does.
+        Directories and symlinks are always pushed, remote files missing
+        locally are kept.
+
+        Args:
+            local_dir: local directory
+            remote_dir: directory on remote instance, created if missing
+            compression: optional, 'gz', 'bz2' or 'xz' to compress the
+                         stream with
+
+        Returns:
+            SyncStats of the files and bytes pushed and skipped
+
+        """
+        self._log.debug('syncing tree %s to %s', local_dir, remote_dir)
+        dirs, links, files = _list_tree(local_dir)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            remote = executor.submit(self._remote_hashes, remote_dir, files)
+            local_hashes = [
+                _sha256(os.path.join(local_dir, name)) for name in files
+            ]
+            remote_hashes = remote.result()
+
+        changed, stats = _compare_tree(
+            local_dir, dict(zip(files, local_hashes)), remote_hashes
+        )
+        self._push_archive(
+            local_dir, remote_dir, compression,
+            names=dirs + links + changed
+        )
+        self._log.debug('synced tree %s to %s: %s', local_dir, remote_dir,
+                        stats)
+        return stats
+
+    def read_bytes(self, remote_path):
+        """Read the content of file 'remote_path' on the instance.
+
+        The content is read straight into memory, over SFTP with
+        prefetching or from the output of 'cat' on LXD and KVM.
+
+        Args:
+            remote_path: path on remote instance
+
+        Returns:
+            bytes content of the file
+
+        Raises:
+            OSError: the file could not be read
+
+        """
+        self._log.debug('reading file %s', remote_path)
+        if self._type in ('lxd', 'kvm'):
+            return self._exec_file(['cat', '--', remote_path], remote_path)
+
+        sftp = self._sftp_connect()
+        with sftp.open(remote_path, 'rb') as remote_file:
+            remote_file.prefetch()
+            return remote_file.read()
+
+    def read_text(self, remote_path, encoding='utf-8'):
+        """Read the content of text file 'remote_path' on the instance.
+
+        Args:
+            remote_path: path on remote instance
+            encoding: encoding of the file
+
+        Returns:
+            string content of the file
+
+        Raises:
+            OSError: the file could not be read
+
+        """
+        return self.read_bytes(remote_path).decode(encoding)
+
+    def write_bytes(self, remote_path, data):
+        """Write data to file 'remote_path' on the instance.
+
+        The file is created or truncated. Data is written over SFTP with
+        pipelined writes or through the stdin of 'cat' on LXD and KVM,
+        file objects are read as the transfer goes.
+
+        Args:
+            remote_path: path on remote instance
+            data: bytes or binary file object to write
+
+        Raises:
+            OSError: the file could not be written
+
+        """
+        self._log.debug('writing file %s', remote_path)
+        if self._type in ('lxd', 'kvm'):
+            self._exec_file(
+                ['sh', '-c', 'cat > "$1"', 'write_bytes', remote_path],
+                remote_path, stdin=data
+            )
+            return
+
+        sftp = self._sftp_connect()
+        with sftp.open(remote_path, 'wb') as remote_file:
+            remote_file.set_pipelined(True)
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                remote_file.write(data)
+                return
+            for block in iter(lambda: data.read(_SFTP_BLOCK_SIZE), b''):
+                remote_file.write(block)
+
+    def write_text(self, remote_path, text, encoding='utf-8'):
+        """Write text to file 'remote_path' on the instance.
+
+        Args:
+            remote_path: path on remote instance
+            text: string to write
+            encoding: encoding of the file
+
+        Raises:
+            OSError: the file could not be written
+
+        """
+        self.write_bytes(remote_path, text.encode(encoding))
+
+    def _push_archive(self, local_dir, remote_dir, compression=None,
+                      names=None):
+        """Stream a tar archive of local_dir into remote_dir.
+
+        Args:
+            local_dir: local directory
+            remote_dir: directory on remote instance, created if missing
+            compression: optional, 'gz', 'bz2' or 'xz'
+            names: optional, list of paths relative to local_dir to
+                   archive non-recursively instead of the whole tree
+        """
+        flag = _TAR_COMPRESSION[compression]
+
+        archive = _TarProducer(local_dir, compression, names)
+        try:
+            _, err, return_code = collect_stream(self.execute_stream(
+                ['sh', '-c', 'mkdir -p "$1" && exec tar -x%sf - -C "$1"'
+                 % flag, 'push_tree', remote_dir],
+                stdin=archive.reader,
+                description='pushing tree %s' % local_dir
+            ))
+        finally:
+            archive.close()
+
+        if return_code != 0:
+            raise RuntimeError(
+                'Failed to push tree %s (rc=%s): %s' % (
+                    local_dir, return_code, err.decode('utf-8', 'replace')
+                )
+            )
+        if archive.error:
+            raise archive.error
+
+    def _remote_hashes(self, remote_dir, names):
+        """Hash files below remote_dir on the instance.
+
+        Args:
+            remote_dir: directory on remote instance
+            names: list of paths relative to remote_dir
+
+        Returns:
+            dictionary of SHA-256 hex digests by path, without the paths
+            which do not exist or cannot be read
+
+        """
+        if not names:
+            return {}
+        out = []
+        for name, data in self.execute_stream(
+                ['sh', '-c',
+                 'cd "$1" 2>/dev/null || exit 0; '
+                 'xargs -0 sha256sum -- 2>/dev/null; exit 0',
+                 'sync_tree', remote_dir],
+                stdin=b'\0'.join(os.fsencode(name) for name in names),
+                description='hashing tree %s' % remote_dir):
+            if name == 'stdout':
+                out.append(data)
+        hashes = {}
+        for line in b''.join(out).splitlines():
+            # Names with a newline or backslash come escaped, which
+            # leaves them unmatched and so pushed
+            digest, _, name = line.partition(b'  ')
+            if name and not digest.startswith(b'\\'):
+                # Decoded like os.walk() decodes the local names
+                hashes[os.fsdecode(name)] = digest.decode('ascii')
+        return hashes
+
+    def _exec_file(self, command, remote_path, stdin=None):
+        """Run a file access command, raising OSError on failure.
+
+        Args:
+            command: list, command reading or writing remote_path
+            remote_path: path on remote instance, for the error
+            stdin: optional, bytes or binary file object for the command
+
+        Returns:
+            bytes output of the command
+
+        """
+        out, err, return_code = collect_stream(
+            self.execute_stream(command, stdin=stdin)
+        )
+        if return_code != 0:
+            raise OSError('Failed to access {}: {}'.format(
+                remote_path, err.decode('utf-8', 'replace')
+            ))
+        return out
+
+    def _sftp_connect(self):
+        """Connect to instance via SFTP."""
+        with self._ssh_lock:
+            if (self._sftp_client and self._sftp_client.get_channel()
+                    .get_transport().is_active()):
+                return self._sftp_client
+
+            logging.getLogger("paramiko").setLevel(logging.INFO)
+
+            # _ssh_connect() implements the required retry logic.
+            sftpclient = self._sftp_open()
+            self._sftp_client = sftpclient
+            return sftpclient
+
+    def _sftp_open(self):
+        """Open a new SFTP channel on the shared SSH connection.
+
+        Returns:
+            paramiko SFTPClient using sftp_window_size and
+            sftp_max_packet_size
+
+        """
+        return paramiko.SFTPClient.from_transport(
+            self._ssh_connect().get_transport(),
+            window_size=self.sftp_window_size,
+            max_packet_size=self.sftp_max_packet_size
+        )
+
+    def _sftp_parallel(self, transfer, source, target, size, callback):
+        """Transfer ranges of a file concurrently.
+
+        Args:
+            transfer: method moving one range, _pull_range or _push_range
+            source: path to read from
+            target: path to write to, must exist
+            size: size of the file in bytes
+            callback: optional progress callback, see push_file()
+        """
+        lock = threading.Lock()
+        done = [0]
+
+        def progress(count):
+            with lock:
+                done[0] += count
+                if callback:
+                    callback(done[0], size)
+
+        def worker(offset, length):
+            with self._channel_slots:
+                sftp = self._sftp_open()
+                try:
+                    transfer(sftp, source, target, offset, length, progress)
+                finally:
+                    sftp.close()
+
+        ranges = _split_ranges(size, self.sftp_workers)
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(worker, offset, length)
+                       for offset, length in ranges]
+            for future in futures:
+                future.result()
+
+    @staticmethod
+    def _pull_range(sftp, remote_path, local_path, offset, length,
+                    progress):
+        """Download one range of a file with prefetched reads."""
+        chunks = [
+            (offset + start, min(_SFTP_BLOCK_SIZE, length - start))
+            for start in range(0, length, _SFTP_BLOCK_SIZE)
+        ]
+        with sftp.open(remote_path, 'rb') as remote_file, \
+                open(local_path, 'r+b') as local_file:
+            local_file.seek(offset)
+            for data in remote_file.readv(chunks):
+                local_file.write(data)
+                progress(len(data))
+
+    @staticmethod
+    def _push_range(sftp, local_path, remote_path, offset, length,
+                    progress):
+        """Upload one range of a file with pipelined writes."""
+        with open(local_path, 'rb') as local_file, \
+                sftp.open(remote_path, 'r+b') as remote_file:
+            local_file.seek(offset)
+            remote_file.seek(offset)
+            remote_file.set_pipelined(True)
+            while length:
+                data = local_file.read(min(length, _SFTP_BLOCK_SIZE))
+                if not data:
+                    raise IOError(
+                        'File %s shrank during upload' % local_path
+                    )
+                remote_file.write(data)
+                length -= len(data)
+                progress(len(data))
+
+
+SyncStats = namedtuple(
+    'SyncStats', 'files_sent files_skipped bytes_sent bytes_skipped'
+)
+SyncStats.__doc__ = """Files and bytes pushed and skipped by sync_tree()."""
+
+# Bytes per SFTP request of parallel transfers, as in paramiko
+_SFTP_BLOCK_SIZE = 32768
+
+# tar command line flag for each tarfile compression
+_TAR_COMPRESSION = {None: '', 'gz': 'z', 'bz2': 'j', 'xz': 'J'}
+
+
+class _TarProducer:
+    """Write a tar archive of a directory into a pipe from a thread.
+
+    Attributes:
+        reader: binary file object to read the archive from
+        error: exception raised while archiving, if any
+    """
+
+    def __init__(self, local_dir, compression=None, names=None):
+        """Start archiving.
+
+        Args:
+            local_dir: directory to archive, entries are relative to it
+            compression: optional, tarfile compression to apply
+            names: optional, list of paths relative to local_dir to
+                   archive non-recursively instead of the whole tree
+        """
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, 'rb')
+        self.error = None
+        self._writer = os.fdopen(write_fd, 'wb')
+        self._thread = threading.Thread(
+            target=self._produce, args=(local_dir, compression, names),
+            daemon=True
+        )
+        self._thread.start()
+
+    def _produce(self, local_dir, compression, names):
+        """Archive local_dir into the pipe."""
+        try:
+            with self._writer, tarfile.open(
+                    fileobj=self._writer,
+                    mode='w|' + (compression or '')) as tar:
+                if names is None:
+                    tar.add(local_dir, arcname='.')
+                for name in names or ():
+                    tar.add(os.path.join(local_dir, name), arcname=name,
+                            recursive=False)
+        except BrokenPipeError:
+            # The command stopped reading, its exit code tells why
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            self.error = e
+
+    def close(self):
+        """Stop reading and wait for the thread to finish."""
+        self.reader.close()
+        self._thread.join()
+
+
+class _StreamReader(io.RawIOBase):
+    """Binary file object reading stdout of an execute_stream() stream.
+
+    Attributes:
+        return_code: exit code of the command once it finished
+        stderr: string, collected stderr once the command finished
+    """
+
+    def __init__(self, stream):
+        """Wrap stream."""
+        super().__init__()
+        self._stream = stream
+        self._buffer = b''
+        self._err = []
+        self.return_code = None
+        self.stderr = ''
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def readinto(self, buffer):
+        """Read the next stdout bytes into buffer."""
+        while not self._buffer and self.return_code is None:
+            self._next()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        """Drain the rest of the stream."""
+        while self.return_code is None:
+            self._next()
+        super().close()
+
+    def _next(self):
+        """Consume the next chunk of the stream."""
+        name, data = next(self._stream)
+        if name == 'stdout':
+            self._buffer += data
+        elif name == 'stderr':
+            self._err.append(data)
+        else:
+            self.return_code = data
+            self.stderr = b''.join(self._err).decode('utf-8', 'replace')
+
+
+def _compare_tree(local_dir, local_hashes, remote_hashes):
+    """Return the files of local_dir whose remote copy differs.
+
+    Args:
+        local_dir: local directory the files are relative to
+        local_hashes: dict of relative file path to local SHA-256
+        remote_hashes: dict of relative file path to remote SHA-256
+
+    Returns:
+        tuple of the list of changed files and their SyncStats
+
+    """
+    changed = []
+    stats = {'files_sent': 0, 'files_skipped': 0,
+             'bytes_sent': 0, 'bytes_skipped': 0}
+    for name, digest in local_hashes.items():
+        size = os.path.getsize(os.path.join(local_dir, name))
+        if remote_hashes.get(name) == digest:
+            stats['files_skipped'] += 1
+            stats['bytes_skipped'] += size
+        else:
+            changed.append(name)
+            stats['files_sent'] += 1
+            stats['bytes_sent'] += size
+    return changed, SyncStats(**stats)
+
+
+def _list_tree(local_dir):
+    """List the entries of a local tree by kind.
+
+    Args:
+        local_dir: directory to list
+
+    Returns:
+        tuple of sorted lists of the directories, symlinks and regular
+        files below local_dir, as paths relative to it
+
+    """
+    dirs, links, files = [], [], []
+    for root, dirnames, filenames in os.walk(local_dir):
+        for name in dirnames + filenames:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, local_dir)
+            if os.path.islink(path):
+                links.append(relative)
+            elif name in dirnames:
+                dirs.append(relative)
+            else:
+                files.append(relative)
+    return sorted(dirs), sorted(links), sorted(files)
+
+
+def _sha256(path):
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _split_ranges(size, parts):
+    """Split size bytes into at most parts contiguous ranges.
+
+    Args:
+        size: number of bytes
+        parts: number of ranges wanted
+
+    Returns:
+        list of (offset, length) tuples covering all bytes
+
+    """
+    parts = max(1, min(parts, size))
+    step, extra = divmod(size, parts)
+    ranges = []
+    offset = 0
+    for part in range(parts):
+        length = step + (1 if part < extra else 0)
+        if length:
+            ranges.append((offset, length))
+        offset += length
+    return ranges
@@ -6,10 +6,15 @@ import datetime
 from errno import ENOENT
 import platform
 import os
+import random
 import re
+import selectors
 import shlex
+import socket
 import subprocess
 import tempfile
+import threading
+import time
 
 from pycloudlib.result import Result
 
@@ -21,6 +26,93 @@ UBUNTU_RELEASE_VERSION_MAP = {
 }
 
 
+class CancelToken:
+    """Stop running commands from another thread.
+
+    Pass the token as 'cancel' to BaseInstance.execute() and friends,
+    then call cancel() to stop every command using it.
+    """
+
+    def __init__(self):
+        """Initialize an uncancelled token."""
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Stop the commands using this token."""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """Return boolean if cancel() was called."""
+        return self._event.is_set()
+
+
+class Deadline:
+    """Point in time at which a command is stopped.
+
+    Combines an optional timeout and an optional CancelToken, which is
+    polled while waiting.
+    """
+
+    # seconds between checks of the CancelToken
+    poll_interval = 0.1
+
+    def __init__(self, timeout=None, cancel=None):
+        """Start counting.
+
+        Args:
+            timeout: optional, seconds until the deadline
+            cancel: optional, CancelToken moving the deadline to now
+        """
+        self._end = None if timeout is None else time.monotonic() + timeout
+        self._cancel = cancel
+
+    def expired(self):
+        """Return boolean if the deadline passed or was cancelled."""
+        if self._cancel is not None and self._cancel.cancelled:
+            return True
+        return self._end is not None and time.monotonic() >= self._end
+
+    def wait(self, maximum=None):
+        """Return the seconds to block at most before checking again.
+
+        Args:
+            maximum: optional, upper bound of the wait
+
+        Returns:
+            seconds as float, or None to block indefinitely
+
+        """
+        waits = [maximum]
+        if self._end is not None:
+            waits.append(max(0, self._end - time.monotonic()))
+        if self._cancel is not None:
+            waits.append(self.poll_interval)
+        waits = [wait for wait in waits if wait is not None]
+        return min(waits) if waits else None
+
+
+def backoff(initial=0.5, maximum=10, factor=2):
+    """Generate exponentially growing, jittered delays.
+
+    Each delay is picked at random between half and all of the current
+    step, so concurrent waiters do not retry in lockstep.
+
+    Args:
+        initial: seconds of the first step
+        maximum: cap of a step in seconds
+        factor: growth of a step after each delay
+
+    Yields:
+        float seconds to sleep
+
+    """
+    step = initial
+    while True:
+        yield random.uniform(step / 2, step)
+        step = min(step * factor, maximum)
+
+
 def chmod(path, mode):
     """Run chmod on a file or directory.
 
@@ -33,6 +125,29 @@ def chmod(path, mode):
         os.chmod(path, real_mode)
 
 
+def collect_stream(stream):
+    """Collect the output of a subp_stream() or execute_stream() stream.
+
+    Args:
+        stream: iterable of (name, data) tuples
+
+    Returns:
+        tuple of stdout bytes, stderr bytes and the return code
+
+    """
+    out = []
+    err = []
+    return_code = None
+    for name, data in stream:
+        if name == 'stdout':
+            out.append(data)
+        elif name == 'stderr':
+            err.append(data)
+        else:
+            return_code = data
+    return b''.join(out), b''.join(err), return_code
+
+
 def is_writable_dir(path):
     """Make sure dir is writable.
 
@@ -64,6 +179,34 @@ def mkdtemp(prefix='pycloudlib'):
     return tempfile.mkdtemp(prefix=prefix)
 
 
+def probe_ssh(host, port, timeout=1):
+    """Check whether an SSH server answers on host and port.
+
+    Opens a plain TCP connection and waits for the SSH identification
+    banner, which is much cheaper than a full SSH handshake.
+
+    Args:
+        host: string, address to probe
+        port: int, port to probe
+        timeout: seconds to wait for the connection and banner
+
+    Returns:
+        boolean, True if an SSH banner was received
+
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            banner = b''
+            while b'\n' not in banner and len(banner) < 1024:
+                data = sock.recv(256)
+                if not data:
+                    break
+                banner += data
+    except OSError:
+        return False
+    return banner.startswith(b'SSH-')
+
+
 def rmfile(path):
     """Delete a file.
 
@@ -124,10 +267,10 @@ def shell_safe(cmd):
     Create a string that can be passed to $(set -- <string>) to produce
     the same array that cmd represents.
 
-    Internally we utilize 'getopt's ability/knowledge on how to quote
-    strings to be safe for shell.  This implementation could be changed
-    to be pure python.  It is just a matter of correctly escaping
-    or quoting characters like: ' " ^ & $ ; ( ) ...
+    Each argument is wrapped in single quotes, embedded single quotes
+    close the quoting, get escaped and reopen it. This is byte for byte
+    what 'getopt --shell sh' produces, without forking a getopt process
+    for every command.
 
     Args:
         cmd: command as a list
@@ -136,11 +279,9 @@ def shell_safe(cmd):
         shell safe string
 
     """
-    out = subprocess.check_output(
-        ["getopt", "--shell", "sh", "--options", "", "--", "--"] + list(cmd))
-
-    # out contains ' -- <data>\n'. drop the ' -- ' and the '\n'
-    return out.decode()[4:-1]
+    return ' '.join(
+        "'%s'" % _to_str(arg).replace("'", "'\\''") for arg in cmd
+    )
 
 
 def subp(args, data=None, env=None, shell=False, rcs=(0,),
@@ -202,6 +343,155 @@ def subp(args, data=None, env=None, shell=False, rcs=(0,),
     return Result(out, err, rc)
 
 
+def subp_stream(args, data=None, env=None, shortcircuit_stdin=True,
+                chunk_size=65536, timeout=None, cancel=None):
+    """Subprocess wrapper yielding output as the process produces it.
+
+    stdin, stdout and stderr are multiplexed with a selector, so neither
+    the output nor the input is ever held fully in memory.
+
+    Args:
+        args: command to run
+        data: data to pass on stdin, or a binary file object. Objects
+              with a file descriptor are used as stdin directly, others
+              are read as the process consumes them
+        env: optional env to use
+        shortcircuit_stdin: bind stdin to /dev/null if no data is given
+        chunk_size: maximum number of bytes per yielded chunk
+        timeout: optional, seconds after which the process is killed
+        cancel: optional, CancelToken killing the process once cancelled
+
+    Yields:
+        ('stdout', bytes) and ('stderr', bytes) tuples as output arrives,
+        followed by a final ('exit', return_code) tuple, return_code
+        being None if the process was killed by timeout or cancel
+
+    """
+    deadline = Deadline(timeout, cancel)
+    stdin, feeder = _stream_stdin(data, shortcircuit_stdin, chunk_size)
+    process = subprocess.Popen(
+        _convert_args(args), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, stdin=stdin, env=env
+    )
+
+    with process, selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ, 'stdout')
+        selector.register(process.stderr, selectors.EVENT_READ, 'stderr')
+        if feeder:
+            feeder.start(process.stdin, selector)
+
+        try:
+            while selector.get_map():
+                if deadline.expired():
+                    process.kill()
+                    yield 'exit', None
+                    return
+                for key, _events in selector.select(deadline.wait()):
+                    if key.data is feeder:
+                        feeder.write(selector)
+                        continue
+                    chunk = os.read(key.fd, chunk_size)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    yield key.data, chunk
+
+            yield 'exit', process.wait()
+        finally:
+            # The consumer stopped early, do not leave the command running
+            if process.poll() is None:
+                process.kill()
+
+
+def _stream_stdin(data, shortcircuit_stdin, chunk_size):
+    """Pick the stdin of a subp_stream() process.
+
+    Args:
+        data: data argument of subp_stream()
+        shortcircuit_stdin: bind stdin to /dev/null if no data is given
+        chunk_size: maximum number of bytes written at a time
+
+    Returns:
+        tuple of the Popen stdin argument and the _StdinFeeder writing
+        to the stdin pipe, or None without a pipe
+
+    """
+    if _has_fileno(data):
+        return data, None
+    if hasattr(data, 'read'):
+        return subprocess.PIPE, _StdinFeeder(b'', data, chunk_size)
+    if data is not None:
+        if not isinstance(data, bytes):
+            data = data.encode()
+        return subprocess.PIPE, _StdinFeeder(data, None, chunk_size)
+    if shortcircuit_stdin:
+        return subprocess.DEVNULL, None
+    return None, None
+
+
+class _StdinFeeder:
+    """Write data to a process stdin pipe whenever it is writable."""
+
+    def __init__(self, data, reader, chunk_size):
+        """Initialize feeder.
+
+        Args:
+            data: bytes to write
+            reader: optional, binary file object to write after data
+            chunk_size: maximum number of bytes written at a time
+        """
+        self._view = memoryview(data)
+        self._reader = reader
+        self._chunk_size = chunk_size
+        self._pipe = None
+
+    def start(self, pipe, selector):
+        """Register pipe for writing, or close it if there is no input.
+
+        Args:
+            pipe: stdin pipe of the process
+            selector: selector the pipe is registered with
+        """
+        self._pipe = pipe
+        if self._view or self._reader:
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_WRITE, self)
+        else:
+            pipe.close()
+
+    def write(self, selector):
+        """Write the next chunk, closing the pipe once all is written.
+
+        Args:
+            selector: selector the pipe is registered with
+        """
+        if not self._view and self._reader:
+            self._view = memoryview(self._reader.read(self._chunk_size))
+        try:
+            written = os.write(
+                self._pipe.fileno(), self._view[:self._chunk_size]
+            )
+        except BlockingIOError:
+            written = 0
+        except BrokenPipeError:
+            # The process stopped reading, drop the rest
+            written = len(self._view)
+            self._reader = None
+        self._view = self._view[written:]
+        if not self._view and not (self._reader and written):
+            selector.unregister(self._pipe)
+            self._pipe.close()
+
+
+def _has_fileno(stream):
+    """Check whether stream is backed by a file descriptor."""
+    try:
+        stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
 def touch(path, mode=None):
     """Ensure a directory exists with a specific mode, it not create it.
 
@@ -275,6 +565,21 @@ def _convert_args(args):
     return bytes_args
 
 
+def _to_str(value):
+    """Return value as a string, decoding bytes as UTF-8.
+
+    Args:
+        value: string or bytes
+
+    Returns:
+        string
+
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
 def _safe_int(possible_int):
     """Create an int as safely as possbile.
 